@@ -0,0 +1,251 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import time
+import numpy as np
+
+import Boid as boid_module
+import BoidNumpy as boid_numpy_module
+from Flock import Flock
+from ParallelFlock import ParallelFlock
+
+'''
+=====================================================
+    BENCHMARK OF THE ENGINES: ms PER STEP SPLIT BY PHASE
+=====================================================
+'''
+COUNTS: tuple = (100, 1000, 10000, 100000)
+LAYOUTS: tuple = ('uniform', 'clustered', 'streaming')
+# Every on/off combination of Separation, Alignment and Cohesion, as 'SAC' letters ('' = no rules)
+RULES: tuple = tuple(''.join(letter for letter, on in zip('SAC', flags) if on)
+                     for flags in itertools.product((False, True), repeat=3))
+PHASES: tuple = ('neighbours', 'rules', 'integration', 'total')
+# The per boid engines are too slow for the big counts, cases above this are skipped
+MAX_OBJECT_BOIDS: int = 2000
+
+
+class ObjectEngine:
+    """
+    A list of Boid objects (Boid.py or BoidNumpy.py) sharing a BOIDS_MATRIX, stepped as init.py used to.
+    Neighbour search happens inside boid_movement, so its time is reported with the rules.
+    """
+    def __init__(self, module, positions: np.ndarray, velocities: np.ndarray, rules: str,
+                 width: int, height: int, seed: int = None):
+        self.module = module
+        module.set_seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.set_resolution(width, height)
+        self.matrix = [[[] for _ in range(module.CELS_PER_AXIS)] for _ in range(module.CELS_PER_AXIS)]
+
+        self.boids = []
+        for (x, y), direction in zip(positions.tolist(), velocities.tolist()):
+            boid = module.Boid(x=x, y=y, matrix=self.matrix)
+            boid.set_direction(direction)
+            boid.switch_separation('S' in rules)
+            boid.switch_alignment('A' in rules)
+            boid.switch_cohesion('C' in rules)
+            self.boids.append(boid)
+
+    def step(self, deltaTime: float) -> dict:
+        moveTime: list = [0.0]
+        move = self.module.Boid.move
+
+        def timed_move(boid, *args, **kwargs):
+            start: float = time.perf_counter()
+            move(boid, *args, **kwargs)
+            moveTime[0] += time.perf_counter() - start
+
+        self.module.Boid.move = timed_move
+        try:
+            start: float = time.perf_counter()
+            for boid in self.boids:
+                boid.boid_movement(deltaTime)
+            total: float = time.perf_counter() - start
+        finally:
+            self.module.Boid.move = move
+        return {'neighbours': None, 'rules': total - moveTime[0], 'integration': moveTime[0]}
+
+
+class FlockEngine:
+    def __init__(self, backend: str, positions: np.ndarray, velocities: np.ndarray, rules: str,
+                 width: int, height: int, seed: int = None, workers: int = None, jit: bool = False,
+                 far_field: bool = False, stencil_sums: bool = False, neighbour_limit: int = None):
+        self.flock = Flock(width, height, rng=np.random.default_rng(seed), backend=backend,
+                           workers=workers, jit=jit, far_field=far_field, stencil_sums=stencil_sums,
+                           neighbour_limit=neighbour_limit)
+        self.flock.add(positions, velocities,
+                       separation='S' in rules, alignment='A' in rules, cohesion='C' in rules)
+
+    def step(self, deltaTime: float) -> dict:
+        self.flock.step(deltaTime)
+        return dict(self.flock.step_times)
+
+    def close(self) -> None:
+        self.flock.close()
+
+
+class ParallelEngine(FlockEngine):
+    def __init__(self, *args, seed: int = None, **kwargs):
+        super().__init__('grid', *args, seed=seed, **kwargs)
+        self.flock = ParallelFlock(self.flock, seed=seed)
+
+
+# Neighbours of the flock-knn engine
+KNN: int = 7
+
+ENGINES: dict = {
+    'python': lambda *args, **kwargs: ObjectEngine(boid_module, *args, **kwargs),
+    'numpy': lambda *args, **kwargs: ObjectEngine(boid_numpy_module, *args, **kwargs),
+    'flock-grid': lambda *args, **kwargs: FlockEngine('grid', *args, **kwargs),
+    'flock-kdtree': lambda *args, **kwargs: FlockEngine('kdtree', *args, **kwargs),
+    'flock-jit': lambda *args, **kwargs: FlockEngine('grid', *args, jit=True, **kwargs),
+    'flock-far': lambda *args, **kwargs: FlockEngine('grid', *args, jit=True, far_field=True, **kwargs),
+    'flock-sums': lambda *args, **kwargs: FlockEngine('grid', *args, stencil_sums=True, **kwargs),
+    'flock-knn': lambda *args, **kwargs: FlockEngine('grid', *args, jit=True, neighbour_limit=KNN, **kwargs),
+    'flock-threads': lambda *args, **kwargs: FlockEngine('grid', *args, workers=os.cpu_count(), **kwargs),
+    'flock-parallel': ParallelEngine,
+}
+OBJECT_ENGINES: tuple = ('python', 'numpy')
+
+
+def initial_layout(layout: str, n: int, width: int, height: int, maxSpeed: float,
+                   rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param layout: 'uniform' (whole screen, random headings), 'clustered' (gaussian blobs,
+                   random headings) or 'streaming' (a horizontal band flying to the right)
+    :return: (positions, velocities) of n boids
+    """
+    size = np.array([width, height], dtype=float)
+    if layout == 'uniform':
+        positions = rng.uniform(0, size, (n, 2))
+        velocities = rng.uniform(-maxSpeed, maxSpeed, (n, 2))
+    elif layout == 'clustered':
+        centres = rng.uniform(0, size, (max(1, n // 500), 2))
+        positions = centres[rng.integers(0, len(centres), n)] + rng.normal(0, 50, (n, 2))
+        velocities = rng.uniform(-maxSpeed, maxSpeed, (n, 2))
+    elif layout == 'streaming':
+        positions = np.stack((rng.uniform(0, width, n),
+                              rng.normal(height / 2, height / 20, n)), axis=1)
+        velocities = np.stack((np.full(n, maxSpeed * 0.8), np.zeros(n)), axis=1) + rng.normal(0, maxSpeed / 20, (n, 2))
+    else:
+        raise ValueError(f'Unknown layout {layout!r}, expected one of {LAYOUTS}')
+    return np.mod(positions, size), velocities
+
+def run_case(engine: str, n: int, layout: str, rules: str, width: int, height: int,
+             steps: int, warmup: int, deltaTime: float, seed: int) -> dict:
+    """
+    :return: Mean ms per step of every phase (None when the engine cannot separate it)
+    """
+    rng = np.random.default_rng(seed)
+    positions, velocities = initial_layout(layout, n, width, height, boid_module.MAX_SPEED, rng)
+    simulation = ENGINES[engine](positions, velocities, rules, width, height, seed=seed)
+
+    try:
+        for _ in range(warmup):
+            simulation.step(deltaTime)
+        sums: dict = dict.fromkeys(PHASES, 0.0)
+        for _ in range(steps):
+            start: float = time.perf_counter()
+            times: dict = simulation.step(deltaTime)
+            sums['total'] += time.perf_counter() - start
+            for phase, value in times.items():
+                sums[phase] = None if value is None else sums[phase] + value
+    finally:
+        if hasattr(simulation, 'close'): simulation.close()
+
+    return {phase: None if value is None else value * 1000 / steps for phase, value in sums.items()}
+
+def run_suite(engines: tuple = tuple(ENGINES), counts: tuple = COUNTS, layouts: tuple = LAYOUTS,
+              rules: tuple = RULES, width: int = 3840, height: int = 2160, steps: int = 5,
+              warmup: int = 1, deltaTime: float = 0.016, seed: int = 0,
+              maxObjectBoids: int = MAX_OBJECT_BOIDS, verbose: bool = True) -> dict:
+    """
+    :return: {'meta': ..., 'results': [one dict per case]}, ready to be dumped as JSON
+    """
+    results: list = []
+    for engine, n, layout, rule in itertools.product(engines, counts, layouts, rules):
+        case: dict = {'engine': engine, 'n': n, 'layout': layout, 'rules': rule}
+        if engine in OBJECT_ENGINES and n > maxObjectBoids:
+            continue
+        case.update({f'{phase}_ms': value for phase, value in
+                     run_case(engine, n, layout, rule, width, height, steps, warmup, deltaTime, seed).items()})
+        results.append(case)
+        if verbose:
+            print(f'{engine:>14} {n:>7} {layout:>10} {rule or "-":>4}: {case["total_ms"]:10.2f} ms/step')
+
+    meta: dict = {'width': width, 'height': height, 'steps': steps, 'warmup': warmup, 'dt': deltaTime,
+                  'seed': seed, 'python': platform.python_version(), 'numpy': np.__version__,
+                  'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+def far_field_error(n: int, layout: str, width: int = 3840, height: int = 2160, seed: int = 0,
+                    jit: bool = False) -> dict:
+    """
+    Step the same flock once exactly and once with the far field approximation
+    :return: Error of the approximated accelerations relative to the largest one (rms and max), mean
+             angle between both (degrees, boids with a non zero acceleration), mean relative error of
+             the number of neighbours and ms of each step
+    """
+    positions, velocities = initial_layout(layout, n, width, height, boid_module.MAX_SPEED,
+                                           np.random.default_rng(seed))
+    accelerations: list = []
+    neighbours: list = []
+    times: list = []
+    for farField in (False, True):
+        engine = FlockEngine('grid', positions, velocities, 'SAC', width, height, seed=seed, jit=jit,
+                             far_field=farField)
+        try:
+            # First step compiles the kernels when jit
+            if jit: engine.step(0.0)
+            engine.flock.positions[:], engine.flock.velocities[:] = positions, velocities
+            start: float = time.perf_counter()
+            engine.step(0.0)
+            times.append((time.perf_counter() - start) * 1000)
+            accelerations.append(engine.flock.accelerations.copy())
+            neighbours.append(engine.flock.neighbourCounts.copy())
+        finally:
+            engine.close()
+
+    exact, approximated = accelerations
+    force: float = float(np.abs(exact).max()) or 1.0
+    error = np.hypot(*(approximated - exact).T) / force
+    moving = (np.hypot(*exact.T) > 0) & (np.hypot(*approximated.T) > 0)
+    cosine = np.einsum('ij,ij->i', exact[moving], approximated[moving]) \
+        / (np.hypot(*exact[moving].T) * np.hypot(*approximated[moving].T))
+    return {'n': n, 'layout': layout, 'rms': float(np.sqrt(np.mean(error ** 2))), 'max': float(error.max()),
+            'angle': float(np.degrees(np.arccos(np.clip(cosine, -1, 1))).mean()) if moving.any() else 0.0,
+            'count': float(np.mean(np.abs(neighbours[1] - neighbours[0]) / np.maximum(neighbours[0], 1))),
+            'exact_ms': times[0], 'far_ms': times[1]}
+
+def case_key(case: dict) -> tuple:
+    return case['engine'], case['n'], case['layout'], case['rules']
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    :param threshold: Relative slow down that counts as a regression (0.1 = 10 % slower)
+    :return: One dict per (case, phase) of current slower than baseline beyond the threshold
+    """
+    previous: dict = {case_key(case): case for case in baseline['results']}
+    regressions: list = []
+    for case in current['results']:
+        old = previous.get(case_key(case))
+        if old is None: continue
+        for phase in PHASES:
+            before, after = old.get(f'{phase}_ms'), case.get(f'{phase}_ms')
+            if before is None or after is None or before <= 0: continue
+            if after > before * (1 + threshold):
+                regressions.append({'engine': case['engine'], 'n': case['n'], 'layout': case['layout'],
+                                    'rules': case['rules'], 'phase': phase, 'baseline_ms': before,
+                                    'current_ms': after, 'change': after / before - 1})
+    return regressions
+
+def save(results: dict, path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
@@ -1,5 +1,4 @@
 import random
-import pygame as py
 import math
 
 ''' 
@@ -31,6 +30,11 @@ MAX_FORCE = 1
 MAX_SPEED = 200
 AVG_SIZE = 6
 
+# Stream of the random velocities and direction changes, seeded with set_seed
+RANDOM: random.Random = random.Random()
+
+def set_seed(v: int):
+    RANDOM.seed(v)
 def set_max_force(v: float):
     global MAX_FORCE
     MAX_FORCE = v
@@ -39,22 +43,33 @@ def set_max_speed(v: float):
     MAX_SPEED = v
 
 class Boid:
-    def __init__(self, x: float = 0, y: float = 0, size: float = AVG_SIZE, matrix: list = None, color: tuple = (255, 0, 0)):
+    """
+    Pure Python boid, the fallback engine without NumPy. __slots__ keeps it to its state, no
+    __dict__, and the colour and size are derived from the velocity only when it is drawn.
+    """
+    __slots__ = ('x', 'y', 'dx', 'dy', 'ax', 'ay', 'Separation', 'Alignment', 'Cohesion',
+                 'matrix', 'actualI', 'actualJ')
+
+    def __init__(self, x: float = 0, y: float = 0, size: float = AVG_SIZE, matrix: list = None,
+                 color: tuple = (255, 0, 0)):
+        """
+        :param size: Ignored, the size follows the speed (see the size property)
+        :param color: Ignored, the colour follows the heading (see the color property)
+        """
         self.x = x
         self.y = y
-        self.size = size
-        self.color = color
 
-        self.dx = random.uniform(-MAX_SPEED,MAX_SPEED)
-        self.dy = random.uniform(-MAX_SPEED,MAX_SPEED)
-        self.ax = random.uniform(-MAX_SPEED,MAX_SPEED)
-        self.ay = random.uniform(-MAX_SPEED,MAX_SPEED)
+        self.dx = RANDOM.uniform(-MAX_SPEED,MAX_SPEED)
+        self.dy = RANDOM.uniform(-MAX_SPEED,MAX_SPEED)
+        self.ax = RANDOM.uniform(-MAX_SPEED,MAX_SPEED)
+        self.ay = RANDOM.uniform(-MAX_SPEED,MAX_SPEED)
 
         self.Separation = False
         self.Alignment = False
         self.Cohesion = False
 
         self.matrix = matrix
+        self.actualI = None; self.actualJ = None
         # Add to matrix. Refactored code here to avoid extra comparisons later
         if self.matrix is None: return
         i: int = int(self.x // CEL_GAP_X) % CELS_PER_AXIS
@@ -84,23 +99,6 @@ class Boid:
     def switch_cohesion(self, value: bool = None) -> None:
         self.Cohesion = not self.Cohesion if value is None else value
 
-    def draw(self, screen) -> None:
-        angle = math.atan2(self.dy, self.dx)
-        points = [
-            # Upper dot
-            (self.x + self.size * math.cos(angle), self.y + self.size * math.sin(angle)),
-            # Left lower dot
-            (self.x + self.size * math.cos(angle + 2.5 * math.pi / 3),
-             self.y + self.size * math.sin(angle + 2.5 * math.pi / 3)),
-            # mid point
-            (self.x, self.y),
-            # Right lower dot
-            (self.x + self.size * math.cos(angle - 2.5 * math.pi / 3),
-             self.y + self.size * math.sin(angle - 2.5 * math.pi / 3))
-        ]
-
-        py.draw.polygon(screen, self.color, points)
-
     def add_to_matrix(self):
         if self.matrix is None: return
 
@@ -116,14 +114,22 @@ class Boid:
     def remove_from_matrix(self):
         self.matrix[self.actualI][self.actualJ].remove(self)
 
-    def update_color(self):
+    @property
+    def color(self) -> tuple:
+        """
+        Hue of the heading, only computed when drawn
+        """
         theta = math.atan2(self.dy, self.dx)
         normalizedAngle = (theta + math.pi) / (2 * math.pi)
         color = hsv_a_rgb(normalizedAngle, 1.0, 1.0)
 
-        self.color = tuple(int(c * 255) for c in color)
-    def update_size(self):
-        self.size = vector_norm(self.dx,self.dy) * AVG_SIZE / MAX_SPEED + AVG_SIZE
+        return tuple(int(c * 255) for c in color)
+    @property
+    def size(self) -> float:
+        """
+        Grows with the speed, only computed when drawn
+        """
+        return vector_norm(self.dx,self.dy) * AVG_SIZE / MAX_SPEED + AVG_SIZE
     def move_down(self, y: float = None, deltaTime: float = 1) -> None:
         if y is None: y = 10 * deltaTime
         self.move(dir = (0, y))
@@ -139,7 +145,7 @@ class Boid:
     def move(self, dir: tuple = None, deltaTime: float = 1) -> None:
         # Make random changes to direction
         OffsetRange = 2.5
-        self.change_velocity_direction(random.uniform(-OffsetRange, OffsetRange))
+        self.change_velocity_direction(RANDOM.uniform(-OffsetRange, OffsetRange))
 
         if dir is not None:
             self.x += dir[0]; self.y += dir[1]
@@ -150,8 +156,6 @@ class Boid:
 
         # print(f'{self.x = }, {self.y = }, {self.dx = }, {self.dy= }')
         self.normalize_position()
-        self.update_color()
-        self.update_size()
         self.add_to_matrix()
 
     def normalize_position(self):
@@ -162,13 +166,18 @@ class Boid:
         self.dx += self.ax
         self.dy += self.ay
 
-        norm: float = math.sqrt(self.dx ** 2 + self.dy ** 2)
+        norm: float = math.sqrt(self.dx * self.dx + self.dy * self.dy)
         if norm > MAX_SPEED:
-            self.dx *= MAX_SPEED/norm
-            self.dy *= MAX_SPEED/norm
+            scale: float = MAX_SPEED / norm
+            self.dx *= scale
+            self.dy *= scale
     def normalize_and_set_acceleration(self, ax: float, ay: float):
-        # Limit de acceleration to a max force
-        self.ax, self.ay = normalize_acceleration(ax,ay)
+        # Limit de acceleration to a max force, inlined to skip the tuple of normalize_acceleration
+        norm: float = math.sqrt(ax * ax + ay * ay)
+        if norm > MAX_FORCE:
+            scale: float = MAX_FORCE / norm
+            ax *= scale; ay *= scale
+        self.ax = ax; self.ay = ay
 
     def change_direction(self, angle: float = None) -> None:
         theta = math.radians(angle)
@@ -209,7 +218,7 @@ class Boid:
                     if boid is self: continue
                     count += 1
 
-                    auxX, auxY = boid.get_position()
+                    auxX: float = boid.x; auxY: float = boid.y
                     if invertLowe0X:
                         auxX -= SCREEN_WIDTH
                     if invertUpperWX:
@@ -221,7 +230,7 @@ class Boid:
 
                     dist = 0
                     if self.Separation:
-                        dist: float = distance(boid = self, position = (auxX,auxY))
+                        dist: float = math.sqrt((self.x - auxX) ** 2 + (self.y - auxY) ** 2)
                         if dist > DISTANCE_RADIUS_CHECK: continue
 
                     # Cohesion: boids move toward the center of mass of their neighbors.
@@ -240,9 +249,8 @@ class Boid:
 
                     # Alignment: boids attempt to match the velocities of their neighbors.
                     if self.Alignment:
-                        auxX, auxY = boid.get_direction()
-                        avgDirX += auxX
-                        avgDirY += auxY
+                        avgDirX += boid.dx
+                        avgDirY += boid.dy
 
                 # End for boids
             # End for j
@@ -294,10 +302,12 @@ def distance(boid: Boid, position: tuple) -> float:
     x2, y2 = position
     return math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
 
-def normalize_acceleration(ax: float, ay: float, force: float = MAX_FORCE) -> tuple[float, float]:
+def normalize_acceleration(ax: float, ay: float, force: float = None) -> tuple[float, float]:
     """
+    :param force: MAX_FORCE by default, read on every call as normalize_and_set_acceleration does
     :return: Limit de acceleration to a max force
     """
+    if force is None: force = MAX_FORCE
     norm: float = vector_norm(ax,ay)
     if norm > force:
         return ax*force/norm, ay*force/norm
@@ -1,5 +1,4 @@
 import random
-import pygame as py
 import math
 import numpy as np
 
@@ -37,6 +36,11 @@ MAX_FORCE = 1
 MAX_SPEED = 200
 AVG_SIZE = 6
 
+# Stream of the random velocities and direction changes, seeded with set_seed
+RANDOM: random.Random = random.Random()
+
+def set_seed(v: int):
+    RANDOM.seed(v)
 def set_max_force(v: float):
     global MAX_FORCE
     MAX_FORCE = v
@@ -50,10 +54,10 @@ class Boid:
         self.size = size
         self.color = color
 
-        self.direction = np.array([random.uniform(-MAX_SPEED, MAX_SPEED),
-                                   random.uniform(-MAX_SPEED,MAX_SPEED)])
-        self.acceleration = np.array([random.uniform(-MAX_SPEED,MAX_SPEED),
-                                      random.uniform(-MAX_SPEED,MAX_SPEED)])
+        self.direction = np.array([RANDOM.uniform(-MAX_SPEED, MAX_SPEED),
+                                   RANDOM.uniform(-MAX_SPEED,MAX_SPEED)])
+        self.acceleration = np.array([RANDOM.uniform(-MAX_SPEED,MAX_SPEED),
+                                      RANDOM.uniform(-MAX_SPEED,MAX_SPEED)])
 
         self.Separation = False
         self.Alignment = False
@@ -86,24 +90,6 @@ class Boid:
         self.Alignment = not self.Alignment if value is None else value
     def switch_cohesion(self, value: bool = None) -> None:
         self.Cohesion = not self.Cohesion if value is None else value
-    def draw(self, screen) -> None:
-        angle = math.atan2(self.direction[Y], self.direction[X])
-        points = [
-            # Upper dot
-            (float(self.position[X] + self.size * math.cos(angle)),
-             float(self.position[Y] + self.size * math.sin(angle))),
-            # Left lower dot
-            (float(self.position[X] + self.size * math.cos(angle + 2.5 * math.pi / 3)),
-             float(self.position[Y] + self.size * math.sin(angle + 2.5 * math.pi / 3))),
-            # mid point
-            (float(self.position[X]), float(self.position[Y])),
-            # Right lower dot
-            (float(self.position[X] + self.size * math.cos(angle - 2.5 * math.pi / 3)),
-             float(self.position[Y] + self.size * math.sin(angle - 2.5 * math.pi / 3)))
-        ]
-
-        py.draw.polygon(screen, self.color, points)
-
     def add_to_matrix(self):
         if self.matrix is None: return
 
@@ -144,7 +130,7 @@ class Boid:
     def move(self, dir: tuple = None, deltaTime: float = 1) -> None:
         # Make random changes to direction
         OffsetRange = 2.5
-        self.change_velocity_direction(random.uniform(-OffsetRange, OffsetRange))
+        self.change_velocity_direction(RANDOM.uniform(-OffsetRange, OffsetRange))
 
         if dir is not None:
             self.position += dir
@@ -0,0 +1,376 @@
+import numpy as np
+
+'''
+=====================================================
+    UNIFORM GRID REBUILT EVERY FRAME (CSR LAYOUT)
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+
+class CellGrid:
+    """
+    Replacement of the BOIDS_MATRIX list of lists. Instead of moving boids between python
+    lists, every rebuild sorts the boid indices by cell id, so the boids of cell c are
+    order[cell_start[c]:cell_start[c] + cell_count[c]].
+    """
+    def __init__(self, width: float, height: float, cels_x: int, cels_y: int, cel_radius: int,
+                 radius: float = None):
+        """
+        :param cel_radius: Square stencil of (2*cel_radius+1)^2 cells, used when radius is None
+        :param radius: Interaction radius, the stencil is then the cells that can hold a boid
+                       closer than radius to some point of the centre cell
+        """
+        self.width = width
+        self.height = height
+        self.cels_x = cels_x
+        self.cels_y = cels_y
+        self.cel_radius = cel_radius
+        self.radius = radius
+        self.gap_x: float = width / cels_x
+        self.gap_y: float = height / cels_y
+        # Cells scanned on each side of the centre cell, per axis. Further than half the grid the
+        # stencil would wrap onto cells it already has (screens smaller than about 2*radius)
+        self.reach_x: int = min(cel_radius if radius is None else int(np.ceil(radius / self.gap_x)), cels_x // 2)
+        self.reach_y: int = min(cel_radius if radius is None else int(np.ceil(radius / self.gap_y)), cels_y // 2)
+        # Radix sort is used by numpy for stable sorts of 16 bit keys, which keeps the rebuild O(N)
+        self.dtype = np.uint16 if cels_x * cels_y <= np.iinfo(np.uint16).max else np.int64
+
+        self.cells = np.empty(0, dtype=self.dtype)
+        self.layer_offset = None
+        self.order = np.empty(0, dtype=np.intp)
+        self.cell_start = np.zeros(cels_x * cels_y, dtype=np.intp)
+        self.cell_count = np.zeros(cels_x * cels_y, dtype=np.intp)
+
+        self.build_offset_tables()
+
+    @classmethod
+    def for_radius(cls, width: float, height: float, radius: float, cels_per_radius: int = 2,
+                   max_cels: int = 512):
+        """
+        Grid sized from the interaction radius instead of the screen: (almost) square cells of
+        radius / cels_per_radius pixels, as many as fit the screen so they tile it exactly,
+        and the circular stencil of radius.
+        :param max_cels: Cap of cells per axis, for tiny radii on huge screens
+        """
+        side: float = max(radius, 1) / cels_per_radius
+        cels_x: int = int(min(max(width // side, 1), max_cels))
+        cels_y: int = int(min(max(height // side, 1), max_cels))
+        # A stencil wider than the grid is cut to half of it on each side, which only stays
+        # symmetric (j seen by i from the opposite side i is seen by j) on an odd number of cells
+        if cels_x % 2 == 0 and 2 * np.ceil(radius * cels_x / width) + 1 > cels_x: cels_x -= 1
+        if cels_y % 2 == 0 and 2 * np.ceil(radius * cels_y / height) + 1 > cels_y: cels_y -= 1
+        return cls(width, height, cels_x, cels_y, cels_per_radius, radius=radius)
+
+    def __str__(self):
+        if self.radius is None:
+            return f'CellGrid({self.cels_x}x{self.cels_y} | radius {self.cel_radius})'
+        return f'CellGrid({self.cels_x}x{self.cels_y} | {self.gap_x:.1f}x{self.gap_y:.1f} px | ' \
+               f'{self.neighbour_cells.shape[1]} cell stencil)'
+
+    def fits(self, width: float, height: float, radius: float) -> bool:
+        """
+        :return: Whether this grid can still answer queries of radius on a width x height screen
+        """
+        if self.width != width or self.height != height: return False
+        return self.radius == radius if self.radius is not None else True
+
+    def stencil(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (di, dj) cell offsets scanned around every cell
+        """
+        di, dj = np.meshgrid(np.arange(-self.reach_x, self.reach_x + 1),
+                             np.arange(-self.reach_y, self.reach_y + 1), indexing='ij')
+        # On an even number of cells, a reach of half the grid gets the opposite cell from both sides
+        inside = (di + self.reach_x < self.cels_x) & (dj + self.reach_y < self.cels_y)
+        if self.radius is None: return di[inside], dj[inside]
+
+        # Closest two points of the centre cell and of the offset cell can be
+        gapX = np.maximum(np.abs(di) - 1, 0) * self.gap_x
+        gapY = np.maximum(np.abs(dj) - 1, 0) * self.gap_y
+        inside &= gapX ** 2 + gapY ** 2 <= self.radius ** 2
+        return di[inside], dj[inside]
+
+    def build_offset_tables(self) -> None:
+        """
+        For every cell and every stencil offset, store the wrapped neighbour cell and the
+        shift that brings its boids next to the cell (the invertLowe0X/invertUpperWX flags
+        of Boid.boid_movement, solved once instead of per neighbour).
+        """
+        di, dj = self.stencil()
+
+        i = np.arange(self.cels_x)[:, None, None] + di[None, None, :]
+        j = np.arange(self.cels_y)[None, :, None] + dj[None, None, :]
+        i, j = np.broadcast_arrays(i, j)
+
+        self.neighbour_cells = ((i % self.cels_x) * self.cels_y + j % self.cels_y).reshape(-1, len(di))
+        self.neighbour_shifts = np.stack((np.floor_divide(i, self.cels_x) * self.width,
+                                          np.floor_divide(j, self.cels_y) * self.height),
+                                         axis=-1).reshape(-1, len(di), 2)
+        # Closest distance between the centre cell and every stencil cell, splits it for split_stencil
+        self.stencil_gaps = np.hypot(np.maximum(np.abs(di) - 1, 0) * self.gap_x,
+                                     np.maximum(np.abs(dj) - 1, 0) * self.gap_y)
+        self.inner_margin = None
+        self.sorted_gaps = None
+
+    def split_stencil(self, margin: float) -> None:
+        """
+        Cut the stencil in the inner cells, closer than margin to the centre cell, whose boids are
+        visited one by one, and the outer cells, only seen through their aggregates (far field)
+        """
+        if self.inner_margin == margin: return
+        inner = self.stencil_gaps < margin
+        self.inner_cells = np.ascontiguousarray(self.neighbour_cells[:, inner])
+        self.inner_shifts = np.ascontiguousarray(self.neighbour_shifts[:, inner])
+        self.outer_cells = np.ascontiguousarray(self.neighbour_cells[:, ~inner])
+        self.outer_shifts = np.ascontiguousarray(self.neighbour_shifts[:, ~inner])
+        self.inner_margin = margin
+
+    def sort_stencil(self) -> None:
+        """
+        Stencil columns ordered by their gap to the centre cell (the own cell first), so a search can
+        spiral out and stop as soon as the nearest boids are certain (nearest_pairs)
+        """
+        if self.sorted_gaps is not None: return
+        order = np.argsort(self.stencil_gaps, kind='stable')
+        self.sorted_cells = np.ascontiguousarray(self.neighbour_cells[:, order])
+        self.sorted_shifts = np.ascontiguousarray(self.neighbour_shifts[:, order])
+        self.sorted_gaps = np.ascontiguousarray(self.stencil_gaps[order])
+
+    def aggregate(self, positions: np.ndarray, velocities: np.ndarray) -> None:
+        """
+        Needs rebuild(positions) first. Sum of the positions and velocities of the boids of every cell.
+        """
+        ncells: int = self.cels_x * self.cels_y
+        self.cell_positions = np.stack((np.bincount(self.cells, positions[:, X], ncells),
+                                        np.bincount(self.cells, positions[:, Y], ncells)), axis=1)
+        self.cell_velocities = np.stack((np.bincount(self.cells, velocities[:, X], ncells),
+                                         np.bincount(self.cells, velocities[:, Y], ncells)), axis=1)
+
+    def stencil_rectangles(self) -> list:
+        """
+        :return: The stencil as few (di0, di1, dj0, dj1) rectangles of offsets (inclusive bounds):
+                 one per run of stencil columns spanning the same rows, a single one for a square stencil
+        """
+        di, dj = self.stencil()
+        rectangles: list = []
+        for column in range(-self.reach_y, self.reach_y + 1):
+            rows = di[dj == column]
+            if len(rows) == 0: continue
+            span: tuple = (int(rows.min()), int(rows.max()))
+            if rectangles and rectangles[-1][:2] == span and rectangles[-1][3] == column - 1:
+                rectangles[-1] = (*span, rectangles[-1][2], column)
+            else:
+                rectangles.append((*span, column, column))
+        return rectangles
+
+    def stencil_sums(self, positions: np.ndarray, velocities: np.ndarray) -> None:
+        """
+        Needs rebuild(positions) first. Count, position sum and velocity sum of the boids of the
+        stencil of every cell, from a summed-area table of the per cell sums: O(cells) whatever the
+        number of boids per stencil. Cells reached across a border are padded with their sums moved
+        by the screen size (the invertLowe0X/invertUpperHY shifts of Boid.boid_movement applied to
+        whole cells), so the position sums are those of the copies next to the cell.
+        """
+        ncells: int = self.cels_x * self.cels_y
+        counts = self.cell_count.reshape(self.cels_x, self.cels_y).astype(float)
+        sums = [np.bincount(self.cells, weights, ncells).reshape(self.cels_x, self.cels_y)
+                for weights in (positions[:, X], positions[:, Y], velocities[:, X], velocities[:, Y])]
+
+        # Wrapped copy of the grid with reach cells more on every side
+        paddedX = np.arange(-self.reach_x, self.cels_x + self.reach_x)
+        paddedY = np.arange(-self.reach_y, self.cels_y + self.reach_y)
+        sourceX = np.ix_(paddedX % self.cels_x, paddedY % self.cels_y)
+        shiftX = (np.floor_divide(paddedX, self.cels_x) * self.width)[:, None]
+        shiftY = (np.floor_divide(paddedY, self.cels_y) * self.height)[None, :]
+        padded = [counts[sourceX],
+                  sums[X][sourceX] + counts[sourceX] * shiftX,
+                  sums[Y][sourceX] + counts[sourceX] * shiftY,
+                  sums[2][sourceX], sums[3][sourceX]]
+
+        i = np.arange(self.cels_x)[:, None] + self.reach_x
+        j = np.arange(self.cels_y)[None, :] + self.reach_y
+        totals = [np.zeros((self.cels_x, self.cels_y)) for _ in padded]
+        for values, total in zip(padded, totals):
+            table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+            table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+            for di0, di1, dj0, dj1 in self.stencil_rectangles():
+                total += table[i + di1 + 1, j + dj1 + 1] - table[i + di0, j + dj1 + 1] \
+                    - table[i + di1 + 1, j + dj0] + table[i + di0, j + dj0]
+
+        self.stencil_count = np.rint(totals[0]).astype(np.intp).ravel()
+        self.stencil_positions = np.stack((totals[1].ravel(), totals[2].ravel()), axis=1)
+        self.stencil_velocities = np.stack((totals[3].ravel(), totals[4].ravel()), axis=1)
+
+    def stencil_totals(self, positions: np.ndarray, velocities: np.ndarray,
+                       rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Needs stencil_sums() first. O(1) per boid.
+        :return: (count, delta sum, velocity sum) of every other boid in the stencil of each boid of rows
+        """
+        cells = self.cells[rows]
+        count = self.stencil_count[cells]
+        return (count - 1, self.stencil_positions[cells] - count[:, None] * positions[rows],
+                self.stencil_velocities[cells] - velocities[rows])
+
+    def cell_of(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :return: Cell id (i * cels_y + j, as matrix[i][j]) of every (n,2) position
+        """
+        i = (positions[:, X] // self.gap_x).astype(np.intp) % self.cels_x
+        j = (positions[:, Y] // self.gap_y).astype(np.intp) % self.cels_y
+        return (i * self.cels_y + j).astype(self.dtype)
+
+    def rebuild(self, positions: np.ndarray, layers: np.ndarray = None, nlayers: int = 1) -> None:
+        """
+        Counting sort of the boids by cell, O(N)
+        :param layers: Layer of every boid. Layers are independent copies of the screen sharing the
+                       grid (see Ensemble.py), a boid only finds the boids of its own layer.
+        """
+        ncells: int = self.cels_x * self.cels_y
+        self.cells = self.cell_of(positions)
+        if layers is None:
+            self.layer_offset = None
+            keys = self.cells
+        else:
+            self.layer_offset = np.asarray(layers, dtype=np.intp) * ncells
+            keys = self.layer_offset + self.cells
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_count = np.bincount(keys, minlength=nlayers * ncells)
+        self.cell_start = np.cumsum(self.cell_count) - self.cell_count
+
+    def candidates(self, rows: np.ndarray, inner: bool = False,
+                   columns: slice = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param rows: Boids whose stencil is scanned
+        :param inner: Only scan the inner cells of split_stencil
+        :param columns: Only scan these columns of the sorted stencil (sort_stencil)
+        :return: (i, j, shift) for every boid j found in the stencil of boid i (including i
+                 itself). positions[j] + shift is the copy of j next to i.
+        """
+        neighbourCells = self.inner_cells if inner else self.neighbour_cells
+        neighbourShifts = self.inner_shifts if inner else self.neighbour_shifts
+        if columns is not None:
+            neighbourCells = self.sorted_cells[:, columns]
+            neighbourShifts = self.sorted_shifts[:, columns]
+        cells = neighbourCells[self.cells[rows]]
+        if self.layer_offset is not None: cells = cells + self.layer_offset[rows][:, None]
+        counts = self.cell_count[cells].ravel()
+        total: int = int(counts.sum())
+
+        # Flattened [start, start + count) ranges, one after the other
+        ends = np.cumsum(counts)
+        slots = np.arange(total) + np.repeat(self.cell_start[cells].ravel() - (ends - counts), counts)
+
+        i = np.repeat(np.repeat(rows, cells.shape[1]), counts)
+        shift = np.repeat(neighbourShifts[self.cells[rows]].reshape(-1, 2), counts, axis=0)
+        return i, self.order[slots], shift
+
+    def query_pairs(self, positions: np.ndarray, radius: float, rows: np.ndarray,
+                    inner: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Needs rebuild(positions) first. Holds no state, so disjoint rows can be queried from several threads.
+        :param inner: Only search the inner cells of split_stencil
+        :return: (i, j, delta) for every boid i of rows and every other boid j closer than radius,
+                 delta being the wrapped vector from boid i to boid j
+        """
+        i, j, shift = self.candidates(rows, inner)
+        delta = positions[j] + shift - positions[i]
+        close = (np.einsum('ij,ij->i', delta, delta) <= radius ** 2) & (i != j)
+        return i[close], j[close], delta[close]
+
+    def nearest_pairs(self, positions: np.ndarray, radius: float, k: int,
+                      rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Like query_pairs, capped to the k nearest boids of every row. The stencil is scanned ring by
+        ring of cells at the same gap, nearest first, and a boid leaves the search once k boids are
+        closer than the gap of the next ring: the work per boid is bounded by the density around it,
+        not by the whole stencil.
+        :param rows: Sorted boids to search for
+        :return: (i, j, delta) with at most k pairs per boid of rows, nearest first
+        """
+        self.sort_stencil()
+        ringStarts = np.flatnonzero(np.r_[True, np.diff(self.sorted_gaps) > 0])
+        ringEnds = np.r_[ringStarts[1:], len(self.sorted_gaps)]
+        pending = rows
+        found: list = []
+        for start, end in zip(ringStarts, ringEnds):
+            if self.sorted_gaps[start] > radius or len(pending) == 0: break
+            i, j, shift = self.candidates(pending, columns=slice(start, end))
+            delta = positions[j] + shift - positions[i]
+            distance2 = np.einsum('ij,ij->i', delta, delta)
+            close = (distance2 <= radius ** 2) & (i != j)
+            found.append((i[close], j[close], delta[close], distance2[close]))
+
+            # Every boid of the rings left is at least the next gap away
+            nextGap: float = self.sorted_gaps[end] if end < len(self.sorted_gaps) else np.inf
+            i = np.concatenate([f[0] for f in found]); distance2 = np.concatenate([f[3] for f in found])
+            certain = np.bincount(np.searchsorted(rows, i[distance2 <= nextGap ** 2]), minlength=len(rows))
+            pending = pending[certain[np.searchsorted(rows, pending)] < k]
+
+        if not found: return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty((0, 2))
+        i, j, delta, distance2 = (np.concatenate([f[n] for f in found]) for n in range(4))
+        # Rank of every pair among the pairs of its boid, by distance
+        order = np.lexsort((distance2, i))
+        i, j, delta = i[order], j[order], delta[order]
+        groupStart = np.r_[0, np.flatnonzero(np.diff(i)) + 1]
+        rank = np.arange(len(i)) - np.repeat(groupStart, np.diff(np.r_[groupStart, len(i)]))
+        keep = rank < k
+        return i[keep], j[keep], delta[keep]
+
+    def far_field(self, positions: np.ndarray, radius: float,
+                  rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Needs aggregate() and split_stencil() first. Every outer cell counts as all its boids
+        sitting on its centre of mass, weighted by far_field_weight of its distance.
+        :return: (count, delta sum, velocity sum) of the boids of rows from their outer cells
+        """
+        cells = self.outer_cells[self.cells[rows]]
+        counts = self.cell_count[cells]
+        delta = self.cell_positions[cells] / np.maximum(counts, 1)[..., None] \
+            + self.outer_shifts[self.cells[rows]] - positions[rows][:, None, :]
+        weights = far_field_weight(np.sqrt(np.einsum('rkd,rkd->rk', delta, delta)), radius,
+                                   np.sqrt(self.gap_x * self.gap_y)) * (counts > 0)
+        return ((counts * weights).sum(axis=1), (delta * (counts * weights)[..., None]).sum(axis=1),
+                (self.cell_velocities[cells] * weights[..., None]).sum(axis=1))
+
+    def neighbour_pairs(self, positions: np.ndarray, radius: float, rows: np.ndarray = None,
+                        chunk: int = 4096) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param rows: Only search the neighbours of these boids (all of them by default)
+        :return: (i, j, delta) for every ordered pair of distinct boids closer than radius,
+                 delta being the wrapped vector from boid i to boid j
+        """
+        self.rebuild(positions)
+        if rows is None: rows = np.arange(len(positions))
+
+        allI, allJ, allDelta = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)], [np.empty((0, 2))]
+        for start in range(0, len(rows), chunk):
+            i, j, delta = self.query_pairs(positions, radius, rows[start:start + chunk])
+            allI.append(i); allJ.append(j); allDelta.append(delta)
+        return np.concatenate(allI), np.concatenate(allJ), np.concatenate(allDelta)
+
+    def candidate_count(self, rows: np.ndarray = None) -> int:
+        """
+        :param rows: Boolean mask of the boids whose stencil is scanned (all of them by default)
+        :return: Boids tested by those scans (each boid included in its own), without enumerating them
+        """
+        perCell = self.cell_count[self.neighbour_cells].sum(axis=1)
+        scanning = self.cell_count if rows is None else np.bincount(self.cells[rows], minlength=len(self.cell_count))
+        return int(np.dot(scanning, perCell))
+
+    def occupancy(self) -> np.ndarray:
+        """
+        :return: (cels_x, cels_y) number of boids per cell
+        """
+        return self.cell_count.reshape(self.cels_x, self.cels_y)
+
+
+def far_field_weight(distance, radius: float, side: float):
+    """
+    :return: Fraction of a cell of side pixels whose centre of mass is at distance taken as within
+             radius: a ramp from 1 (half a cell inside) to 0 (half a cell outside) instead of all or nothing
+    """
+    return np.clip((radius - distance) / side + 0.5, 0, 1)
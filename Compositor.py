@@ -0,0 +1,144 @@
+import numpy as np
+import pygame as py
+
+from Text import Text
+
+'''
+=====================================================
+    FRAME COMPOSITION WITH DIRTY RECTANGLES
+=====================================================
+'''
+# Above this many dirty rectangles a full display update is cheaper
+MAX_DIRTY_RECTS: int = 1500
+# Times per second the HUD texts are re-rendered
+HUD_FPS: float = 4
+
+
+def grid_background(width: int, height: int, celsX: int, celsY: int, color: tuple,
+                    fill: tuple = (0, 0, 0)) -> py.Surface:
+    """
+    :return: Screen sized surface with a dot at every inner corner of the cell grid, drawn once
+    """
+    background = py.Surface((width, height))
+    background.fill(fill)
+    gapX: float = width / celsX
+    gapY: float = height / celsY
+    for i in range(1, celsX):
+        for j in range(1, celsY):
+            py.draw.circle(background, color, (i * gapX, j * gapY), 1)
+    return background
+
+
+def paint_obstacles(background: py.Surface, field, color: tuple) -> py.Surface:
+    """
+    Fill the texels inside the obstacles of an ObstacleField (Obstacles.py) on the background
+    :return: The background
+    """
+    inside = field.distance <= 0
+    if field.texelSize > 1:
+        inside = np.repeat(np.repeat(inside, field.texelSize, axis=0), field.texelSize, axis=1)
+    width, height = background.get_size()
+    pixels = py.surfarray.pixels3d(background)
+    pixels[:min(width, inside.shape[0]), :min(height, inside.shape[1])][inside[:width, :height]] = color
+    del pixels
+    return background
+
+
+class Compositor:
+    """
+    Draws a frame on top of the previous one instead of from scratch: the static background is
+    only restored under what was drawn last frame, Text surfaces are rendered again only when
+    their string changes (at most HUD_FPS times per second), and only the changed rectangles
+    are pushed to the display.
+    """
+    def __init__(self, screen: py.Surface, background: py.Surface, font, hudFps: float = HUD_FPS):
+        self.screen = screen
+        self.background = background
+        self.font = font
+        self.hudInterval: float = 1 / hudFps if hudFps > 0 else 0
+        self.lastHud: float = -float('inf')
+
+        # Text -> (string, surface, rect)
+        self.texts: dict = {}
+        self.widgets: list = []
+        # Drawn this frame, restored at the start of the next one
+        self.drawn: list = []
+        self.dirty: list = []
+        self.fullUpdate: bool = True
+
+        self.screen.blit(self.background, (0, 0))
+
+    def __str__(self):
+        return f'Compositor({len(self.texts)} texts, {len(self.widgets)} widgets)'
+
+    def set_background(self, background: py.Surface) -> None:
+        self.background = background
+        self.screen.blit(self.background, (0, 0))
+        self.fullUpdate = True
+
+    def set_hud_fps(self, hudFps: float) -> None:
+        self.hudInterval = 1 / hudFps if hudFps > 0 else 0
+
+    def add_widget(self, rect: py.Rect) -> None:
+        """
+        Area redrawn by someone else every frame (pygame_widgets sliders)
+        """
+        self.widgets.append(py.Rect(rect))
+
+    def begin_frame(self) -> None:
+        """
+        Erase last frame: background back under everything drawn and under the widgets
+        """
+        restore: list = self.drawn + self.widgets
+        self.screen.blits([(self.background, rect, rect) for rect in restore], doreturn=False)
+        self.dirty = restore
+        self.drawn = []
+
+    def add_drawn(self, rects: list) -> None:
+        """
+        Rectangles drawn this frame, e.g. returned by Surface.blits
+        """
+        self.drawn.extend(rects)
+        self.dirty.extend(rects)
+
+    def draw_texts(self, texts: list[Text], now: float) -> None:
+        """
+        :param now: Current time (s), the HUD only changes every 1/HUD_FPS seconds
+        """
+        refresh: bool = now - self.lastHud >= self.hudInterval
+        if refresh: self.lastHud = now
+
+        for text in texts:
+            cached = self.texts.get(text)
+            string: str = str(text)
+            if cached is None or (refresh and cached[0] != string):
+                if cached is not None:
+                    self.screen.blit(self.background, cached[2], cached[2])
+                    self.dirty.append(cached[2])
+                surface = self.font.render(string, True, text.text_col)
+                cached = (string, surface, surface.get_rect(topleft=text.pos))
+                self.texts[text] = cached
+                self.dirty.append(cached[2])
+            # Blitted every frame (it is cheap) so boids flying below do not erase it
+            self.screen.blit(cached[1], cached[2])
+
+    def hide_texts(self, texts: list[Text]) -> None:
+        """
+        Erase texts that stop being drawn
+        """
+        for text in texts:
+            cached = self.texts.pop(text, None)
+            if cached is None: continue
+            self.screen.blit(self.background, cached[2], cached[2])
+            self.dirty.append(cached[2])
+
+    def present(self) -> None:
+        """
+        Push the dirty rectangles, or the whole screen when there are too many of them
+        """
+        if self.fullUpdate or len(self.dirty) > MAX_DIRTY_RECTS:
+            py.display.update()
+        else:
+            py.display.update(self.dirty + self.widgets)
+        self.fullUpdate = False
+        self.dirty = []
@@ -0,0 +1,165 @@
+import math
+import numpy as np
+import pygame as py
+
+import Flock as flock_module
+from Flock import Flock, hsv_a_rgb
+
+'''
+=====================================================
+    DRAWING, KEPT APART SO THE PHYSICS DOES NOT NEED PYGAME
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+# Side (px) of the squares of draw_points
+POINT_SIZE: int = 2
+
+
+def draw_boid(screen, boid) -> None:
+    """
+    Draw one Boid (Boid.py or BoidNumpy.py) as an arrow pointing to its direction
+    """
+    x, y = boid.get_position()
+    dx, dy = boid.get_direction()
+    angle = math.atan2(dy, dx)
+    points = [
+        # Upper dot
+        (float(x + boid.size * math.cos(angle)), float(y + boid.size * math.sin(angle))),
+        # Left lower dot
+        (float(x + boid.size * math.cos(angle + 2.5 * math.pi / 3)),
+         float(y + boid.size * math.sin(angle + 2.5 * math.pi / 3))),
+        # mid point
+        (float(x), float(y)),
+        # Right lower dot
+        (float(x + boid.size * math.cos(angle - 2.5 * math.pi / 3)),
+         float(y + boid.size * math.sin(angle - 2.5 * math.pi / 3)))
+    ]
+
+    py.draw.polygon(screen, boid.color, points)
+
+def draw_flock(screen, flock: Flock) -> None:
+    """
+    Same arrows as draw_boid, with the vertices and colours of the whole flock computed at once
+    """
+    if len(flock) == 0: return
+    angle = np.arctan2(flock.velocities[:, Y], flock.velocities[:, X])
+    offsets = np.stack((angle, angle + 2.5 * math.pi / 3, angle - 2.5 * math.pi / 3), axis=1)
+    tips = flock.positions[:, None, :] + flock.sizes[:, None, None] * np.stack((np.cos(offsets),
+                                                                                 np.sin(offsets)), axis=2)
+    # Upper dot, left lower dot, mid point, right lower dot
+    points = np.stack((tips[:, 0], tips[:, 1], flock.positions, tips[:, 2]), axis=1).tolist()
+    colors = HEADING_COLORS[heading_bucket(flock.velocities, len(HEADING_COLORS))].tolist()
+
+    for color, polygon in zip(colors, points):
+        py.draw.polygon(screen, color, polygon)
+
+def draw_points(screen, flock, alpha: float = None, doreturn: bool = False):
+    """
+    Cheapest detail: every boid is a POINT_SIZE square of its heading colour, written straight
+    into the pixels of the screen. Same arguments as SpriteAtlas.draw.
+    :return: The whole screen when doreturn, the points are too many to be worth a rectangle each
+    """
+    if len(flock) == 0: return [] if doreturn else None
+    width, height = screen.get_size()
+    positions = flock.positions if alpha is None else flock.interpolated_positions(alpha)
+    x = positions[:, X].astype(np.intp)
+    y = positions[:, Y].astype(np.intp)
+    colors = HEADING_COLORS[heading_bucket(flock.velocities, len(HEADING_COLORS))]
+    pixels = py.surfarray.pixels3d(screen)
+    for dx in range(POINT_SIZE):
+        for dy in range(POINT_SIZE):
+            pixels[(x + dx) % width, (y + dy) % height] = colors
+    del pixels
+    return [screen.get_rect()] if doreturn else None
+
+
+'''
+=====================================================
+    SPRITE ATLAS: ONE PRE-ROTATED ARROW PER (SIZE, HEADING) BUCKET
+=====================================================
+'''
+HEADING_BUCKETS: int = 64
+# Transparent colour of the sprites, the heading colours are never black
+SPRITE_COLORKEY: tuple = (0, 0, 0)
+
+
+class SpriteAtlas:
+    """
+    Arrows pre-drawn for every heading bucket and integer size, the colour being the one of
+    the heading (HEADING_COLORS). Drawing the flock is then one Surface.blits call, with the
+    sprite and destination of every boid computed as arrays. Sprites use a run-length encoded
+    colour key instead of per pixel alpha, which blits several times faster.
+    """
+    def __init__(self, headings: int = HEADING_BUCKETS, minSize: int = None, maxSize: int = None):
+        self.headings = headings
+        self.minSize: int = int(flock_module.AVG_SIZE if minSize is None else minSize)
+        self.maxSize: int = int(2 * flock_module.AVG_SIZE if maxSize is None else maxSize)
+        # Every sprite shares the same square canvas, centred on the boid
+        self.half: int = self.maxSize + 1
+        self.colors = heading_colors(headings)
+
+        canConvert: bool = py.display.get_init() and py.display.get_surface() is not None
+        self.sprites: list = []
+        for size in range(self.minSize, self.maxSize + 1):
+            for bucket in range(headings):
+                sprite = py.Surface((2 * self.half, 2 * self.half))
+                sprite.fill(SPRITE_COLORKEY)
+                angle: float = (bucket + 0.5) / headings * 2 * math.pi - math.pi
+                points = [
+                    # Upper dot
+                    (self.half + size * math.cos(angle), self.half + size * math.sin(angle)),
+                    # Left lower dot
+                    (self.half + size * math.cos(angle + 2.5 * math.pi / 3),
+                     self.half + size * math.sin(angle + 2.5 * math.pi / 3)),
+                    # mid point
+                    (self.half, self.half),
+                    # Right lower dot
+                    (self.half + size * math.cos(angle - 2.5 * math.pi / 3),
+                     self.half + size * math.sin(angle - 2.5 * math.pi / 3))
+                ]
+                py.draw.polygon(sprite, self.colors[bucket].tolist(), points)
+                sprite.set_colorkey(SPRITE_COLORKEY, py.RLEACCEL)
+                self.sprites.append(sprite.convert() if canConvert else sprite)
+
+    def __str__(self):
+        return f'SpriteAtlas({self.headings} headings x sizes {self.minSize}..{self.maxSize})'
+
+    def sprite_index(self, velocities: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        :return: Index in self.sprites of every boid
+        """
+        sizeBucket = np.clip(np.rint(sizes).astype(np.intp), self.minSize, self.maxSize) - self.minSize
+        return sizeBucket * self.headings + heading_bucket(velocities, self.headings)
+
+    def draw(self, screen, flock, alpha: float = None, doreturn: bool = False):
+        """
+        :param alpha: Draw the flock this fraction of the way through its last step (see Flock.interpolated_positions)
+        :param doreturn: Return the rectangles drawn, for dirty rectangle updates (see Compositor)
+        """
+        if len(flock) == 0: return [] if doreturn else None
+        sprites = self.sprites
+        positions = flock.positions if alpha is None else flock.interpolated_positions(alpha)
+        destinations = (positions - self.half).astype(np.intp).tolist()
+        return screen.blits([(sprites[k], destination) for k, destination in
+                             zip(self.sprite_index(flock.velocities, flock.sizes).tolist(), destinations)],
+                            doreturn=doreturn)
+
+
+def heading_bucket(velocities: np.ndarray, buckets: int) -> np.ndarray:
+    """
+    :return: Bucket of the heading of every velocity, [-pi, pi) cut in buckets equal parts
+    """
+    angle = np.arctan2(velocities[:, Y], velocities[:, X])
+    return ((angle + math.pi) * (buckets / (2 * math.pi))).astype(np.intp) % buckets
+
+def heading_colors(buckets: int) -> np.ndarray:
+    """
+    :return: (buckets,3) lookup table of the RGB colour of every heading bucket
+    """
+    return (hsv_a_rgb((np.arange(buckets) + 0.5) / buckets) * 255).astype(np.uint8)
+
+# Heading to colour lookup table (one bucket per degree), replaces hsv_a_rgb per boid and frame
+HEADING_COLORS: np.ndarray = heading_colors(360)
@@ -0,0 +1,158 @@
+import itertools
+import time
+import numpy as np
+
+import Flock as flock_module
+from CellGrid import CellGrid
+from Flock import rule_acceleration, integrate
+
+'''
+=====================================================
+    K INDEPENDENT FLOCKS STEPPED AS ONE (PARAMETER SWEEPS)
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+# Parameters that can differ between the flocks of an ensemble, and the module global they default to
+ENSEMBLE_PARAMETERS: dict = {
+    'max_force': 'MAX_FORCE',
+    'max_speed': 'MAX_SPEED',
+    'radius': 'DISTANCE_RADIUS_CHECK',
+    'margin': 'SEPARATION_MARGIN',
+}
+
+
+class Ensemble:
+    """
+    K flocks of N boids with their own MAX_FORCE, MAX_SPEED, DISTANCE_RADIUS_CHECK and
+    SEPARATION_MARGIN, in one (K,N,2) state. Every flock lives on its own copy of the screen:
+    they share one CellGrid where the cells of flock k are a layer of their own, so a step is
+    one sort and one batch of pairs for the whole ensemble, whatever K.
+    """
+    def __init__(self, k: int, n: int, width: float = None, height: float = None,
+                 rng: np.random.Generator = None, separation: bool = True, alignment: bool = True,
+                 cohesion: bool = True, **parameters):
+        """
+        :param parameters: max_force, max_speed, radius and/or margin, a scalar or one value per flock.
+                           Missing ones take the value of the Flock module globals.
+        """
+        unknown: set = set(parameters) - set(ENSEMBLE_PARAMETERS)
+        if unknown:
+            raise ValueError(f'Unknown ensemble parameters {sorted(unknown)}, expected {list(ENSEMBLE_PARAMETERS)}')
+        self.k = k
+        self.n = n
+        self.width = flock_module.SCREEN_WIDTH if width is None else width
+        self.height = flock_module.SCREEN_HEIGHT if height is None else height
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.parameters: dict = {name: np.broadcast_to(np.asarray(parameters.get(name, getattr(flock_module, glob)),
+                                                                  dtype=float), (k,)).copy()
+                                 for name, glob in ENSEMBLE_PARAMETERS.items()}
+        self.grid: CellGrid = None
+        self.step_times: dict = {'neighbours': 0.0, 'rules': 0.0, 'integration': 0.0}
+
+        speed = self.parameters['max_speed'][:, None, None]
+        self.positions = self.rng.uniform((0, 0), (self.width, self.height), (k, n, 2))
+        self.velocities = self.rng.uniform(-1, 1, (k, n, 2)) * speed
+        self.accelerations = self.rng.uniform(-1, 1, (k, n, 2)) * speed
+        self.neighbourCounts = np.zeros((k, n), dtype=np.intp)
+
+        self.Separation = np.full((k, n), separation)
+        self.Alignment = np.full((k, n), alignment)
+        self.Cohesion = np.full((k, n), cohesion)
+
+    def __len__(self) -> int:
+        return self.k
+
+    def __str__(self):
+        return f'Ensemble({self.k} flocks x {self.n} boids | {self.width}x{self.height})'
+
+    def fit_grid(self) -> None:
+        """
+        One grid for the largest radius of the ensemble, the smaller ones filter its pairs
+        """
+        radius: float = float(self.parameters['radius'].max())
+        if self.grid is None or not self.grid.fits(self.width, self.height, radius):
+            self.grid = CellGrid.for_radius(self.width, self.height, radius, flock_module.CELS_PER_RADIUS)
+
+    def step(self, deltaTime: float) -> None:
+        """
+        Advance every flock by deltaTime, same rules as Flock.step with the parameters of each flock
+        """
+        k, n = self.k, self.n
+        positions = self.positions.reshape(-1, 2)
+        velocities = self.velocities.reshape(-1, 2)
+        accelerations = self.accelerations.reshape(-1, 2)
+        separation, alignment, cohesion = (self.Separation.ravel(), self.Alignment.ravel(), self.Cohesion.ravel())
+        layers = np.repeat(np.arange(k), n)
+        force = self.parameters['max_force'][layers]
+        radius = self.parameters['radius']
+        margin = self.parameters['margin']
+
+        start: float = time.perf_counter()
+        searched: float = 0.0
+        active = separation | alignment | cohesion
+        if active.any():
+            self.fit_grid()
+            self.grid.rebuild(positions, layers, k)
+            counts = self.neighbourCounts.reshape(-1)
+            for first in range(0, k * n, flock_module.CHUNK_SIZE):
+                rows = np.arange(first, min(first + flock_module.CHUNK_SIZE, k * n))
+                chunkStart: float = time.perf_counter()
+                i, j, shift = self.grid.candidates(rows)
+                delta = positions[j] + shift - positions[i]
+                close = (np.einsum('ij,ij->i', delta, delta) <= radius[layers[i]] ** 2) & (i != j)
+                i, j, delta = i[close], j[close], delta[close]
+                searched += time.perf_counter() - chunkStart
+
+                acceleration = rule_acceleration(len(rows), i - first, j, delta, velocities, separation[rows],
+                                                 alignment[rows], cohesion[rows], force[rows],
+                                                 margin[layers[i]])
+                chunkActive = active[rows]
+                accelerations[rows[chunkActive]] = acceleration[chunkActive]
+                counts[rows[chunkActive]] = np.bincount(i - first, minlength=len(rows))[chunkActive]
+        ruled: float = time.perf_counter()
+
+        jitter = self.rng.uniform(-flock_module.JITTER_DEGREES, flock_module.JITTER_DEGREES, k * n)
+        newPositions, newVelocities = integrate(positions, velocities, accelerations, jitter, deltaTime,
+                                                self.width, self.height, self.parameters['max_speed'][layers])
+        self.positions = newPositions.reshape(k, n, 2)
+        self.velocities = newVelocities.reshape(k, n, 2)
+        self.step_times = {'neighbours': searched, 'rules': ruled - start - searched,
+                           'integration': time.perf_counter() - ruled}
+
+    def run(self, steps: int, deltaTime: float) -> dict:
+        for _ in range(steps):
+            self.step(deltaTime)
+        return self.metrics()
+
+    def metrics(self) -> dict:
+        """
+        :return: One (K,) array per metric:
+                 polarization: norm of the mean heading, 1 when every boid flies the same way, ~0 at random
+                 speed: mean speed over the max speed of the flock
+                 neighbours: mean number of boids within radius (last step, boids with rules)
+        """
+        speed = np.sqrt(np.einsum('kni,kni->kn', self.velocities, self.velocities))
+        headings = self.velocities / np.maximum(speed, flock_module.ZERO)[..., None]
+        return {'polarization': np.sqrt(np.einsum('ki,ki->k', headings.mean(axis=1), headings.mean(axis=1))),
+                'speed': speed.mean(axis=1) / np.maximum(self.parameters['max_speed'], flock_module.ZERO),
+                'neighbours': self.neighbourCounts.mean(axis=1).astype(float)}
+
+
+def sweep(n: int, steps: int, deltaTime: float, width: float = None, height: float = None, seed: int = None,
+          **grid) -> list:
+    """
+    Run every combination of the parameter lists in grid as one Ensemble
+    :param grid: max_force, max_speed, radius and/or margin, each a list of values
+    :return: One dict per combination: its parameters and its metrics
+    """
+    names: list = list(grid)
+    points: list = list(itertools.product(*(grid[name] for name in names)))
+    columns = np.array(points, dtype=float).reshape(len(points), len(names))
+    ensemble = Ensemble(len(points), n, width, height, rng=np.random.default_rng(seed),
+                        **{name: columns[:, c] for c, name in enumerate(names)})
+    metrics: dict = ensemble.run(steps, deltaTime)
+    return [{**dict(zip(names, point)), **{metric: float(values[p]) for metric, values in metrics.items()}}
+            for p, point in enumerate(points)]
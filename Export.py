@@ -0,0 +1,110 @@
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+
+'''
+=====================================================
+    OFFLINE FRAME EXPORT: ENCODE AND WRITE WHILE THE NEXT STEP RUNS
+=====================================================
+    Frames are handed over as (height, width, 3) uint8 arrays and encoded by a thread pool.
+    zlib and file writes release the GIL, so encoding runs on other cores while the main
+    thread steps and rasterises the next frame. PNG files carry no time stamp or other
+    metadata: the same frames always give the same bytes.
+'''
+# Formats of FrameWriter: file extension
+FRAME_FORMATS: dict = {'png': 'png', 'raw': 'rgb'}
+# zlib level of the PNG frames, 6 is the usual trade between size and speed
+PNG_COMPRESSION: int = 6
+# Frames waiting to be written per worker, beyond it submit() waits (bounds the memory)
+PENDING_PER_WORKER: int = 2
+
+def set_png_compression(v: int):
+    global PNG_COMPRESSION
+    PNG_COMPRESSION = v
+
+
+class FrameWriter:
+    """
+    Writes numbered frames frame_000000.png (or .rgb, raw RGB24 rows) into a directory with a
+    pool of encoder threads
+    """
+    def __init__(self, directory: str, format: str = 'png', workers: int = None):
+        """
+        :param workers: Encoder threads, one per core by default
+        """
+        if format not in FRAME_FORMATS:
+            raise ValueError(f'Unknown frame format {format!r}, expected one of {list(FRAME_FORMATS)}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.workers: int = os.cpu_count() if workers is None else max(1, workers)
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.pending: deque = deque()
+        self.frames: int = 0
+        self.bytes: int = 0
+
+    def __str__(self):
+        return f'FrameWriter({self.frames} {self.format} frames | {self.bytes / 2**20:.1f} MiB in {self.directory})'
+
+    def path(self, frame: int) -> str:
+        return os.path.join(self.directory, f'frame_{frame:06d}.{FRAME_FORMATS[self.format]}')
+
+    def submit(self, pixels: np.ndarray) -> None:
+        """
+        :param pixels: (height, width, 3) uint8 frame, owned by the writer from now on
+        """
+        while len(self.pending) >= self.workers * PENDING_PER_WORKER:
+            self.bytes += self.pending.popleft().result()
+        self.pending.append(self.executor.submit(write_frame, self.path(self.frames), pixels, self.format))
+        self.frames += 1
+
+    def close(self) -> None:
+        """
+        Wait for every frame to be on disk
+        """
+        while self.pending:
+            self.bytes += self.pending.popleft().result()
+        self.executor.shutdown()
+
+
+def surface_pixels(surface) -> np.ndarray:
+    """
+    :return: (height, width, 3) uint8 copy of a pygame Surface, rows top to bottom
+    """
+    import pygame as py
+    return np.ascontiguousarray(py.surfarray.array3d(surface).transpose(1, 0, 2))
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def write_frame(path: str, pixels: np.ndarray, format: str) -> int:
+    """
+    :return: Bytes written
+    """
+    data: bytes = encode_png(pixels) if format == 'png' else pixels.tobytes()
+    with open(path, 'wb') as file:
+        file.write(data)
+    return len(data)
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """
+    :return: PNG file of a (height, width, 3) uint8 image: 8 bit RGB, no filter, no metadata
+    """
+    height, width, _ = pixels.shape
+    # Every row starts with its filter type, 0 (none)
+    rows = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = pixels.reshape(height, 3 * width)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) \
+        + png_chunk(b'IDAT', zlib.compress(rows.tobytes(), PNG_COMPRESSION)) + png_chunk(b'IEND', b'')
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
@@ -0,0 +1,678 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import Kernels
+from CellGrid import CellGrid
+
+'''
+=====================================================
+    STATIC VALUES AND FUNCTIONS USED IN THE CASS
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+ZERO: float = 1e-8
+
+SCREEN_WIDTH: int = 1400
+SCREEN_HEIGHT: int = 700
+# Cells per DISTANCE_RADIUS_CHECK: the grid cells are squares of DISTANCE_RADIUS_CHECK / CELS_PER_RADIUS
+# pixels whatever the screen, and the stencil is the circle of cells within the radius
+CELS_PER_RADIUS: int = 2
+
+def set_resolution(width: int, height: int):
+    global SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH = width
+    SCREEN_HEIGHT = height
+    print(f'{SCREEN_HEIGHT = }, {SCREEN_WIDTH = }')
+    print(f'{CellGrid.for_radius(SCREEN_WIDTH, SCREEN_HEIGHT, DISTANCE_RADIUS_CHECK, CELS_PER_RADIUS)}')
+
+
+DISTANCE_RADIUS_CHECK: int = 100
+SEPARATION_MARGIN: float = 50
+MAX_FORCE = 1
+MAX_SPEED = 200
+AVG_SIZE = 6
+# Max random rotation (degrees) applied to every velocity on each step
+JITTER_DEGREES: float = 2.5
+# Rows stepped at once, the unit of work of the thread pool
+CHUNK_SIZE: int = 4096
+# Neighbour search used by new flocks: 'grid' (CellGrid stencil) or 'kdtree' (PeriodicKDTree)
+NEIGHBOUR_BACKEND: str = 'grid'
+NEIGHBOUR_BACKENDS: tuple = ('grid', 'kdtree')
+# Use the compiled rules of Kernels.py when numba is installed (grid backend only)
+USE_JIT: bool = True
+# Approximate the cells farther than SEPARATION_MARGIN by their centre of mass, velocity sum and
+# count (grid backend only). Dense flocks then cost O(boids per cell) per boid instead of O(neighbours).
+# Its error against the exact rules is reported by `python -m boids farfield` (see README).
+FAR_FIELD: bool = False
+# Alignment and cohesion over every boid of the stencil cells, read from summed-area tables of the
+# cell sums in O(1) per boid (grid backend, NumPy rules). Separation keeps its exact pairs. Wins over FAR_FIELD.
+STENCIL_SUMS: bool = False
+# Interact with the NEIGHBOUR_LIMIT nearest boids within DISTANCE_RADIUS_CHECK only (about 7 in real
+# flocks), None for all of them. The cost per boid is then bounded by the limit, not by the density.
+NEIGHBOUR_LIMIT: int = None
+# Seed of the flocks created without a Generator, None for a different run every time
+SEED: int = None
+# Boids the per boid buffers hold at least, they double when full (see Flock.reserve)
+MIN_CAPACITY: int = 1024
+# Placement of the boids of Flock.spawn within its region
+SPAWN_DISTRIBUTIONS: tuple = ('uniform', 'gaussian')
+# Per boid arrays of a Flock: (shape of one boid, dtype)
+BOID_FIELDS: dict = {
+    'positions': ((2,), float),
+    'velocities': ((2,), float),
+    'accelerations': ((2,), float),
+    # Written by step and swapped with the front buffers
+    'backPositions': ((2,), float),
+    'backVelocities': ((2,), float),
+    # Neighbours within DISTANCE_RADIUS_CHECK of every boid found by the last step (boids with rules only)
+    'neighbourCounts': ((), np.intp),
+    'Separation': ((), bool),
+    'Alignment': ((), bool),
+    'Cohesion': ((), bool),
+}
+
+def set_neighbour_backend(name: str):
+    global NEIGHBOUR_BACKEND
+    if name not in NEIGHBOUR_BACKENDS:
+        raise ValueError(f'Unknown neighbour backend {name!r}, expected one of {NEIGHBOUR_BACKENDS}')
+    NEIGHBOUR_BACKEND = name
+def set_neighbour_limit(v: int):
+    global NEIGHBOUR_LIMIT
+    NEIGHBOUR_LIMIT = checked_neighbour_limit(v)
+def set_seed(v: int):
+    global SEED
+    SEED = v
+def set_stencil_sums(v: bool):
+    global STENCIL_SUMS
+    STENCIL_SUMS = v
+def set_far_field(v: bool):
+    global FAR_FIELD
+    FAR_FIELD = v
+def set_distance_radius(v: float):
+    """
+    Flocks re-grid on their next step
+    """
+    global DISTANCE_RADIUS_CHECK
+    DISTANCE_RADIUS_CHECK = v
+def set_max_force(v: float):
+    global MAX_FORCE
+    MAX_FORCE = v
+def set_max_speed(v: float):
+    global MAX_SPEED
+    MAX_SPEED = v
+
+
+class Flock:
+    """
+    Structure of arrays version of the Boid classes: every attribute of every boid lives
+    in one contiguous array, so a step is a handful of batched operations over the whole
+    flock instead of one Python call per boid.
+    """
+    def __init__(self, width: float = None, height: float = None, rng: np.random.Generator = None,
+                 backend: str = None, workers: int = None, jit: bool = None, profiler=None,
+                 far_field: bool = None, stencil_sums: bool = None, obstacles=None, neighbour_limit: int = None):
+        """
+        :param rng: Generator of the spawned boids, the jitter streams are derived from it (default_rng(SEED) by default)
+        :param workers: Threads stepping chunks of CHUNK_SIZE boids in parallel (one by default)
+        :param jit: Use the numba kernels (USE_JIT by default), ignored when numba is missing
+        :param far_field: Use the cell aggregates beyond SEPARATION_MARGIN (FAR_FIELD by default), grid only
+        :param neighbour_limit: Only the k nearest neighbours count (NEIGHBOUR_LIMIT by default). Exact by
+                                definition, so it turns far_field and stencil_sums off.
+        :param obstacles: ObstacleField (Obstacles.py) every boid steers away from
+        :param profiler: Profiler receiving the phase spans, neighbour counters and cell occupancy of every step
+        """
+        self.width = SCREEN_WIDTH if width is None else width
+        self.height = SCREEN_HEIGHT if height is None else height
+        self.rng = np.random.default_rng(SEED) if rng is None else rng
+        # Root of the jitter streams, one per chunk of rows (see chunk_rngs), and of the ParallelFlock workers
+        self.streams = np.random.SeedSequence(int(self.rng.integers(np.iinfo(np.int64).max)))
+        self.chunkRngs: list = []
+        self.backend: str = NEIGHBOUR_BACKEND if backend is None else backend
+        self.index = make_index(self.backend, self.width, self.height)
+        self.executor = ThreadPoolExecutor(workers) if workers is not None and workers > 1 else None
+        self.jit: bool = (USE_JIT if jit is None else jit) and Kernels.NUMBA_AVAILABLE \
+            and isinstance(self.index, CellGrid)
+        self.neighbourLimit: int = checked_neighbour_limit(NEIGHBOUR_LIMIT if neighbour_limit is None
+                                                           else neighbour_limit)
+        self.stencilSums: bool = (STENCIL_SUMS if stencil_sums is None else stencil_sums) and self.backend == 'grid' \
+            and self.neighbourLimit is None
+        self.farField: bool = (FAR_FIELD if far_field is None else far_field) and self.backend == 'grid' \
+            and not self.stencilSums and self.neighbourLimit is None
+        # The summed-area tables are NumPy only, the pairs left are the few of the separation
+        if self.stencilSums: self.jit = False
+        self.profiler = profiler
+        self.obstacles = obstacles
+        # Seconds spent by the last step in each phase
+        self.step_times: dict = {'neighbours': 0.0, 'rules': 0.0, 'integration': 0.0}
+
+        # Every field of BOID_FIELDS is the view [:count] of a buffer of capacity boids, so adding and
+        # removing boids moves only the boids added or removed
+        self.count: int = 0
+        self.buffers: dict = {name: np.empty((0,) + shape, dtype=dtype) for name, (shape, dtype) in BOID_FIELDS.items()}
+        self.set_count(0)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __str__(self):
+        return f'Flock({len(self)} boids | {self.width}x{self.height})'
+
+    def set_count(self, count: int) -> None:
+        """
+        Point every field of BOID_FIELDS at the first count boids of its buffer
+        """
+        self.count = count
+        for name, buffer in self.buffers.items():
+            setattr(self, name, buffer[:count])
+
+    def reserve(self, capacity: int) -> None:
+        """
+        Grow the buffers to hold at least capacity boids, doubling them so that adding boids one
+        batch at a time copies the flock O(log n) times only
+        """
+        current: int = len(self.buffers['positions'])
+        if capacity <= current: return
+        capacity = max(capacity, 2 * current, MIN_CAPACITY)
+        for name, buffer in self.buffers.items():
+            grown = np.zeros((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:self.count] = buffer[:self.count]
+            self.buffers[name] = grown
+        self.set_count(self.count)
+
+    def add(self, positions: np.ndarray, velocities: np.ndarray = None, separation: bool = False, alignment: bool = False, cohesion: bool = False) -> None:
+        """
+        Append boids at the given (n,2) positions. Missing velocities are random, as in Boid.
+        """
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        n: int = len(positions)
+        if velocities is None:
+            velocities = self.rng.uniform(-MAX_SPEED, MAX_SPEED, (n, 2))
+
+        first: int = self.count
+        self.reserve(first + n)
+        self.set_count(first + n)
+        rows = slice(first, first + n)
+        self.positions[rows] = positions
+        self.velocities[rows] = velocities
+        self.accelerations[rows] = self.rng.uniform(-MAX_SPEED, MAX_SPEED, (n, 2))
+        self.neighbourCounts[rows] = 0
+        self.Separation[rows] = separation
+        self.Alignment[rows] = alignment
+        self.Cohesion[rows] = cohesion
+        np.mod(self.positions[rows], (self.width, self.height), out=self.positions[rows])
+        # No previous step for them: interpolated_positions draws them where they are
+        self.backPositions[rows] = self.positions[rows]
+        self.backVelocities[rows] = self.velocities[rows]
+
+    def spawn(self, n: int, separation: bool = False, alignment: bool = False, cohesion: bool = False,
+              region: tuple = None, distribution: str = 'uniform') -> None:
+        """
+        Add n boids, every random value drawn in one call
+        :param region: (x0, y0, x1, y1) the boids are placed in, the whole screen by default
+        :param distribution: 'uniform' over the region, or 'gaussian' around its centre (a quarter of its
+                             size as standard deviation, wrapped around the screen)
+        """
+        if distribution not in SPAWN_DISTRIBUTIONS:
+            raise ValueError(f'Unknown spawn distribution {distribution!r}, expected one of {SPAWN_DISTRIBUTIONS}')
+        x0, y0, x1, y1 = (0, 0, self.width, self.height) if region is None else region
+        if distribution == 'uniform':
+            positions = self.rng.uniform((x0, y0), (x1, y1), (n, 2))
+        else:
+            positions = self.rng.normal(((x0 + x1) / 2, (y0 + y1) / 2), ((x1 - x0) / 4, (y1 - y0) / 4), (n, 2))
+        self.add(positions, None, separation, alignment, cohesion)
+
+    def remove(self, index) -> None:
+        """
+        Remove the boids selected by index (int, array of ints, slice or boolean mask of count boids).
+        The last boids take their places (the order is not kept), so only as many boids as removed are moved.
+        """
+        index = np.arange(self.count)[index] if isinstance(index, slice) else np.asarray(index)
+        if index.dtype == bool:
+            if index.shape != (self.count,):
+                raise IndexError(f'Boolean mask of shape {index.shape} for a flock of {self.count} boids')
+            index = np.flatnonzero(index)
+        else:
+            index = np.atleast_1d(index)
+            if len(index) and (index.min() < -self.count or index.max() >= self.count):
+                raise IndexError(f'Boid index out of range for a flock of {self.count} boids')
+            # Sorted without repetitions, negative indices counting from the end as in NumPy
+            index = np.sort(np.where(index < 0, index + self.count, index))
+            index = index[np.r_[True, index[1:] != index[:-1]]] if len(index) else index
+        if len(index) == 0: return
+        count: int = self.count - len(index)
+        # Removed boids within the first count slots, and kept boids beyond them: as many of each
+        holes = index[index < count]
+        tail = np.arange(count, self.count)
+        fillers = tail[~np.isin(tail, index, assume_unique=True)]
+        for buffer in self.buffers.values():
+            buffer[holes] = buffer[fillers]
+        self.set_count(count)
+
+    def despawn(self, selection) -> None:
+        """
+        :param selection: Number of boids to remove at random, or the boids to remove (see remove)
+        """
+        if isinstance(selection, (int, np.integer)):
+            selection = self.rng.choice(self.count, min(int(selection), self.count), replace=False)
+        self.remove(selection)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """
+        Drawing size of every boid, from its speed as Boid.size. Only computed when drawn.
+        """
+        return vector_norm(self.velocities) * AVG_SIZE / MAX_SPEED + AVG_SIZE
+
+    def interpolated_positions(self, alpha: float = None) -> np.ndarray:
+        """
+        :param alpha: Fraction of the last step, 0 = positions before it, 1 (or None) = current positions
+        :return: Positions between the last two steps, for rendering between physics steps.
+                 The back buffer still holds the positions before the last step.
+        """
+        if alpha is None or alpha >= 1:
+            return self.positions
+        previous = self.backPositions
+        # Boids that wrapped around the screen move by the short way, not across the whole screen
+        positions = previous + wrap_delta(self.positions - previous, self.width, self.height) * alpha
+        positions[:, X] %= self.width
+        positions[:, Y] %= self.height
+        return positions
+
+    def switch_separation(self, value: bool = None) -> None:
+        self.Separation[:] = ~self.Separation if value is None else value
+    def switch_alignment(self, value: bool = None) -> None:
+        self.Alignment[:] = ~self.Alignment if value is None else value
+    def switch_cohesion(self, value: bool = None) -> None:
+        self.Cohesion[:] = ~self.Cohesion if value is None else value
+
+    def set_neighbour_limit(self, k: int = None) -> None:
+        """
+        Cap of neighbours from the next step on, None for all of them. A cap turns far_field and
+        stencil_sums off for good.
+        """
+        self.neighbourLimit = checked_neighbour_limit(k)
+        if k is not None: self.farField = self.stencilSums = False
+
+    def move(self, dir: tuple) -> None:
+        """
+        Displace the whole flock by dir, like Boid.move_left/right/up/down. The positions before the
+        last step move too, so interpolated_positions does not blend across the jump.
+        """
+        self.positions += dir
+        self.backPositions += dir
+        self.normalize_position()
+
+    def change_velocity_direction(self, angle) -> None:
+        """
+        Rotate the velocities by angle degrees (scalar or one angle per boid)
+        """
+        self.velocities[:] = rotate(self.velocities, np.radians(angle))
+
+    def random_direction(self, degrees: float) -> None:
+        """
+        Rotate every velocity by its own random angle within +-degrees
+        """
+        self.change_velocity_direction(self.rng.uniform(-degrees, degrees, len(self)))
+
+    def add_obstacle(self, obstacle) -> None:
+        """
+        :param obstacle: Circle, Polygon or Mask (Obstacles.py), compiled into the field at once
+        """
+        if self.obstacles is None:
+            from Obstacles import ObstacleField
+            self.obstacles = ObstacleField(self.width, self.height)
+        self.obstacles.add(obstacle)
+
+    def clear_obstacles(self) -> None:
+        self.obstacles = None
+
+    def normalize_position(self) -> None:
+        """
+        Wrap the positions, and the positions before the last step (interpolated_positions), into the screen
+        """
+        for positions in (self.positions, self.backPositions):
+            np.mod(positions[:, X], self.width, out=positions[:, X])
+            np.mod(positions[:, Y], self.height, out=positions[:, Y])
+
+    def resize(self, width: float, height: float) -> None:
+        """
+        New screen size, the boids keep their place modulo the new size. Re-grids on the next step.
+        """
+        self.width = width
+        self.height = height
+        if self.obstacles is not None and not self.obstacles.fits(width, height):
+            self.obstacles = self.obstacles.resized(width, height)
+        self.normalize_position()
+
+    def fit_index(self) -> None:
+        """
+        Rebuild the neighbour structure when the screen size or DISTANCE_RADIUS_CHECK changed
+        """
+        if not self.index.fits(self.width, self.height, DISTANCE_RADIUS_CHECK):
+            self.index = make_index(self.backend, self.width, self.height)
+
+    def neighbour_pairs(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: (i, j, delta) for every ordered pair of distinct boids closer than
+                 DISTANCE_RADIUS_CHECK, delta being the wrapped vector from boid i to boid j
+        """
+        self.fit_index()
+        return self.index.neighbour_pairs(self.positions, DISTANCE_RADIUS_CHECK)
+
+    def step(self, deltaTime: float) -> None:
+        """
+        Advance every boid by deltaTime: rules, jitter, speed clamping and wrap-around.
+        Synchronous (Jacobi) update: every chunk of rows reads the front buffers and writes its
+        rows of the back buffers, which are swapped at the end. No boid sees a neighbour that
+        already moved this step, so the chunks can run in any order or in parallel.
+        """
+        n: int = len(self)
+        if n == 0: return
+
+        start: float = time.perf_counter()
+        active = self.Separation | self.Alignment | self.Cohesion
+        if active.any():
+            self.fit_index()
+            self.index.rebuild(self.positions)
+            if self.farField or self.stencilSums:
+                self.index.split_stencil(SEPARATION_MARGIN)
+            if self.farField:
+                self.index.aggregate(self.positions, self.velocities)
+            if self.stencilSums:
+                self.index.stencil_sums(self.positions, self.velocities)
+        rebuilt: float = time.perf_counter() - start
+        profiling: bool = self.profiler is not None and self.profiler.enabled
+        if profiling: self.profiler.add_span('grid rebuild', start, start + rebuilt)
+
+        # Without threads of our own, numba spreads the whole flock over every core in one call
+        fused: bool = self.jit and self.executor is None and active.any()
+        if fused and self.neighbourLimit is not None:
+            Kernels.grid_nearest_acceleration(Kernels.parallel_nearest_acceleration, 0, n, self.positions,
+                                              self.velocities, self.Separation, self.Alignment, self.Cohesion,
+                                              self.index, DISTANCE_RADIUS_CHECK, self.neighbourLimit, MAX_FORCE,
+                                              SEPARATION_MARGIN, self.accelerations, self.neighbourCounts)
+        elif fused and self.farField:
+            Kernels.grid_far_acceleration(Kernels.parallel_far_acceleration, 0, n, self.positions, self.velocities,
+                                          self.Separation, self.Alignment, self.Cohesion, self.index,
+                                          DISTANCE_RADIUS_CHECK, MAX_FORCE, SEPARATION_MARGIN, self.accelerations,
+                                          self.neighbourCounts)
+        elif fused:
+            Kernels.grid_acceleration(Kernels.parallel_acceleration, 0, n, self.positions, self.velocities,
+                                      self.Separation, self.Alignment, self.Cohesion, self.index,
+                                      DISTANCE_RADIUS_CHECK, MAX_FORCE, SEPARATION_MARGIN, self.accelerations,
+                                      self.neighbourCounts)
+        fusedTime: float = time.perf_counter() - start - rebuilt
+        if profiling and fused: self.profiler.add_span('rules', start + rebuilt, start + rebuilt + fusedTime)
+
+        # Every chunk draws its jitter from its own stream, the result does not depend on which thread runs it
+        chunks = [(first, min(first + CHUNK_SIZE, n), rng)
+                  for first, rng in zip(range(0, n, CHUNK_SIZE), self.chunk_rngs(-(-n // CHUNK_SIZE)))]
+        params: tuple = (deltaTime, active & (not fused), DISTANCE_RADIUS_CHECK, MAX_FORCE, MAX_SPEED)
+        if self.executor is None or len(chunks) == 1:
+            times = [self.step_rows(*chunk, *params) for chunk in chunks]
+        else:
+            times = list(self.executor.map(lambda chunk: self.step_rows(*chunk, *params), chunks))
+
+        self.positions, self.backPositions = self.backPositions, self.positions
+        self.velocities, self.backVelocities = self.backVelocities, self.velocities
+        buffers: dict = self.buffers
+        buffers['positions'], buffers['backPositions'] = buffers['backPositions'], buffers['positions']
+        buffers['velocities'], buffers['backVelocities'] = buffers['backVelocities'], buffers['velocities']
+
+        # Chunk times are summed, with threads they add up to more than the wall time
+        self.step_times = {'neighbours': rebuilt + sum(t[0] for t in times),
+                           'rules': fusedTime + sum(t[1] for t in times),
+                           'integration': sum(t[2] for t in times)}
+        if profiling and active.any():
+            self.profile_neighbours(active)
+
+    def step_rows(self, first: int, last: int, rng: np.random.Generator, deltaTime: float, active: np.ndarray,
+                  radius: float, force: float, speed: float) -> tuple[float, float, float]:
+        """
+        Step the boids [first, last) from the front buffers into the back buffers
+        :param rng: Jitter stream of the chunk
+        :return: Seconds spent in (neighbour search, rules, integration)
+        """
+        rows = slice(first, last)
+        start: float = time.perf_counter()
+        searched: float = start
+        if active[rows].any() and self.jit:
+            # Neighbour search and rules are fused in the kernel, all its time counts as rules
+            if self.neighbourLimit is not None:
+                Kernels.grid_nearest_acceleration(Kernels.rows_nearest_acceleration, first, last, self.positions,
+                                                  self.velocities, self.Separation, self.Alignment, self.Cohesion,
+                                                  self.index, radius, self.neighbourLimit, force, SEPARATION_MARGIN,
+                                                  self.accelerations, self.neighbourCounts)
+            elif self.farField:
+                Kernels.grid_far_acceleration(Kernels.rows_far_acceleration, first, last, self.positions,
+                                              self.velocities, self.Separation, self.Alignment, self.Cohesion,
+                                              self.index, radius, force, SEPARATION_MARGIN, self.accelerations,
+                                              self.neighbourCounts)
+            else:
+                Kernels.grid_acceleration(Kernels.rows_acceleration, first, last, self.positions, self.velocities,
+                                          self.Separation, self.Alignment, self.Cohesion, self.index,
+                                          radius, force, SEPARATION_MARGIN, self.accelerations, self.neighbourCounts)
+        elif active[rows].any():
+            rowIndex = np.arange(first, last)
+            far = sums = None
+            if self.stencilSums:
+                # Only the separation needs pairs, and only closer than SEPARATION_MARGIN
+                if self.Separation[rows].any():
+                    i, j, delta = self.index.query_pairs(self.positions, min(radius, SEPARATION_MARGIN), rowIndex,
+                                                         inner=True)
+                else:
+                    i, j, delta = np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty((0, 2))
+                sums = self.index.stencil_totals(self.positions, self.velocities, rowIndex)
+            elif self.neighbourLimit is not None:
+                i, j, delta = self.index.nearest_pairs(self.positions, radius, self.neighbourLimit, rowIndex)
+            elif self.farField:
+                i, j, delta = self.index.query_pairs(self.positions, radius, rowIndex, inner=True)
+                far = self.index.far_field(self.positions, radius, rowIndex)
+            else:
+                # The kd-tree has no split stencil, only the grid takes inner
+                i, j, delta = self.index.query_pairs(self.positions, radius, rowIndex)
+            searched = time.perf_counter()
+            acceleration = rule_acceleration(last - first, i - first, j, delta, self.velocities,
+                                             self.Separation[rows], self.Alignment[rows], self.Cohesion[rows], force,
+                                             far=far, sums=sums)
+            # Boids without rules keep their last acceleration, as Boid.boid_movement does
+            accelerations = self.accelerations[rows]
+            accelerations[active[rows]] = acceleration[active[rows]]
+            if sums is not None:
+                found = sums[0]
+            else:
+                found = np.bincount(i - first, minlength=last - first) \
+                    + (0 if far is None else np.rint(far[0]).astype(np.intp))
+            counts = self.neighbourCounts[rows]
+            counts[active[rows]] = found[active[rows]]
+        ruled: float = time.perf_counter()
+
+        jitter = rng.uniform(-JITTER_DEGREES, JITTER_DEGREES, last - first)
+        accelerations = self.accelerations[rows]
+        if self.obstacles is not None:
+            # Every boid avoids the obstacles, with or without rules, without keeping the push
+            accelerations = accelerations + self.obstacles.avoidance(self.positions[rows], force)
+        self.backPositions[rows], self.backVelocities[rows] = integrate(
+            self.positions[rows], self.velocities[rows], accelerations, jitter,
+            deltaTime, self.width, self.height, speed)
+        end: float = time.perf_counter()
+        if self.profiler is not None and self.profiler.enabled:
+            if searched > start: self.profiler.add_span('neighbours', start, searched)
+            if ruled > searched: self.profiler.add_span('rules', searched, ruled)
+            self.profiler.add_span('integration', ruled, end)
+        return searched - start, ruled - searched, end - ruled
+
+    def chunk_rngs(self, count: int) -> list:
+        """
+        :return: Jitter Generators of the first count chunks. Chunk k always draws from stream k,
+                 so a seeded flock steps the same with any number of threads.
+        """
+        if len(self.chunkRngs) < count:
+            self.chunkRngs += [np.random.default_rng(s) for s in self.streams.spawn(count - len(self.chunkRngs))]
+        return self.chunkRngs[:count]
+
+    def profile_neighbours(self, active: np.ndarray) -> None:
+        """
+        Counters of the last step: boids tested against each other (grid only) versus found
+        within DISTANCE_RADIUS_CHECK, and histogram of the boids per cell
+        """
+        start: float = time.perf_counter()
+        self.profiler.count('accepted', int(self.neighbourCounts[active].sum()))
+        if isinstance(self.index, CellGrid):
+            self.profiler.count('candidates', self.index.candidate_count(active))
+            self.profiler.histogram('cell occupancy', np.bincount(self.index.cell_count))
+        self.profiler.add_span('profiling', start, time.perf_counter())
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def checked_neighbour_limit(k: int) -> int:
+    """
+    :return: k, when it is None or at least one neighbour
+    """
+    if k is not None and k < 1:
+        raise ValueError(f'Neighbour limit must be at least 1 or None, got {k}')
+    return k
+
+def make_index(backend: str, width: float, height: float):
+    """
+    :return: The neighbour search structure named by backend (see NEIGHBOUR_BACKENDS)
+    """
+    if backend == 'grid':
+        return CellGrid.for_radius(width, height, DISTANCE_RADIUS_CHECK, CELS_PER_RADIUS)
+    if backend == 'kdtree':
+        # scipy is only loaded by the flocks that use it
+        from PeriodicTree import PeriodicKDTree
+        return PeriodicKDTree(width, height)
+    raise ValueError(f'Unknown neighbour backend {backend!r}, expected one of {NEIGHBOUR_BACKENDS}')
+
+def rule_acceleration(n: int, i: np.ndarray, j: np.ndarray, delta: np.ndarray, velocities: np.ndarray,
+                      separation: np.ndarray, alignment: np.ndarray, cohesion: np.ndarray,
+                      force: float = None, margin: float = None, far: tuple = None, sums: tuple = None) -> np.ndarray:
+    """
+    :param n: Number of boids
+    :param i: Boid receiving the contribution of each pair
+    :param j: Neighbour of each pair
+    :param delta: Wrapped vector from boid i to boid j for each pair
+    :param force: Scalar or one per boid
+    :param margin: Scalar or one per pair
+    :param far: (count, delta sum, velocity sum) per boid of the neighbours not in the pairs
+                (CellGrid.far_field), added to alignment and cohesion
+    :param sums: (count, delta sum, velocity sum) per boid (CellGrid.stencil_totals) used for alignment and
+                 cohesion instead of the pairs, which then only feed the separation
+    :return: (n,2) acceleration from separation, alignment and cohesion, limited to force
+    """
+    if force is None: force = MAX_FORCE
+    if margin is None: margin = SEPARATION_MARGIN
+
+    if sums is not None:
+        count, sumPosition, sumDir = sums[0].astype(float), sums[1], sums[2]
+    else:
+        count = np.bincount(i, minlength=n).astype(float)
+        sumDir = np.stack((np.bincount(i, velocities[j, X], n), np.bincount(i, velocities[j, Y], n)), axis=1)
+        sumPosition = np.stack((np.bincount(i, delta[:, X], n), np.bincount(i, delta[:, Y], n)), axis=1)
+    if far is not None:
+        count += far[0]; sumPosition += far[1]; sumDir += far[2]
+    safeCount = np.maximum(count, 1)[:, None]
+    acceleration = np.zeros((n, 2))
+
+    # Alignment: boids attempt to match the velocities of their neighbors.
+    avgDir = sumDir / safeCount
+    acceleration += normalize_acceleration(avgDir, force) * alignment[:, None]
+
+    # Cohesion: boids move toward the center of mass of their neighbors.
+    avgPosition = sumPosition / safeCount
+    acceleration += normalize_acceleration(avgPosition, force) * cohesion[:, None]
+
+    # Separation: boids move away from other boids that are too close.
+    coefficient = separation_coefficient(vector_norm(delta), margin)
+    separationDir = np.stack((np.bincount(i, -delta[:, X] * coefficient, n),
+                              np.bincount(i, -delta[:, Y] * coefficient, n)), axis=1)
+    acceleration += normalize_acceleration(separationDir, force) * separation[:, None]
+
+    return normalize_acceleration(acceleration, force)
+
+def integrate(positions: np.ndarray, velocities: np.ndarray, accelerations: np.ndarray, jitter: np.ndarray,
+              deltaTime: float, width: float, height: float, maxSpeed: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param jitter: Random rotation (degrees) of every velocity
+    :return: (positions, velocities) after one step: jitter, acceleration, speed clamping and wrap-around
+    """
+    velocities = rotate(velocities, np.radians(jitter)) + accelerations
+    velocities = normalize_acceleration(velocities, maxSpeed)
+    positions = positions + velocities * deltaTime
+    positions[:, X] %= width
+    positions[:, Y] %= height
+    return positions, velocities
+
+def wrap_delta(delta: np.ndarray, width: float, height: float) -> np.ndarray:
+    """
+    :return: The shortest vector equivalent to delta on the wrapped (toroidal) screen
+    """
+    delta[..., X] -= width * np.round(delta[..., X] / width)
+    delta[..., Y] -= height * np.round(delta[..., Y] / height)
+    return delta
+
+def rotate(vectors: np.ndarray, theta) -> np.ndarray:
+    """
+    :return: The (n,2) vectors rotated by theta radians (scalar or one angle per row)
+    """
+    cos, sin = np.cos(theta), np.sin(theta)
+    return np.stack((vectors[:, X] * cos - vectors[:, Y] * sin,
+                     vectors[:, X] * sin + vectors[:, Y] * cos), axis=1)
+
+def normalize_acceleration(acceleration: np.ndarray, force: float = None) -> np.ndarray:
+    """
+    :return: Limit de (n,2) accelerations to a max force
+    """
+    if force is None: force = MAX_FORCE
+    norm = vector_norm(acceleration)
+    scale = np.where(norm > force, force / np.maximum(norm, ZERO), 1.0)
+    return acceleration * scale[:, None]
+
+def vector_norm(vect: np.ndarray) -> np.ndarray:
+    """
+    :return: The norm of every (dx,dy) row
+    """
+    return np.sqrt(np.einsum('ij,ij->i', vect, vect))
+
+def separation_coefficient(dist: np.ndarray, margin: float = None) -> np.ndarray:
+    """
+    :return: A value depending on the distance between the two boids
+    """
+    if margin is None: margin = SEPARATION_MARGIN
+    aux = np.maximum(np.log(np.maximum(dist, ZERO) + 1), ZERO)
+    return np.where(dist > margin, 0, 50000 / aux)
+
+def hsv_a_rgb(h: np.ndarray, s: float = 1.0, v: float = 1.0) -> np.ndarray:
+    """
+    :param h: Hue of every boid
+    :param s: Saturation
+    :param v: Value
+    :return: (n,3) array of (R,G,B)
+    """
+    h = np.asarray(h, dtype=float)
+    i = (h * 6).astype(int)
+    f = h * 6 - i
+    p = np.full_like(h, v * (1 - s))
+    q = v * (1 - f * s)
+    t = v * (1 - (1 - f) * s)
+    v = np.full_like(h, v)
+    i = i % 6
+    return np.select([i[:, None] == k for k in range(6)],
+                     [np.stack(c, axis=1) for c in ((v, t, p), (q, v, p), (p, v, t),
+                                                    (p, q, v), (t, p, v), (v, p, q))])
@@ -0,0 +1,154 @@
+import json
+import time
+from collections import deque
+
+from Profiler import Span
+
+'''
+=====================================================
+    FRAME BUDGET GOVERNOR: TRADE QUALITY FOR A STEADY FRAME RATE
+=====================================================
+    Every frame is timed phase by phase. When the frames run over the budget the governor
+    degrades one quality knob of the most expensive phase, when they are well under it again
+    it restores the last knob it degraded. Every decision is printed and kept (and optionally
+    appended to a JSON lines file), so what was traded away is never a guess.
+'''
+# Frames averaged before a decision, and after a decision before the next one
+DEGRADE_FRAMES: int = 10
+# Frames well under the budget before a knob is restored, longer than DEGRADE_FRAMES to avoid flickering
+RESTORE_FRAMES: int = 120
+# A knob is restored only if the frames, plus what degrading it saved, stay under this fraction of the budget
+RESTORE_HEADROOM: float = 0.8
+
+# (knob, degraded value, phase it makes cheaper), cheapest loss of fidelity first. Knobs only
+# registered in the Governor are used; a knob degraded twice goes back through its values in order.
+QUALITY_STEPS: list = [
+    ('hud_fps', 1, 'hud'),                  # HUD texts rendered once a second
+    ('points', True, 'draw'),               # Boids drawn as points instead of sprites
+    ('neighbour_limit', 16, 'physics'),     # Rules over the 16 nearest neighbours only
+    ('physics_rate', 60, 'physics'),        # Physics steps per simulated second
+    ('neighbour_limit', 7, 'physics'),
+    ('radius', 0.75, 'physics'),            # Fraction of the neighbour radius (smaller stencil)
+    ('physics_rate', 30, 'physics'),
+    ('radius', 0.5, 'physics'),
+]
+
+def set_degrade_frames(v: int):
+    global DEGRADE_FRAMES
+    DEGRADE_FRAMES = v
+def set_restore_frames(v: int):
+    global RESTORE_FRAMES
+    RESTORE_FRAMES = v
+def set_restore_headroom(v: float):
+    global RESTORE_HEADROOM
+    RESTORE_HEADROOM = v
+
+
+class Governor:
+    """
+    Keeps the frame time under budget by walking QUALITY_STEPS down (degrade) and back up
+    (restore). Phases are timed with span(), like Profiler.span, and forwarded to the profiler.
+    """
+    def __init__(self, budget: float, knobs: dict, steps: list = None, profiler=None, log: str = None):
+        """
+        :param budget: Target frame time (s)
+        :param knobs: name: (full quality value, setter) of the knobs it may change
+        :param steps: Degradation ladder, QUALITY_STEPS by default
+        :param profiler: Profiler (Profiler.py) also receiving the phase spans
+        :param log: JSON lines file every decision is appended to
+        """
+        self.budget = budget
+        self.setters: dict = {name: setter for name, (_, setter) in knobs.items()}
+        self.values: dict = {name: value for name, (value, _) in knobs.items()}
+        self.steps: list = [step for step in (QUALITY_STEPS if steps is None else steps) if step[0] in knobs]
+        self.profiler = profiler
+        self.log = log
+        # Degraded steps, last one on top: {step, previous, before, saving}
+        self.applied: list = []
+        self.decisions: list = []
+        # (frame time, {phase: s}) of the frames since the last decision
+        self.frames: deque = deque(maxlen=max(DEGRADE_FRAMES, RESTORE_FRAMES))
+        self.phases: dict = {}
+        self.lastFrame: float = None
+        self.origin: float = time.perf_counter()
+
+    def __str__(self):
+        return f'Governor({self.budget * 1000:.1f} ms | {len(self.applied)}/{len(self.steps)} steps degraded)'
+
+    @property
+    def level(self) -> int:
+        return len(self.applied)
+
+    def span(self, name: str) -> Span:
+        return Span(self, name)
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + end - start
+        if self.profiler is not None: self.profiler.add_span(name, start, end)
+
+    def end_frame(self) -> dict:
+        """
+        Close the frame (its time is the wall time since the last call) and maybe change a knob
+        :return: The decision taken, None most frames
+        """
+        now: float = time.perf_counter()
+        if self.lastFrame is not None:
+            self.frames.append((now - self.lastFrame, self.phases))
+        self.lastFrame = now
+        self.phases = {}
+
+        if len(self.frames) >= DEGRADE_FRAMES:
+            recent: list = list(self.frames)[-DEGRADE_FRAMES:]
+            frameTime: float = sum(frame for frame, _ in recent) / len(recent)
+            top: dict = self.applied[-1] if self.applied else None
+            if top is not None and top['saving'] is None:
+                # First frames since this step was degraded: what it saved
+                top['saving'] = max(top['before'] - frameTime, 0.0)
+            if frameTime > self.budget:
+                return self.degrade(frameTime, recent)
+            if len(self.frames) >= RESTORE_FRAMES and top is not None:
+                frameTime = sum(frame for frame, _ in self.frames) / len(self.frames)
+                if frameTime + top['saving'] <= RESTORE_HEADROOM * self.budget:
+                    return self.restore(frameTime)
+        return None
+
+    def degrade(self, frameTime: float, frames: list) -> dict:
+        """
+        Degrade the next step of the most expensive phase that has one left
+        """
+        phases: dict = {}
+        for _, spans in frames:
+            for name, seconds in spans.items():
+                phases[name] = phases.get(name, 0.0) + seconds / len(frames)
+        applied: set = {id(entry['step']) for entry in self.applied}
+        pending: list = [step for step in self.steps if id(step) not in applied]
+        if not pending: return None
+        step = max(pending, key=lambda step: (phases.get(step[2], 0.0), -pending.index(step)))
+        entry: dict = {'step': step, 'previous': self.values[step[0]], 'before': frameTime, 'saving': None}
+        self.applied.append(entry)
+        return self.decide('degrade', step[0], entry['previous'], step[1], frameTime, phases)
+
+    def restore(self, frameTime: float) -> dict:
+        """
+        Undo the last degraded step
+        """
+        entry: dict = self.applied.pop()
+        knob, value, _ = entry['step']
+        # A knob degraded again later goes back to the value that step had set
+        return self.decide('restore', knob, value, entry['previous'], frameTime, {})
+
+    def decide(self, action: str, knob: str, old, new, frameTime: float, phases: dict) -> dict:
+        self.values[knob] = new
+        self.setters[knob](new)
+        self.frames.clear()
+        decision: dict = {'time': round(time.perf_counter() - self.origin, 3), 'action': action, 'knob': knob,
+                          'from': old, 'to': new, 'frame ms': round(frameTime * 1000, 2),
+                          'budget ms': round(self.budget * 1000, 2), 'level': self.level,
+                          'phases ms': {name: round(seconds * 1000, 2) for name, seconds in phases.items()}}
+        self.decisions.append(decision)
+        print(f'Governor {action} {knob}: {old} -> {new} ({decision["frame ms"]} ms per frame, '
+              f'budget {decision["budget ms"]} ms, level {self.level})')
+        if self.log is not None:
+            with open(self.log, 'a') as file:
+                file.write(json.dumps(decision) + '\n')
+        return decision
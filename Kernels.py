@@ -0,0 +1,309 @@
+import math
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE: bool = True
+except ImportError:
+    NUMBA_AVAILABLE: bool = False
+
+    # Same functions as plain python: importable and debuggable, far too slow to be used by Flock
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda function: function
+    prange = range
+
+'''
+=====================================================
+    COMPILED BOID RULES OVER THE CELL GRID (NUMBA)
+=====================================================
+    Same rules as Flock.rule_acceleration, but walking the CellGrid stencil of every boid
+    directly, so no pair list is materialised. cache=True stores the machine code next to
+    this file, only the first launch pays the compilation.
+'''
+ZERO: float = 1e-8
+# Rows sharing one set of scratch arrays in parallel_nearest_acceleration
+NEAREST_BLOCK: int = 256
+
+
+@njit(cache=True, nogil=True)
+def limit(x: float, y: float, force: float) -> tuple:
+    """
+    :return: (x,y) limited to a max norm of force
+    """
+    norm: float = math.sqrt(x * x + y * y)
+    if norm > force:
+        return x * force / norm, y * force / norm
+    return x, y
+
+@njit(cache=True, nogil=True)
+def boid_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                      cellCount, cells, neighbourCells, neighbourShifts, radius, force, margin, out, counts) -> None:
+    """
+    Write in out[row] the acceleration of the boid row from the boids in its stencil, and in
+    counts[row] how many of them are within radius
+    """
+    x: float = positions[row, 0]; y: float = positions[row, 1]
+    radius2: float = radius * radius
+    count: int = 0
+    avgX: float = 0.0; avgY: float = 0.0
+    avgDirX: float = 0.0; avgDirY: float = 0.0
+    separationX: float = 0.0; separationY: float = 0.0
+
+    cell = cells[row]
+    for k in range(neighbourCells.shape[1]):
+        neighbourCell = neighbourCells[cell, k]
+        shiftX: float = neighbourShifts[cell, k, 0]; shiftY: float = neighbourShifts[cell, k, 1]
+        start = cellStart[neighbourCell]
+        for slot in range(start, start + cellCount[neighbourCell]):
+            other = order[slot]
+            if other == row: continue
+            dx: float = positions[other, 0] + shiftX - x
+            dy: float = positions[other, 1] + shiftY - y
+            dist2: float = dx * dx + dy * dy
+            if dist2 > radius2: continue
+
+            count += 1
+            avgX += dx; avgY += dy
+            avgDirX += velocities[other, 0]; avgDirY += velocities[other, 1]
+            dist: float = math.sqrt(dist2)
+            if dist <= margin:
+                coefficient: float = 50000 / max(math.log(max(dist, ZERO) + 1), ZERO)
+                separationX -= dx * coefficient; separationY -= dy * coefficient
+
+    apply_rules(row, count, avgX, avgY, avgDirX, avgDirY, separationX, separationY, separation, alignment,
+                cohesion, force, out, counts)
+
+@njit(cache=True, nogil=True)
+def apply_rules(row, count, avgX, avgY, avgDirX, avgDirY, separationX, separationY, separation, alignment,
+                cohesion, force, out, counts) -> None:
+    """
+    Write in out[row] the acceleration from the sums over the count neighbours of the boid row
+    """
+    # Rounded for boid_far_acceleration, whose weighted outer cells make count fractional
+    counts[row] = int(count + 0.5)
+    accelerationX: float = 0.0; accelerationY: float = 0.0
+    if count > 0:
+        if alignment[row]:
+            ax, ay = limit(avgDirX / count, avgDirY / count, force)
+            accelerationX += ax; accelerationY += ay
+        if cohesion[row]:
+            ax, ay = limit(avgX / count, avgY / count, force)
+            accelerationX += ax; accelerationY += ay
+        if separation[row]:
+            ax, ay = limit(separationX, separationY, force)
+            accelerationX += ax; accelerationY += ay
+    out[row, 0], out[row, 1] = limit(accelerationX, accelerationY, force)
+
+@njit(cache=True, nogil=True)
+def boid_far_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                          cellCount, cells, innerCells, innerShifts, outerCells, outerShifts, cellPositions,
+                          cellVelocities, radius, side, force, margin, out, counts) -> None:
+    """
+    boid_acceleration with the boids of the outer cells replaced by their cell aggregates
+    (CellGrid.split_stencil / CellGrid.aggregate). Separation only comes from the inner cells.
+    """
+    x: float = positions[row, 0]; y: float = positions[row, 1]
+    radius2: float = radius * radius
+    count: float = 0.0
+    avgX: float = 0.0; avgY: float = 0.0
+    avgDirX: float = 0.0; avgDirY: float = 0.0
+    separationX: float = 0.0; separationY: float = 0.0
+
+    cell = cells[row]
+    for k in range(innerCells.shape[1]):
+        neighbourCell = innerCells[cell, k]
+        shiftX: float = innerShifts[cell, k, 0]; shiftY: float = innerShifts[cell, k, 1]
+        start = cellStart[neighbourCell]
+        for slot in range(start, start + cellCount[neighbourCell]):
+            other = order[slot]
+            if other == row: continue
+            dx: float = positions[other, 0] + shiftX - x
+            dy: float = positions[other, 1] + shiftY - y
+            dist2: float = dx * dx + dy * dy
+            if dist2 > radius2: continue
+
+            count += 1
+            avgX += dx; avgY += dy
+            avgDirX += velocities[other, 0]; avgDirY += velocities[other, 1]
+            dist: float = math.sqrt(dist2)
+            if dist <= margin:
+                coefficient: float = 50000 / max(math.log(max(dist, ZERO) + 1), ZERO)
+                separationX -= dx * coefficient; separationY -= dy * coefficient
+
+    # Same weight as CellGrid.far_field_weight
+    for k in range(outerCells.shape[1]):
+        neighbourCell = outerCells[cell, k]
+        cellCountK = cellCount[neighbourCell]
+        if cellCountK == 0: continue
+        dx: float = cellPositions[neighbourCell, 0] / cellCountK + outerShifts[cell, k, 0] - x
+        dy: float = cellPositions[neighbourCell, 1] / cellCountK + outerShifts[cell, k, 1] - y
+        weight: float = min(max((radius - math.sqrt(dx * dx + dy * dy)) / side + 0.5, 0.0), 1.0)
+        if weight == 0.0: continue
+
+        count += weight * cellCountK
+        avgX += dx * weight * cellCountK; avgY += dy * weight * cellCountK
+        avgDirX += cellVelocities[neighbourCell, 0] * weight; avgDirY += cellVelocities[neighbourCell, 1] * weight
+
+    apply_rules(row, count, avgX, avgY, avgDirX, avgDirY, separationX, separationY, separation, alignment,
+                cohesion, force, out, counts)
+
+@njit(cache=True, nogil=True)
+def boid_nearest_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                              cellCount, cells, sortedCells, sortedShifts, sortedGaps, radius, k, force, margin,
+                              out, counts, bestDist2, bestOther, bestDx, bestDy) -> None:
+    """
+    boid_acceleration over the k nearest boids within radius only. The stencil columns are
+    visited nearest first (CellGrid.sort_stencil) and the search ends as soon as the k nearest
+    found are closer than the next column can be.
+    :param bestDist2: Scratch of at least k values for the k nearest so far, sorted by distance,
+                      with bestOther, bestDx and bestDy. Reused from boid to boid.
+    """
+    x: float = positions[row, 0]; y: float = positions[row, 1]
+    radius2: float = radius * radius
+    found: int = 0
+
+    cell = cells[row]
+    for c in range(sortedCells.shape[1]):
+        gap: float = sortedGaps[c]
+        if gap > radius or (found == k and bestDist2[k - 1] <= gap * gap): break
+        neighbourCell = sortedCells[cell, c]
+        shiftX: float = sortedShifts[cell, c, 0]; shiftY: float = sortedShifts[cell, c, 1]
+        start = cellStart[neighbourCell]
+        for slot in range(start, start + cellCount[neighbourCell]):
+            other = order[slot]
+            if other == row: continue
+            dx: float = positions[other, 0] + shiftX - x
+            dy: float = positions[other, 1] + shiftY - y
+            dist2: float = dx * dx + dy * dy
+            if dist2 > radius2 or (found == k and dist2 >= bestDist2[k - 1]): continue
+
+            # Insertion into the sorted k best, the farthest one drops out when full
+            n: int = found if found < k else k - 1
+            while n > 0 and bestDist2[n - 1] > dist2:
+                bestDist2[n] = bestDist2[n - 1]; bestOther[n] = bestOther[n - 1]
+                bestDx[n] = bestDx[n - 1]; bestDy[n] = bestDy[n - 1]
+                n -= 1
+            bestDist2[n] = dist2; bestOther[n] = other; bestDx[n] = dx; bestDy[n] = dy
+            if found < k: found += 1
+
+    avgX: float = 0.0; avgY: float = 0.0
+    avgDirX: float = 0.0; avgDirY: float = 0.0
+    separationX: float = 0.0; separationY: float = 0.0
+    for n in range(found):
+        dx: float = bestDx[n]; dy: float = bestDy[n]
+        avgX += dx; avgY += dy
+        avgDirX += velocities[bestOther[n], 0]; avgDirY += velocities[bestOther[n], 1]
+        dist: float = math.sqrt(bestDist2[n])
+        if dist <= margin:
+            coefficient: float = 50000 / max(math.log(max(dist, ZERO) + 1), ZERO)
+            separationX -= dx * coefficient; separationY -= dy * coefficient
+
+    apply_rules(row, found, avgX, avgY, avgDirX, avgDirY, separationX, separationY, separation, alignment,
+                cohesion, force, out, counts)
+
+@njit(cache=True, nogil=True)
+def rows_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                      cellCount, cells, neighbourCells, neighbourShifts, radius, force, margin, out, counts) -> None:
+    """
+    Serial over [first, last), without the GIL so several threads can run it on disjoint rows
+    """
+    for row in range(first, last):
+        if separation[row] or alignment[row] or cohesion[row]:
+            boid_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                              cellCount, cells, neighbourCells, neighbourShifts, radius, force, margin, out, counts)
+
+@njit(cache=True, nogil=True, parallel=True)
+def parallel_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                          cellCount, cells, neighbourCells, neighbourShifts, radius, force, margin, out, counts) -> None:
+    """
+    Same as rows_acceleration with the rows spread over every core by numba itself
+    """
+    for row in prange(first, last):
+        if separation[row] or alignment[row] or cohesion[row]:
+            boid_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                              cellCount, cells, neighbourCells, neighbourShifts, radius, force, margin, out, counts)
+
+@njit(cache=True, nogil=True)
+def rows_far_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                          cellCount, cells, innerCells, innerShifts, outerCells, outerShifts, cellPositions,
+                          cellVelocities, radius, side, force, margin, out, counts) -> None:
+    for row in range(first, last):
+        if separation[row] or alignment[row] or cohesion[row]:
+            boid_far_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                                  cellCount, cells, innerCells, innerShifts, outerCells, outerShifts,
+                                  cellPositions, cellVelocities, radius, side, force, margin, out, counts)
+
+@njit(cache=True, nogil=True, parallel=True)
+def parallel_far_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order,
+                              cellStart, cellCount, cells, innerCells, innerShifts, outerCells, outerShifts,
+                              cellPositions, cellVelocities, radius, side, force, margin, out, counts) -> None:
+    for row in prange(first, last):
+        if separation[row] or alignment[row] or cohesion[row]:
+            boid_far_acceleration(row, positions, velocities, separation, alignment, cohesion, order, cellStart,
+                                  cellCount, cells, innerCells, innerShifts, outerCells, outerShifts,
+                                  cellPositions, cellVelocities, radius, side, force, margin, out, counts)
+
+@njit(cache=True, nogil=True)
+def rows_nearest_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order,
+                              cellStart, cellCount, cells, sortedCells, sortedShifts, sortedGaps, radius, k, force,
+                              margin, out, counts) -> None:
+    """
+    Serial over [first, last), with one set of scratch arrays for all the rows
+    """
+    bestDist2 = np.empty(k); bestOther = np.empty(k, dtype=np.int64)
+    bestDx = np.empty(k); bestDy = np.empty(k)
+    for row in range(first, last):
+        if separation[row] or alignment[row] or cohesion[row]:
+            boid_nearest_acceleration(row, positions, velocities, separation, alignment, cohesion, order,
+                                      cellStart, cellCount, cells, sortedCells, sortedShifts, sortedGaps, radius,
+                                      k, force, margin, out, counts, bestDist2, bestOther, bestDx, bestDy)
+
+@njit(cache=True, nogil=True, parallel=True)
+def parallel_nearest_acceleration(first, last, positions, velocities, separation, alignment, cohesion, order,
+                                  cellStart, cellCount, cells, sortedCells, sortedShifts, sortedGaps, radius, k,
+                                  force, margin, out, counts) -> None:
+    """
+    Same as rows_nearest_acceleration with blocks of NEAREST_BLOCK rows spread over every core by numba.
+    Every block allocates its scratch arrays once.
+    """
+    for block in prange((last - first + NEAREST_BLOCK - 1) // NEAREST_BLOCK):
+        rows_nearest_acceleration(first + block * NEAREST_BLOCK, min(first + (block + 1) * NEAREST_BLOCK, last),
+                                  positions, velocities, separation, alignment, cohesion, order, cellStart, cellCount,
+                                  cells, sortedCells, sortedShifts, sortedGaps, radius, k, force, margin, out, counts)
+
+def grid_acceleration(kernel, first: int, last: int, positions: np.ndarray, velocities: np.ndarray,
+                      separation: np.ndarray, alignment: np.ndarray, cohesion: np.ndarray, grid,
+                      radius: float, force: float, margin: float, out: np.ndarray, counts: np.ndarray) -> None:
+    """
+    Call kernel (rows_acceleration or parallel_acceleration) with the arrays of a rebuilt CellGrid.
+    Boids without any rule keep their value in out and counts.
+    """
+    kernel(first, last, positions, velocities, separation, alignment, cohesion, grid.order, grid.cell_start,
+           grid.cell_count, grid.cells, grid.neighbour_cells, grid.neighbour_shifts, float(radius),
+           float(force), float(margin), out, counts)
+
+def grid_far_acceleration(kernel, first: int, last: int, positions: np.ndarray, velocities: np.ndarray,
+                          separation: np.ndarray, alignment: np.ndarray, cohesion: np.ndarray, grid,
+                          radius: float, force: float, margin: float, out: np.ndarray, counts: np.ndarray) -> None:
+    """
+    Same as grid_acceleration for rows_far_acceleration or parallel_far_acceleration, the grid
+    also needs split_stencil(margin) and aggregate()
+    """
+    kernel(first, last, positions, velocities, separation, alignment, cohesion, grid.order, grid.cell_start,
+           grid.cell_count, grid.cells, grid.inner_cells, grid.inner_shifts, grid.outer_cells, grid.outer_shifts,
+           grid.cell_positions, grid.cell_velocities, float(radius), float(np.sqrt(grid.gap_x * grid.gap_y)),
+           float(force), float(margin), out, counts)
+
+def grid_nearest_acceleration(kernel, first: int, last: int, positions: np.ndarray, velocities: np.ndarray,
+                              separation: np.ndarray, alignment: np.ndarray, cohesion: np.ndarray, grid,
+                              radius: float, k: int, force: float, margin: float, out: np.ndarray,
+                              counts: np.ndarray) -> None:
+    """
+    Same as grid_acceleration for rows_nearest_acceleration or parallel_nearest_acceleration,
+    capped to the k nearest neighbours of every boid
+    """
+    grid.sort_stencil()
+    kernel(first, last, positions, velocities, separation, alignment, cohesion, grid.order, grid.cell_start,
+           grid.cell_count, grid.cells, grid.sorted_cells, grid.sorted_shifts, grid.sorted_gaps, float(radius),
+           int(k), float(force), float(margin), out, counts)
@@ -0,0 +1,252 @@
+import json
+import math
+import numpy as np
+
+try:
+    from scipy.ndimage import distance_transform_edt
+except ImportError:
+    distance_transform_edt = None
+
+'''
+=====================================================
+    STATIC OBSTACLES COMPILED INTO A SIGNED DISTANCE FIELD
+=====================================================
+    Circles, polygons and painted masks are turned once into a grid of signed distances
+    (negative inside) and their gradient. Avoiding them is then one texel lookup per boid,
+    whatever the number or the shape of the obstacles.
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+# Pixels per side of a texel of the field, 1 is the screen resolution
+TEXEL_SIZE: int = 1
+# Boids closer than this (px) to an obstacle are pushed away, harder the closer they are
+OBSTACLE_DISTANCE: float = 60
+# Push at the border of an obstacle, in units of the max force
+OBSTACLE_FORCE: float = 20
+
+def set_texel_size(v: int):
+    global TEXEL_SIZE
+    TEXEL_SIZE = v
+def set_obstacle_distance(v: float):
+    global OBSTACLE_DISTANCE
+    OBSTACLE_DISTANCE = v
+def set_obstacle_force(v: float):
+    global OBSTACLE_FORCE
+    OBSTACLE_FORCE = v
+
+
+class Circle:
+    def __init__(self, x: float, y: float, radius: float):
+        self.x = x
+        self.y = y
+        self.radius = radius
+
+    def __str__(self):
+        return f'Circle(({self.x}, {self.y}) | r = {self.radius})'
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        return self.x - self.radius, self.y - self.radius, self.x + self.radius, self.y + self.radius
+
+    def distance(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        :return: Signed distance of the points (x,y) to the border, negative inside
+        """
+        return np.hypot(x - self.x, y - self.y) - self.radius
+
+
+class Polygon:
+    def __init__(self, points):
+        """
+        :param points: (n,2) vertices in order, the last one joins the first
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points) < 3:
+            raise ValueError(f'A polygon needs at least 3 points, got {len(self.points)}')
+
+    def __str__(self):
+        return f'Polygon({len(self.points)} points)'
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        (x0, y0), (x1, y1) = self.points.min(axis=0), self.points.max(axis=0)
+        return x0, y0, x1, y1
+
+    def distance(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        :return: Signed distance of the points (x,y) to the closest edge, negative inside (even-odd rule)
+        """
+        distance = np.full(np.broadcast(x, y).shape, np.inf)
+        inside = np.zeros(distance.shape, dtype=bool)
+        for (ax, ay), (bx, by) in zip(self.points, np.roll(self.points, -1, axis=0)):
+            ex, ey = bx - ax, by - ay
+            t = np.clip(((x - ax) * ex + (y - ay) * ey) / max(ex * ex + ey * ey, 1e-12), 0, 1)
+            distance = np.minimum(distance, np.hypot(x - ax - t * ex, y - ay - t * ey))
+            # Edge crossed by the ray going right from the point
+            crosses = (ay > y) != (by > y)
+            inside ^= crosses & (x < ax + (y - ay) * ex / (ey if ey != 0 else 1e-12))
+        return np.where(inside, -distance, distance)
+
+
+class Mask:
+    """
+    Painted obstacle: a boolean image stretched over the whole screen, True where blocked
+    """
+    def __init__(self, mask: np.ndarray):
+        """
+        :param mask: (width, height) booleans, indexed [x, y] like pygame.surfarray
+        """
+        self.mask = np.asarray(mask, dtype=bool)
+
+    def __str__(self):
+        return f'Mask({self.mask.shape[X]}x{self.mask.shape[Y]} | {self.mask.mean():.1%} blocked)'
+
+    @classmethod
+    def load(cls, path: str, threshold: int = 128):
+        """
+        :return: The Mask of an image file: pixels with an alpha and a brightness over threshold are blocked
+        """
+        import pygame as py
+        image = py.image.load(path)
+        alpha = py.surfarray.array_alpha(image) if image.get_flags() & py.SRCALPHA \
+            else np.full(image.get_size(), 255)
+        return cls((py.surfarray.array3d(image).mean(axis=2) > threshold) & (alpha > threshold))
+
+    def sample(self, nx: int, ny: int) -> np.ndarray:
+        """
+        :return: The mask resampled (nearest) to nx x ny texels
+        """
+        i = (np.arange(nx) * self.mask.shape[X] // nx)
+        j = (np.arange(ny) * self.mask.shape[Y] // ny)
+        return self.mask[np.ix_(i, j)]
+
+
+class ObstacleField:
+    """
+    Signed distance to the nearest obstacle and its gradient, one texel every TEXEL_SIZE pixels
+    of the wrapped screen. Built by compile(), which runs again only when the obstacles or the
+    screen size change.
+    """
+    def __init__(self, width: float, height: float, obstacles: list = None, texelSize: int = None):
+        self.width = width
+        self.height = height
+        self.texelSize: int = TEXEL_SIZE if texelSize is None else texelSize
+        self.obstacles: list = [] if obstacles is None else list(obstacles)
+        self.nx: int = max(1, math.ceil(width / self.texelSize))
+        self.ny: int = max(1, math.ceil(height / self.texelSize))
+        self.distance: np.ndarray = None
+        self.gradient: np.ndarray = None
+        self.compile()
+
+    def __len__(self) -> int:
+        return len(self.obstacles)
+
+    def __str__(self):
+        return f'ObstacleField({len(self)} obstacles | {self.nx}x{self.ny} texels of {self.texelSize} px)'
+
+    @classmethod
+    def load(cls, path: str, width: float, height: float):
+        """
+        :param path: JSON file {"circles": [[x, y, r], ...], "polygons": [[[x, y], ...], ...],
+                     "masks": ["image.png", ...]}, coordinates in pixels
+        """
+        with open(path) as file:
+            spec: dict = json.load(file)
+        obstacles: list = [Circle(*circle) for circle in spec.get('circles', [])]
+        obstacles += [Polygon(points) for points in spec.get('polygons', [])]
+        obstacles += [Mask.load(image) for image in spec.get('masks', [])]
+        return cls(width, height, obstacles)
+
+    def fits(self, width: float, height: float) -> bool:
+        return self.width == width and self.height == height
+
+    def resized(self, width: float, height: float):
+        """
+        :return: The same obstacles compiled for a width x height screen
+        """
+        return ObstacleField(width, height, self.obstacles, self.texelSize)
+
+    def add(self, obstacle) -> None:
+        self.obstacles.append(obstacle)
+        self.compile()
+
+    def clear(self) -> None:
+        self.obstacles = []
+        self.compile()
+
+    def compile(self) -> None:
+        """
+        Signed distance of every texel centre, clipped at OBSTACLE_DISTANCE (nothing farther is
+        ever read), and its normalised gradient. Overlapping obstacles are merged with a min.
+        """
+        size: float = self.texelSize
+        reach: float = OBSTACLE_DISTANCE + size
+        distance = np.full((self.nx, self.ny), reach)
+        centresX = (np.arange(self.nx) + 0.5) * size
+        centresY = (np.arange(self.ny) + 0.5) * size
+
+        masks: list = []
+        for obstacle in self.obstacles:
+            if isinstance(obstacle, Mask):
+                masks.append(obstacle.sample(self.nx, self.ny)); continue
+            x0, y0, x1, y1 = obstacle.bounds()
+            # Only the texels within reach of the obstacle, and of its copies across the wrapped borders
+            for shiftX in (-self.width, 0, self.width):
+                i = np.flatnonzero((centresX >= x0 + shiftX - reach) & (centresX <= x1 + shiftX + reach))
+                if len(i) == 0: continue
+                for shiftY in (-self.height, 0, self.height):
+                    j = np.flatnonzero((centresY >= y0 + shiftY - reach) & (centresY <= y1 + shiftY + reach))
+                    if len(j) == 0: continue
+                    window = np.ix_(i, j)
+                    distance[window] = np.minimum(distance[window],
+                                                  obstacle.distance(centresX[i, None] - shiftX,
+                                                                    centresY[None, j] - shiftY))
+        if masks:
+            distance = np.minimum(distance, mask_distance(np.logical_or.reduce(masks), size, reach))
+        self.distance = np.minimum(distance, reach).astype(np.float32)
+
+        # Central differences across the wrapped borders
+        gradient = np.stack(((np.roll(distance, -1, axis=X) - np.roll(distance, 1, axis=X)),
+                             (np.roll(distance, -1, axis=Y) - np.roll(distance, 1, axis=Y))), axis=2)
+        norm = np.sqrt(np.einsum('xyi,xyi->xy', gradient, gradient))
+        self.gradient = (gradient / np.maximum(norm, 1e-8)[..., None]).astype(np.float32)
+
+    def texels(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        i = (positions[:, X] // self.texelSize).astype(np.intp) % self.nx
+        j = (positions[:, Y] // self.texelSize).astype(np.intp) % self.ny
+        return i, j
+
+    def signed_distance(self, positions: np.ndarray) -> np.ndarray:
+        return self.distance[self.texels(positions)]
+
+    def avoidance(self, positions: np.ndarray, force: float) -> np.ndarray:
+        """
+        :return: (n,2) push away from the obstacles: OBSTACLE_FORCE * force at the border (and inside),
+                 fading quadratically to 0 at OBSTACLE_DISTANCE
+        """
+        i, j = self.texels(positions)
+        weight = np.clip(1 - self.distance[i, j] / OBSTACLE_DISTANCE, 0, 1) ** 2
+        return self.gradient[i, j] * (weight * OBSTACLE_FORCE * force)[:, None]
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def mask_distance(mask: np.ndarray, size: float, reach: float) -> np.ndarray:
+    """
+    :return: Signed distance (px) of every texel of a (nx,ny) mask to its border, exact up to reach.
+             The mask is padded with its wrapped borders, so obstacles continue across the screen edges.
+    """
+    if distance_transform_edt is None:
+        raise ImportError('Painted obstacle masks need scipy (pip install scipy)')
+    if not mask.any(): return np.full(mask.shape, reach)
+    pad: int = min(math.ceil(reach / size) + 1, max(mask.shape))
+    padded = np.pad(mask, pad, mode='wrap')
+    outside = distance_transform_edt(~padded)[pad:-pad, pad:-pad]
+    inside = distance_transform_edt(padded)[pad:-pad, pad:-pad]
+    # Texel centres: the border lies half a texel from the first blocked one
+    return np.where(mask, 0.5 - inside, outside - 0.5) * size
@@ -0,0 +1,276 @@
+import os
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+import Flock as flock_module
+from CellGrid import CellGrid
+from Flock import Flock, rule_acceleration, integrate
+
+'''
+=====================================================
+    FLOCK SPLIT IN TILES OF CELLS, ONE WORKER PROCESS PER TILE
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+# name: (shape as a function of the number of boids and of cells of the tile grid, dtype)
+SHARED_LAYOUT: dict = {
+    'positions': (lambda n, cells: (2, n, 2), np.float64),     # front and back buffer
+    'velocities': (lambda n, cells: (2, n, 2), np.float64),    # front and back buffer
+    'accelerations': (lambda n, cells: (n, 2), np.float64),
+    'Separation': (lambda n, cells: (n,), np.bool_),
+    'Alignment': (lambda n, cells: (n,), np.bool_),
+    'Cohesion': (lambda n, cells: (n,), np.bool_),
+    # Boids sorted by cell of the tile grid, and where every cell starts in it (CSR), built once per step
+    'order': (lambda n, cells: (n,), np.intp),
+    'cellStart': (lambda n, cells: (cells + 1,), np.intp),
+}
+
+
+class ParallelFlock:
+    """
+    Flock whose state lives in multiprocessing.shared_memory. The cell grid is cut in tiles
+    (strips when tiles has one row) and every tile is stepped by its own process, which only
+    works on the boids of its tile plus a DISTANCE_RADIUS_CHECK wide halo around it. Every step
+    the boids are sorted by cell once, here, so a worker reads the rows of its own cells and
+    of the halo cells and nothing else. Workers read the front buffers and write the back
+    buffers, which are swapped once all of them are done. The number of boids is fixed at creation.
+    """
+    def __init__(self, flock: Flock, workers: int = None, tiles: tuple = None, seed: int = None):
+        """
+        :param workers: Number of processes (os.cpu_count() by default)
+        :param tiles: (columns, rows) of tiles, by default the most square split of workers
+        :param seed: Seed of the worker jitter streams, spawned from the streams of flock when None
+        """
+        self.width = flock.width
+        self.height = flock.height
+        self.n: int = len(flock)
+        self.front: int = 0
+        self.step_times: dict = {'neighbours': 0.0, 'rules': 0.0, 'integration': 0.0}
+
+        # Tiles are cut along the cells of the grid the flock would use. The grid keeps this geometry
+        # whatever the radius later, the halo is then as many cells as the radius needs.
+        self.grid = CellGrid.for_radius(self.width, self.height, flock_module.DISTANCE_RADIUS_CHECK,
+                                        flock_module.CELS_PER_RADIUS)
+        grid = self.grid
+        cells: int = grid.cels_x * grid.cels_y
+
+        self.shared: dict = {}
+        self.arrays: dict = {}
+        for name, (shape, dtype) in SHARED_LAYOUT.items():
+            nbytes: int = max(1, int(np.prod(shape(self.n, cells))) * np.dtype(dtype).itemsize)
+            self.shared[name] = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.arrays[name] = np.ndarray(shape(self.n, cells), dtype=dtype, buffer=self.shared[name].buf)
+        self.arrays['positions'][self.front] = flock.positions
+        self.arrays['velocities'][self.front] = flock.velocities
+        self.arrays['accelerations'][:] = flock.accelerations
+        for name in ('Separation', 'Alignment', 'Cohesion'):
+            self.arrays[name][:] = getattr(flock, name)
+
+        cels: int = min(grid.cels_x, grid.cels_y)
+        if tiles is None: tiles = tile_layout(workers or os.cpu_count() or 1, cels)
+        self.tiles: tuple = (min(tiles[X], grid.cels_x), min(tiles[Y], grid.cels_y))
+        boundsX = np.linspace(0, grid.cels_x, self.tiles[X] + 1).astype(int)
+        boundsY = np.linspace(0, grid.cels_y, self.tiles[Y] + 1).astype(int)
+        names: dict = {name: shm.name for name, shm in self.shared.items()}
+        streams = flock.streams if seed is None else np.random.SeedSequence(seed)
+        seeds = streams.spawn(self.tiles[X] * self.tiles[Y])
+
+        context = mp.get_context('spawn')
+        self.connections: list = []
+        self.workers: list = []
+        for w in range(self.tiles[X] * self.tiles[Y]):
+            tx, ty = divmod(w, self.tiles[Y])
+            tile: tuple = (int(boundsX[tx]), int(boundsX[tx + 1]), int(boundsY[ty]), int(boundsY[ty + 1]))
+            parent, child = context.Pipe()
+            process = context.Process(target=worker_loop, daemon=True,
+                                      args=(child, names, self.n, tile, self.width, self.height,
+                                            (grid.cels_x, grid.cels_y), flock_module.CELS_PER_RADIUS, seeds[w]))
+            process.start()
+            self.connections.append(parent)
+            self.workers.append(process)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __str__(self):
+        return f'ParallelFlock({self.n} boids | {self.tiles[X]}x{self.tiles[Y]} tiles)'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.arrays['positions'][self.front]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        return self.arrays['velocities'][self.front]
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return flock_module.vector_norm(self.velocities) * flock_module.AVG_SIZE / flock_module.MAX_SPEED \
+            + flock_module.AVG_SIZE
+
+    @property
+    def Separation(self) -> np.ndarray:
+        return self.arrays['Separation']
+
+    @property
+    def Alignment(self) -> np.ndarray:
+        return self.arrays['Alignment']
+
+    @property
+    def Cohesion(self) -> np.ndarray:
+        return self.arrays['Cohesion']
+
+    def switch_separation(self, value: bool = None) -> None:
+        flags = self.arrays['Separation']
+        flags[:] = ~flags if value is None else value
+    def switch_alignment(self, value: bool = None) -> None:
+        flags = self.arrays['Alignment']
+        flags[:] = ~flags if value is None else value
+    def switch_cohesion(self, value: bool = None) -> None:
+        flags = self.arrays['Cohesion']
+        flags[:] = ~flags if value is None else value
+
+    def step(self, deltaTime: float) -> None:
+        """
+        Sort the boids by cell, every worker steps its tile into the back buffers, then the buffers are swapped
+        """
+        self.grid.rebuild(self.positions)
+        self.arrays['order'][:] = self.grid.order
+        self.arrays['cellStart'][:-1] = self.grid.cell_start
+        self.arrays['cellStart'][-1] = self.n
+        message = (deltaTime, self.front, flock_module.MAX_FORCE, flock_module.MAX_SPEED,
+                   flock_module.DISTANCE_RADIUS_CHECK, flock_module.SEPARATION_MARGIN, flock_module.JITTER_DEGREES)
+        for connection in self.connections:
+            connection.send(message)
+        # The slowest worker sets the pace of every phase
+        times: list = [connection.recv() for connection in self.connections]
+        self.step_times = {phase: max(t[phase] for t in times) for phase in self.step_times}
+        self.front = 1 - self.front
+
+    def close(self) -> None:
+        for connection in self.connections:
+            try: connection.send(None)
+            except (BrokenPipeError, OSError): pass
+        for process in self.workers:
+            process.join(timeout=5)
+        self.connections = []; self.workers = []
+
+        self.arrays = {}
+        for shm in self.shared.values():
+            shm.close()
+            shm.unlink()
+        self.shared = {}
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def tile_layout(workers: int, cels: int) -> tuple:
+    """
+    :return: (columns, rows) of tiles using every worker with the least halo, i.e. the most square tiles
+    """
+    workers = max(1, min(workers, cels * cels))
+    best: tuple = (workers, 1)
+    for columns in range(1, workers + 1):
+        if workers % columns or columns > cels or workers // columns > cels: continue
+        if abs(columns - workers // columns) < abs(best[X] - best[Y]):
+            best = (columns, workers // columns)
+    return best
+
+def cell_range(first: int, last: int, reach: int, cels: int) -> np.ndarray:
+    """
+    :return: Cells [first - reach, last + reach) of a wrapped axis of cels cells, each once
+    """
+    if last - first + 2 * reach >= cels: return np.arange(cels)
+    return np.arange(first - reach, last + reach) % cels
+
+def tile_rows(order: np.ndarray, cellStart: np.ndarray, columns: np.ndarray, rows: np.ndarray,
+              celsY: int) -> np.ndarray:
+    """
+    :return: Rows of the boids of the cells columns x rows of the tile grid, gathered from its CSR index
+    """
+    cells = (columns[:, None] * celsY + rows[None, :]).ravel()
+    counts = cellStart[cells + 1] - cellStart[cells]
+    offsets = np.repeat(cellStart[cells] - (np.cumsum(counts) - counts), counts)
+    return order[offsets + np.arange(len(offsets))]
+
+def worker_loop(connection, names: dict, n: int, tile: tuple, width: float, height: float, cels: tuple,
+                celsPerRadius: int, seed: np.random.SeedSequence) -> None:
+    """
+    Body of every worker process: wait for (deltaTime, front, force, speed, radius, margin, jitter), step
+    the boids of the tile (first and last cell columns and rows of the tile grid of cels cells),
+    answer with the phase times. None stops the worker.
+    """
+    celsX, celsY = cels
+    shared: dict = {name: shared_memory.SharedMemory(name=shmName) for name, shmName in names.items()}
+    arrays: dict = {name: np.ndarray(SHARED_LAYOUT[name][0](n, celsX * celsY), dtype=SHARED_LAYOUT[name][1],
+                                     buffer=shared[name].buf) for name in names}
+    rng = np.random.default_rng(seed)
+    grid = None
+    firstX, lastX, firstY, lastY = tile
+    tileColumns = np.arange(firstX, lastX)
+    tileLines = np.arange(firstY, lastY)
+
+    try:
+        while True:
+            message = connection.recv()
+            if message is None: break
+            deltaTime, front, force, speed, radius, margin, jitterDegrees = message
+            start: float = time.perf_counter()
+
+            positions = arrays['positions'][front]
+            velocities = arrays['velocities'][front]
+            accelerations = arrays['accelerations']
+            separation, alignment, cohesion = arrays['Separation'], arrays['Alignment'], arrays['Cohesion']
+
+            # The radius can change between steps
+            if grid is None or not grid.fits(width, height, radius):
+                grid = CellGrid.for_radius(width, height, radius, celsPerRadius)
+
+            # Boids of the tile, then the tile and its halo (as many cells as the radius needs)
+            order, cellStart = arrays['order'], arrays['cellStart']
+            owned = tile_rows(order, cellStart, tileColumns, tileLines, celsY)
+            local = tile_rows(order, cellStart,
+                              cell_range(firstX, lastX, int(np.ceil(radius / (width / celsX))), celsX),
+                              cell_range(firstY, lastY, int(np.ceil(radius / (height / celsY))), celsY), celsY)
+            # The owned boids come first in the neighbour search
+            local = np.concatenate((owned, local[~np.isin(local, owned)]))
+            ownedRows = np.arange(len(owned))
+
+            searched: float = start
+            active = separation[owned] | alignment[owned] | cohesion[owned]
+            if active.any():
+                i, j, delta = grid.neighbour_pairs(positions[local], radius, rows=ownedRows)
+                searched = time.perf_counter()
+                acceleration = rule_acceleration(len(local), i, j, delta, velocities[local], separation[local],
+                                                 alignment[local], cohesion[local], force, margin)
+                accelerations[owned[active]] = acceleration[ownedRows][active]
+            ruled: float = time.perf_counter()
+
+            jitter = rng.uniform(-jitterDegrees, jitterDegrees, len(owned))
+            newPositions, newVelocities = integrate(positions[owned], velocities[owned], accelerations[owned],
+                                                    jitter, deltaTime, width, height, speed)
+            arrays['positions'][1 - front][owned] = newPositions
+            arrays['velocities'][1 - front][owned] = newVelocities
+
+            connection.send({'neighbours': searched - start, 'rules': ruled - searched,
+                             'integration': time.perf_counter() - ruled})
+    finally:
+        arrays = {}
+        for shm in shared.values():
+            shm.close()
@@ -0,0 +1,98 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+'''
+=====================================================
+    PERIODIC KD-TREE NEIGHBOUR SEARCH
+=====================================================
+'''
+# INDEX FOR VALUES
+X: int = 0
+Y: int = 1
+
+
+class PeriodicKDTree:
+    """
+    Exact radius search on the wrapped screen. Unlike the cell stencil it does not depend
+    on the cell shape, and it does not scan empty or overfull cells on clustered flocks.
+    Needs scipy.
+    """
+    def __init__(self, width: float, height: float):
+        if cKDTree is None:
+            raise ImportError('The kdtree neighbour backend needs scipy (pip install scipy)')
+        self.width = width
+        self.height = height
+        self.tree = None
+
+    def __str__(self):
+        return f'PeriodicKDTree({self.width}x{self.height})'
+
+    def fits(self, width: float, height: float, radius: float) -> bool:
+        """
+        :return: Whether this tree still matches a width x height screen, any radius can be queried
+        """
+        return self.width == width and self.height == height
+
+    def wrap(self, positions: np.ndarray) -> np.ndarray:
+        box = np.array([self.width, self.height], dtype=float)
+        # boxsize wants [0, box), and the float modulo can round up to exactly box
+        return np.where(positions >= box, positions - box, positions)
+
+    def rebuild(self, positions: np.ndarray) -> None:
+        self.tree = cKDTree(self.wrap(positions), boxsize=(self.width, self.height))
+
+    def wrapped_delta(self, positions: np.ndarray, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        delta = positions[j] - positions[i]
+        delta[:, X] -= self.width * np.round(delta[:, X] / self.width)
+        delta[:, Y] -= self.height * np.round(delta[:, Y] / self.height)
+        return delta
+
+    def query_pairs(self, positions: np.ndarray, radius: float,
+                    rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Needs rebuild(positions) first. The rows get a small tree of their own, matched against
+        the flock tree, so disjoint rows can be queried from several threads.
+        :return: (i, j, delta) for every boid i of rows and every other boid j closer than radius,
+                 delta being the wrapped vector from boid i to boid j
+        """
+        rowsTree = cKDTree(self.wrap(positions[rows]), boxsize=(self.width, self.height))
+        pairs = rowsTree.sparse_distance_matrix(self.tree, radius, output_type='ndarray')
+        i = rows[pairs['i']]; j = pairs['j'].astype(np.intp)
+        distinct = i != j
+        i = i[distinct]; j = j[distinct]
+        return i, j, self.wrapped_delta(positions, i, j)
+
+    def nearest_pairs(self, positions: np.ndarray, radius: float, k: int,
+                      rows: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Like query_pairs, capped to the k nearest boids of every row. The tree search stops by
+        itself once the k nearest are certain.
+        :return: (i, j, delta) with at most k pairs per boid of rows, nearest first
+        """
+        # k + 1: the boid finds itself
+        distance, j = self.tree.query(self.wrap(positions[rows]), k=k + 1, distance_upper_bound=radius)
+        i = np.repeat(rows, k + 1)
+        j = j.ravel()
+        found = (j < len(positions)) & (j != i)
+        i = i[found]; j = j[found].astype(np.intp)
+        # The boid itself may tie with a neighbour at distance 0, keep k at most
+        rank = np.cumsum(found.reshape(-1, k + 1), axis=1).ravel()[found]
+        keep = rank <= k
+        i = i[keep]; j = j[keep]
+        return i, j, self.wrapped_delta(positions, i, j)
+
+    def neighbour_pairs(self, positions: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: (i, j, delta) for every ordered pair of distinct boids closer than radius,
+                 delta being the wrapped vector from boid i to boid j
+        """
+        self.rebuild(positions)
+        pairs = self.tree.query_pairs(radius, output_type='ndarray')
+
+        i = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        j = np.concatenate((pairs[:, 1], pairs[:, 0]))
+        return i, j, self.wrapped_delta(positions, i, j)
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+'''
+=====================================================
+    PER PHASE TIMERS, COUNTERS AND CHROME TRACE EXPORT
+=====================================================
+'''
+# Events kept for the trace, the oldest are dropped beyond it
+MAX_EVENTS: int = 1_000_000
+# Frames averaged by summary()
+SUMMARY_FRAMES: int = 60
+
+# Shared by every disabled span, entering it costs one attribute lookup
+NO_SPAN = nullcontext()
+
+
+class Span:
+    """
+    Context manager timing one phase into a Profiler
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profiler.add_span(self.name, self.start, time.perf_counter())
+
+
+class Profiler:
+    """
+    Collects phase spans (start, end, thread) and counters. Spans are summed per frame for the
+    HUD and kept as a timeline for export_chrome_trace (chrome://tracing or ui.perfetto.dev).
+    Disabled, span() returns NO_SPAN and add_span/count return at once.
+    """
+    def __init__(self, enabled: bool = False, maxEvents: int = MAX_EVENTS):
+        self.enabled = enabled
+        self.origin: float = time.perf_counter()
+        self.events: deque = deque(maxlen=maxEvents)
+        # Span seconds and counter totals of the frame being measured, and of the last SUMMARY_FRAMES frames
+        self.frame: tuple = ({}, {})
+        self.frames: deque = deque(maxlen=SUMMARY_FRAMES)
+        self.counters: dict = {}
+        self.histograms: dict = {}
+        # Guards the frame totals, added to from the Flock.step_rows worker threads
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f'Profiler({"on" if self.enabled else "off"} | {len(self.events)} events)'
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.frame = ({}, {})
+        self.frames.clear()
+
+    def span(self, name: str):
+        return Span(self, name) if self.enabled else NO_SPAN
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        """
+        Phase measured elsewhere with time.perf_counter(). Thread safe: the frame totals are
+        updated under the lock.
+        """
+        if not self.enabled: return
+        self.events.append((name, start, end, threading.get_ident()))
+        with self.lock:
+            spans: dict = self.frame[0]
+            spans[name] = spans.get(name, 0.0) + end - start
+
+    def count(self, name: str, value: float) -> None:
+        if not self.enabled: return
+        self.counters[name] = value
+        with self.lock:
+            counts: dict = self.frame[1]
+            counts[name] = counts.get(name, 0) + value
+        self.events.append((name, time.perf_counter(), value, None))
+
+    def histogram(self, name: str, values) -> None:
+        """
+        :param values: Histogram to show, e.g. np.bincount of the cell occupancy
+        """
+        if not self.enabled: return
+        self.histograms[name] = values
+
+    def end_frame(self) -> None:
+        if not self.enabled: return
+        with self.lock:
+            self.frames.append(self.frame)
+            self.frame = ({}, {})
+
+    def summary(self) -> tuple[dict, dict]:
+        """
+        :return: ({span: ms}, {counter: value}) averaged per frame over the last SUMMARY_FRAMES frames
+        """
+        averages: list = []
+        for k, scale in ((0, 1000), (1, 1)):
+            names: set = set().union(*(frame[k] for frame in self.frames))
+            averages.append({name: sum(frame[k].get(name, 0) for frame in self.frames) / len(self.frames) * scale
+                             for name in names})
+        return averages[0], averages[1]
+
+    def export_chrome_trace(self, path: str) -> None:
+        """
+        Save the timeline in the Chrome trace event format: one complete event (ph X) per span,
+        one counter event (ph C) per counter sample
+        """
+        pid: int = os.getpid()
+        threads: dict = {}
+        traceEvents: list = []
+        for name, start, end, thread in self.events:
+            timestamp: float = (start - self.origin) * 1e6
+            if thread is None:
+                traceEvents.append({'name': name, 'ph': 'C', 'ts': timestamp, 'pid': pid, 'args': {name: float(end)}})
+            else:
+                tid: int = threads.setdefault(thread, len(threads))
+                traceEvents.append({'name': name, 'ph': 'X', 'ts': timestamp, 'dur': (end - start) * 1e6,
+                                    'pid': pid, 'tid': tid})
+        for thread, tid in threads.items():
+            traceEvents.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                                'args': {'name': 'main' if thread == threading.main_thread().ident else f'worker {tid}'}})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': traceEvents, 'displayTimeUnit': 'ms',
+                       'otherData': {'histograms': {k: list(map(int, v)) for k, v in self.histograms.items()}}},
+                      file)
@@ -0,0 +1,265 @@
+import json
+import numpy as np
+
+import Flock as flock_module
+
+'''
+=====================================================
+    TRAJECTORY FILES: RECORD A RUN ONCE, REPLAY IT AT DISPLAY SPEED
+=====================================================
+    HEADER_BYTES of header: MAGIC and a JSON object padded with spaces (screen size,
+    parameters, number of frames and bytes used). Then one record per frame:
+        int64 n, float64 time, float32 positions (n,2), float32 velocities (n,2),
+        uint8 flags (n,) (SEPARATION | ALIGNMENT | COHESION), padded to 8 bytes
+'''
+MAGIC: bytes = b'BOIDREC1'
+HEADER_BYTES: int = 4096
+# The file grows by this many bytes at once, and is trimmed on close
+CHUNK_BYTES: int = 64 * 1024 * 1024
+
+SEPARATION: int = 1
+ALIGNMENT: int = 2
+COHESION: int = 4
+
+# Module parameters saved in the header
+RECORDED_PARAMETERS: tuple = ('DISTANCE_RADIUS_CHECK', 'CELS_PER_RADIUS', 'SEPARATION_MARGIN', 'MAX_FORCE',
+                              'MAX_SPEED', 'AVG_SIZE', 'JITTER_DEGREES')
+
+
+class Recorder:
+    """
+    Appends frames to a memory-mapped trajectory file. The map grows by CHUNK_BYTES, so
+    recording a frame is a copy of its arrays into the map, not a write call per array.
+    """
+    def __init__(self, path: str, width: float, height: float, rate: float = None, **extra):
+        """
+        :param rate: Physics steps per second of the run, kept for reference
+        :param extra: Anything else worth keeping in the header (JSON serialisable)
+        """
+        self.path = path
+        self.header: dict = {'width': width, 'height': height, 'rate': rate, 'frames': 0, 'used': HEADER_BYTES,
+                             'parameters': {name: getattr(flock_module, name) for name in RECORDED_PARAMETERS},
+                             **extra}
+        with open(path, 'wb') as file:
+            file.truncate(HEADER_BYTES + CHUNK_BYTES)
+        self.map = np.memmap(path, dtype=np.uint8, mode='r+')
+        self.write_header()
+
+    def __len__(self) -> int:
+        return self.header['frames']
+
+    def __str__(self):
+        return f'Recorder({self.path} | {len(self)} frames | {self.header["used"] / 2 ** 20:.1f} MB)'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write_header(self) -> None:
+        data: bytes = MAGIC + json.dumps(self.header).encode()
+        if len(data) > HEADER_BYTES:
+            raise ValueError(f'Recording header over {HEADER_BYTES} bytes, keep the extra fields short')
+        self.map[:HEADER_BYTES] = np.frombuffer(data.ljust(HEADER_BYTES), dtype=np.uint8)
+
+    def record(self, time: float, positions: np.ndarray, velocities: np.ndarray, separation: np.ndarray,
+               alignment: np.ndarray, cohesion: np.ndarray) -> None:
+        """
+        Append one frame at the simulated time (s)
+        """
+        n: int = len(positions)
+        offset: int = self.header['used']
+        end: int = offset + frame_bytes(n)
+        if end > len(self.map):
+            self.grow(end)
+
+        self.map[offset:offset + 8].view(np.int64)[0] = n
+        self.map[offset + 8:offset + 16].view(np.float64)[0] = time
+        positionsAt, velocitiesAt, flagsAt = frame_layout(offset, n)
+        self.map[positionsAt:velocitiesAt].view(np.float32).reshape(n, 2)[:] = positions
+        self.map[velocitiesAt:flagsAt].view(np.float32).reshape(n, 2)[:] = velocities
+        self.map[flagsAt:flagsAt + n] = separation * SEPARATION | alignment * ALIGNMENT | cohesion * COHESION
+
+        self.header['used'] = end
+        self.header['frames'] += 1
+        # Kept up to date in the map, so a run that crashes still leaves a readable file
+        self.write_header()
+
+    def record_flock(self, flock, time: float) -> None:
+        self.record(time, flock.positions, flock.velocities, flock.Separation, flock.Alignment, flock.Cohesion)
+
+    def grow(self, needed: int) -> None:
+        size: int = len(self.map) + max(CHUNK_BYTES, needed - len(self.map))
+        self.map.flush()
+        del self.map
+        with open(self.path, 'r+b') as file:
+            file.truncate(size)
+        self.map = np.memmap(self.path, dtype=np.uint8, mode='r+')
+
+    def close(self) -> None:
+        if self.map is None: return
+        self.write_header()
+        self.map.flush()
+        self.map = None
+        # Drop the unused end of the last chunk
+        with open(self.path, 'r+b') as file:
+            file.truncate(self.header['used'])
+
+
+class RecordedFrame:
+    """
+    One frame of a Recording, with what SpriteAtlas.draw reads of a Flock. The arrays are
+    views of the map, nothing is copied until they are used.
+    """
+    def __init__(self, time: float, positions: np.ndarray, velocities: np.ndarray, flags: np.ndarray,
+                 maxSpeed: float, avgSize: float):
+        self.time = time
+        self.positions = positions
+        self.velocities = velocities
+        self.flags = flags
+        self.maxSpeed = maxSpeed
+        self.avgSize = avgSize
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __str__(self):
+        return f'RecordedFrame({len(self)} boids | t = {self.time:.3f} s)'
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return flock_module.vector_norm(self.velocities) * self.avgSize / self.maxSpeed + self.avgSize
+
+    @property
+    def Separation(self) -> np.ndarray:
+        return (self.flags & SEPARATION).astype(bool)
+
+    @property
+    def Alignment(self) -> np.ndarray:
+        return (self.flags & ALIGNMENT).astype(bool)
+
+    @property
+    def Cohesion(self) -> np.ndarray:
+        return (self.flags & COHESION).astype(bool)
+
+
+class Recording:
+    """
+    Read only map of a trajectory file. Opening it only walks the frame headers, frames are
+    read from the map when asked for.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.map = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path} is not a boid recording')
+        self.header: dict = json.loads(bytes(self.map[len(MAGIC):HEADER_BYTES]).decode())
+        self.width = self.header['width']
+        self.height = self.header['height']
+        parameters: dict = self.header['parameters']
+        self.maxSpeed: float = parameters['MAX_SPEED']
+        self.avgSize: float = parameters['AVG_SIZE']
+
+        offsets: list = []
+        offset: int = HEADER_BYTES
+        for _ in range(self.header['frames']):
+            offsets.append(offset)
+            offset += frame_bytes(int(self.map[offset:offset + 8].view(np.int64)[0]))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.times = np.array([self.map[o + 8:o + 16].view(np.float64)[0] for o in offsets])
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __str__(self):
+        return f'Recording({self.path} | {self.width}x{self.height} | {len(self)} frames | {self.duration:.2f} s)'
+
+    def __getitem__(self, k: int) -> RecordedFrame:
+        return self.frame(k)
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1] - self.times[0]) if len(self) else 0.0
+
+    def frame(self, k: int) -> RecordedFrame:
+        offset: int = int(self.offsets[k])
+        n: int = int(self.map[offset:offset + 8].view(np.int64)[0])
+        positionsAt, velocitiesAt, flagsAt = frame_layout(offset, n)
+        return RecordedFrame(float(self.times[k]),
+                             self.map[positionsAt:velocitiesAt].view(np.float32).reshape(n, 2),
+                             self.map[velocitiesAt:flagsAt].view(np.float32).reshape(n, 2),
+                             self.map[flagsAt:flagsAt + n], self.maxSpeed, self.avgSize)
+
+    def frame_at(self, time: float) -> int:
+        """
+        :return: Index of the last frame recorded at or before time
+        """
+        if len(self) == 0: raise IndexError(f'{self.path} has no frames')
+        return int(np.clip(np.searchsorted(self.times, time, side='right') - 1, 0, len(self) - 1))
+
+    def close(self) -> None:
+        self.map = None
+
+
+class Player:
+    """
+    Playback cursor over a Recording: a clock in recorded seconds that runs at speed times
+    the real one, loops at the end and can be paused or moved.
+    """
+    def __init__(self, recording: Recording, speed: float = 1.0):
+        self.recording = recording
+        self.speed = speed
+        self.paused: bool = False
+        self.time: float = float(recording.times[0]) if len(recording) else 0.0
+
+    def __str__(self):
+        return f'Player({self.time:.2f}/{self.recording.duration:.2f} s | x{self.speed}{" | paused" if self.paused else ""})'
+
+    def advance(self, frameTime: float) -> None:
+        if not self.paused:
+            self.seek(frameTime * self.speed)
+
+    def seek(self, seconds: float) -> None:
+        """
+        Move the cursor by seconds (negative goes back), wrapping around the recording
+        """
+        if len(self.recording) == 0: return
+        first: float = float(self.recording.times[0])
+        duration: float = self.recording.duration
+        self.time = first + ((self.time + seconds - first) % duration if duration > 0 else 0.0)
+
+    def toggle_pause(self) -> None:
+        self.paused = not self.paused
+
+    def frame(self) -> RecordedFrame:
+        """
+        :return: The frame under the cursor, without boids when the recording has no frames
+        """
+        recording = self.recording
+        if len(recording) == 0:
+            return RecordedFrame(0.0, np.empty((0, 2), np.float32), np.empty((0, 2), np.float32),
+                                 np.empty(0, np.uint8), recording.maxSpeed, recording.avgSize)
+        return recording.frame(recording.frame_at(self.time))
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def frame_bytes(n: int) -> int:
+    """
+    :return: Size of the record of a frame of n boids, a multiple of 8 so every record stays aligned
+    """
+    return 16 + 16 * n + (n + 7) // 8 * 8
+
+def frame_layout(offset: int, n: int) -> tuple[int, int, int]:
+    """
+    :return: Offsets of the positions, velocities and flags of the frame record at offset
+    """
+    positionsAt: int = offset + 16
+    velocitiesAt: int = positionsAt + 8 * n
+    return positionsAt, velocitiesAt, velocitiesAt + 8 * n
@@ -0,0 +1,289 @@
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from contextlib import contextmanager
+import numpy as np
+
+import Flock as flock_module
+from CellGrid import CellGrid
+from Flock import Flock
+from Obstacles import ObstacleField
+from Recorder import Recorder, RecordedFrame, SEPARATION, ALIGNMENT, COHESION
+from Timestep import FixedTimestep
+
+'''
+=====================================================
+    SIMULATION IN ITS OWN PROCESS, SNAPSHOTS IN A SHARED MEMORY RING
+=====================================================
+    The process steps a Flock at a fixed rate of real time and publishes every new state in
+    one of RING_SLOTS snapshot slots. Each slot has a lock: the writer only takes a free slot
+    that is not the newest one, the renderer holds the newest one while it draws from it. With
+    three slots the writer never waits and the renderer never copies. Commands (keys, clicks,
+    sliders) go the other way as small tuples on a SimpleQueue.
+'''
+# Newest snapshot, the one drawn and the one written
+RING_SLOTS: int = 3
+# Max boids of a snapshot, the flock does not grow beyond it
+RING_CAPACITY: int = 200_000
+# Longest nap of the simulation when no step is due (s), bounds the latency of the commands
+IDLE_SLEEP: float = 0.002
+# Seconds between two measures of the steps per second
+RATE_WINDOW: float = 0.5
+
+# Columns of the header of every slot
+BOIDS: int = 0
+TIME: int = 1
+STEPS: int = 2
+STEPS_PER_SECOND: int = 3
+
+# name: (shape as a function of (slots, capacity), dtype)
+RING_LAYOUT: dict = {
+    'latest': (lambda slots, capacity: (1,), np.int64),    # Newest complete slot, -1 before the first one
+    'header': (lambda slots, capacity: (slots, 4), np.float64),
+    'positions': (lambda slots, capacity: (slots, capacity, 2), np.float64),
+    'velocities': (lambda slots, capacity: (slots, capacity, 2), np.float64),
+    'flags': (lambda slots, capacity: (slots, capacity), np.uint8),   # SEPARATION | ALIGNMENT | COHESION
+}
+
+# Flock methods the renderer can call through SimulationProcess
+FLOCK_COMMANDS: tuple = ('add', 'spawn', 'remove', 'despawn', 'move', 'change_velocity_direction', 'random_direction',
+                         'switch_separation', 'switch_alignment', 'switch_cohesion', 'add_obstacle',
+                         'clear_obstacles')
+
+
+class FrameRing:
+    """
+    RING_SLOTS snapshots of a flock in shared memory, written by one process and read by another
+    """
+    def __init__(self, slots: int = RING_SLOTS, capacity: int = RING_CAPACITY, names: dict = None,
+                 locks: list = None):
+        """
+        :param names: Shared memory names of an existing ring to attach to, a new one is created when None
+        :param locks: One lock per slot, from the multiprocessing context of the processes
+        """
+        self.slots = slots
+        self.capacity = capacity
+        self.owner: bool = names is None
+        self.locks: list = [mp.get_context('spawn').Lock() for _ in range(slots)] if locks is None else locks
+        self.shared: dict = {}
+        self.arrays: dict = {}
+        for name, (shape, dtype) in RING_LAYOUT.items():
+            if self.owner:
+                nbytes: int = max(1, int(np.prod(shape(slots, capacity))) * np.dtype(dtype).itemsize)
+                self.shared[name] = shared_memory.SharedMemory(create=True, size=nbytes)
+            else:
+                self.shared[name] = shared_memory.SharedMemory(name=names[name])
+            self.arrays[name] = np.ndarray(shape(slots, capacity), dtype=dtype, buffer=self.shared[name].buf)
+        if self.owner: self.arrays['latest'][0] = -1
+
+    def __str__(self):
+        return f'FrameRing({self.slots} slots of {self.capacity} boids)'
+
+    @property
+    def names(self) -> dict:
+        return {name: shm.name for name, shm in self.shared.items()}
+
+    @property
+    def latest(self) -> int:
+        return int(self.arrays['latest'][0])
+
+    def write(self, flock, simulationTime: float, steps: int, stepsPerSecond: float) -> bool:
+        """
+        Publish the state of the flock (at most capacity boids) in a free slot
+        :return: False when no slot was free, the state is then skipped
+        """
+        latest: int = self.latest
+        for k in range(1, self.slots + 1):
+            slot: int = (latest + k) % self.slots
+            if slot != latest and self.locks[slot].acquire(block=False): break
+        else:
+            return False
+        try:
+            n: int = min(len(flock), self.capacity)
+            self.arrays['positions'][slot, :n] = flock.positions[:n]
+            self.arrays['velocities'][slot, :n] = flock.velocities[:n]
+            self.arrays['flags'][slot, :n] = flock.Separation[:n] * SEPARATION | flock.Alignment[:n] * ALIGNMENT \
+                | flock.Cohesion[:n] * COHESION
+            self.arrays['header'][slot] = (n, simulationTime, steps, stepsPerSecond)
+            self.arrays['latest'][0] = slot
+        finally:
+            self.locks[slot].release()
+        return True
+
+    @contextmanager
+    def newest(self):
+        """
+        Hold the newest snapshot, the writer leaves it alone until the block ends
+        :return: (RecordedFrame of views into the slot, its header row), (None, None) before the first one
+        """
+        slot: int = self.latest
+        if slot < 0:
+            yield None, None
+            return
+        # If the writer took this slot meanwhile, it is complete again once the lock is ours
+        with self.locks[slot]:
+            header = self.arrays['header'][slot]
+            n: int = int(header[BOIDS])
+            yield RecordedFrame(float(header[TIME]), self.arrays['positions'][slot, :n],
+                                self.arrays['velocities'][slot, :n], self.arrays['flags'][slot, :n],
+                                flock_module.MAX_SPEED, flock_module.AVG_SIZE), header.copy()
+
+    def close(self) -> None:
+        self.arrays = {}
+        for shm in self.shared.values():
+            shm.close()
+            if self.owner: shm.unlink()
+        self.shared = {}
+
+
+class SimulationProcess:
+    """
+    Stands in for a Flock in the renderer while the real one steps in another process. The Flock
+    methods of FLOCK_COMMANDS are sent as commands, the state is read with newest().
+    """
+    def __init__(self, width: float, height: float, rate: float = 120, maxSubsteps: int = 5,
+                 capacity: int = RING_CAPACITY, workers: int = None, obstacles: ObstacleField = None,
+                 record: str = None, seed: int = None):
+        """
+        :param rate: Physics steps per simulated second
+        :param maxSubsteps: Steps run at once at most when the simulation falls behind (see FixedTimestep)
+        :param workers: Threads of the Flock in the process
+        :param record: Trajectory file where the process records every step (see Recorder.py)
+        """
+        self.width = width
+        self.height = height
+        # Copy of the obstacles of the process, for the background
+        self.obstacles = obstacles
+        self.parameters: tuple = None
+        self.ring = FrameRing(RING_SLOTS, capacity)
+        context = mp.get_context('spawn')
+        self.commands = context.SimpleQueue()
+        self.process = context.Process(target=simulation_loop, daemon=True,
+                                       args=(self.commands, self.ring.names, self.ring.locks, capacity, width,
+                                             height, rate, maxSubsteps, workers, obstacles, record, seed,
+                                             flock_module.DISTANCE_RADIUS_CHECK))
+        self.process.start()
+        self.set_parameters(flock_module.MAX_FORCE, flock_module.MAX_SPEED, 1.0)
+
+    def __len__(self) -> int:
+        latest: int = self.ring.latest
+        return 0 if latest < 0 else int(self.ring.arrays['header'][latest, BOIDS])
+
+    def __str__(self):
+        return f'SimulationProcess({len(self)} boids | {self.width}x{self.height} | pid {self.process.pid})'
+
+    def __getattr__(self, name: str):
+        if name not in FLOCK_COMMANDS: raise AttributeError(name)
+        return lambda *args, **kwargs: self.commands.put((name, args, kwargs))
+
+    @property
+    def index(self) -> CellGrid:
+        """
+        Grid of the flock of the process (same geometry, empty), for the background
+        """
+        return CellGrid.for_radius(self.width, self.height, flock_module.DISTANCE_RADIUS_CHECK,
+                                   flock_module.CELS_PER_RADIUS)
+
+    def set_parameters(self, maxForce: float, maxSpeed: float, speed: float) -> None:
+        """
+        :param speed: Simulated seconds per real second
+        """
+        parameters: tuple = (maxForce, maxSpeed, speed)
+        if parameters == self.parameters: return
+        self.parameters = parameters
+        self.commands.put(('parameters', parameters, {}))
+
+    def add_obstacle(self, obstacle) -> None:
+        if self.obstacles is None: self.obstacles = ObstacleField(self.width, self.height)
+        self.obstacles.add(obstacle)
+        self.commands.put(('add_obstacle', (obstacle,), {}))
+
+    def clear_obstacles(self) -> None:
+        self.obstacles = None
+        self.commands.put(('clear_obstacles', (), {}))
+
+    def newest(self):
+        return self.ring.newest()
+
+    def close(self) -> None:
+        if self.process is None: return
+        self.commands.put(None)
+        self.process.join(timeout=5)
+        if self.process.is_alive(): self.process.terminate()
+        self.process = None
+        self.ring.close()
+
+
+'''
+=====================================================
+        STATIC FUNCTIONS USED IN THE CASS
+        NOT MEANT TO BE IMPORT
+=====================================================
+'''
+
+def simulation_loop(commands, names: dict, locks: list, capacity: int, width: float, height: float, rate: float,
+                    maxSubsteps: int, workers: int, obstacles: ObstacleField, record: str, seed: int,
+                    radius: float) -> None:
+    """
+    Body of the simulation process: apply the commands, step the flock when steps are due in real
+    time (times the simulation speed), publish the new state. None on the queue stops it.
+    """
+    ring = FrameRing(len(locks), capacity, names, locks)
+    flock_module.set_distance_radius(radius)
+    flock = Flock(width, height, rng=np.random.default_rng(seed), workers=workers, obstacles=obstacles)
+    timestep = FixedTimestep(rate, maxSubsteps)
+    recorder = None if record is None else Recorder(record, width, height, rate)
+    speed: float = 1.0
+    simulationTime: float = 0.0
+    steps: int = 0
+    stepsPerSecond: float = 0.0
+    windowSteps: int = 0
+    windowStart: float = time.perf_counter()
+    last: float = windowStart
+
+    try:
+        running: bool = True
+        while running:
+            changed: bool = False
+            while not commands.empty():
+                command = commands.get()
+                if command is None: running = False; break
+                name, args, kwargs = command
+                if name == 'parameters':
+                    maxForce, maxSpeed, speed = args
+                    flock_module.set_max_force(maxForce)
+                    flock_module.set_max_speed(maxSpeed)
+                    continue
+                if name == 'spawn': args = (min(args[0], capacity - len(flock)),) + args[1:]
+                if name == 'add' and len(flock) >= capacity: continue
+                try:
+                    getattr(flock, name)(*args, **kwargs)
+                except (IndexError, ValueError):
+                    # Boids chosen by the renderer from an older frame may be gone by now
+                    if name != 'remove': raise
+                    continue
+                changed = True
+            if not running: break
+
+            now: float = time.perf_counter()
+            due: int = timestep.advance((now - last) * speed)
+            last = now
+            for _ in range(due):
+                flock.step(timestep.deltaTime)
+                simulationTime += timestep.deltaTime
+                if recorder is not None: recorder.record_flock(flock, simulationTime)
+            steps += due; windowSteps += due
+            if now - windowStart >= RATE_WINDOW:
+                stepsPerSecond = windowSteps / (now - windowStart)
+                windowSteps = 0; windowStart = now
+
+            if due or changed:
+                ring.write(flock, simulationTime, steps, stepsPerSecond)
+            else:
+                # Until the next step is due, or a little while when paused
+                pending: float = (timestep.deltaTime - timestep.accumulator) / speed if speed > 0 else IDLE_SLEEP
+                time.sleep(min(max(pending, 0.0), IDLE_SLEEP))
+    finally:
+        flock.close()
+        if recorder is not None: recorder.close()
+        ring.close()
@@ -0,0 +1,55 @@
+'''
+=====================================================
+    FIXED TIMESTEP ACCUMULATOR
+=====================================================
+'''
+
+
+class FixedTimestep:
+    """
+    Runs the physics at a fixed rate whatever the render rate. Every frame adds its duration
+    to an accumulator, which is spent in whole physics steps; the remainder gives the
+    interpolation factor between the last two physics states.
+    """
+    def __init__(self, rate: float = 120, maxSubsteps: int = 5):
+        """
+        :param rate: Physics steps per simulated second
+        :param maxSubsteps: Cap of physics steps per frame. Beyond it the backlog is dropped,
+                            so a slow frame slows the simulation down instead of snowballing.
+        """
+        self.rate = rate
+        self.maxSubsteps = maxSubsteps
+        self.accumulator: float = 0.0
+        self.dropped: float = 0.0
+
+    def __str__(self):
+        return f'FixedTimestep({self.rate} Hz, max {self.maxSubsteps} steps per frame)'
+
+    @property
+    def deltaTime(self) -> float:
+        return 1 / self.rate
+
+    def set_rate(self, rate: float) -> None:
+        # Keep the same fraction of a step pending
+        self.accumulator *= self.rate / rate
+        self.rate = rate
+
+    def advance(self, frameTime: float) -> int:
+        """
+        :param frameTime: Simulated time elapsed since the last frame
+        :return: Number of physics steps of deltaTime to run this frame
+        """
+        self.accumulator += frameTime
+        steps: int = min(int(self.accumulator / self.deltaTime), self.maxSubsteps)
+        self.accumulator -= steps * self.deltaTime
+        if self.accumulator >= self.deltaTime:
+            pending: float = self.accumulator % self.deltaTime
+            self.dropped += self.accumulator - pending
+            self.accumulator = pending
+        return steps
+
+    def alpha(self) -> float:
+        """
+        :return: Fraction of a step pending, how far to interpolate between the last two states
+        """
+        return min(self.accumulator / self.deltaTime, 1.0)
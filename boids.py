@@ -0,0 +1,359 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+from Profiler import Profiler
+import Flock as flock_module
+from Flock import Flock
+
+'''
+=====================================================
+    COMMAND LINE ENTRY POINT: python -m boids <command>
+=====================================================
+'''
+
+
+def build_flock(n: int, width: int, height: int, rules: str, backend: str, seed: int = None,
+                threads: int = None, jit: bool = None, profiler=None) -> Flock:
+    """
+    :param rules: Enabled rules, any of the letters S (separation), A (alignment), C (cohesion)
+    :return: A flock of n boids spread uniformly over the screen
+    """
+    rules = rules.upper()
+    flock = Flock(width, height, rng=np.random.default_rng(seed), backend=backend, workers=threads, jit=jit,
+                  profiler=profiler)
+    flock.spawn(n, separation='S' in rules, alignment='A' in rules, cohesion='C' in rules)
+    return flock
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Step the simulation at a fixed dt as fast as possible and report steps/sec
+    """
+    if args.record_every < 1: sys.exit('--record-every must be at least 1')
+    if args.neighbour_limit is not None and args.neighbour_limit < 1: sys.exit('--neighbour-limit must be at least 1')
+    flock_module.set_resolution(args.width, args.height)
+    flock_module.set_far_field(args.far_field)
+    flock_module.set_stencil_sums(args.stencil_sums)
+    flock_module.set_neighbour_limit(args.neighbour_limit)
+    profiler = Profiler(enabled=args.trace is not None)
+    flock = build_flock(args.n, args.width, args.height, args.rules, args.backend, args.seed, args.threads,
+                        args.jit, profiler)
+    if args.workers is not None:
+        # ParallelFlock workers run the exact NumPy rules over all the neighbours only
+        for flag, value in (('--far-field', args.far_field), ('--stencil-sums', args.stencil_sums),
+                            ('--neighbour-limit', args.neighbour_limit), ('--obstacles', args.obstacles)):
+            if value: sys.exit(f'{flag} needs the threaded Flock, not --workers')
+    if args.obstacles is not None:
+        from Obstacles import ObstacleField
+        flock.obstacles = ObstacleField.load(args.obstacles, args.width, args.height)
+    if args.workers is not None:
+        from ParallelFlock import ParallelFlock
+        flock = ParallelFlock(flock, workers=args.workers, seed=args.seed)
+
+    screen = None
+    if not args.headless:
+        import pygame as py
+        from Draw import SpriteAtlas
+        from Compositor import paint_obstacles
+        py.init()
+        screen = py.display.set_mode((args.width, args.height))
+        py.display.set_caption('Py Boid simulation')
+        atlas = SpriteAtlas()
+        background = py.Surface((args.width, args.height))
+        if args.obstacles is not None: paint_obstacles(background, flock.obstacles, (60, 60, 60))
+
+    recorder = None
+    if args.record is not None:
+        from Recorder import Recorder
+        recorder = Recorder(args.record, args.width, args.height, 1 / args.dt, seed=args.seed, rules=args.rules)
+
+    start: float = time.perf_counter()
+    for step in range(args.steps):
+        with profiler.span('step'):
+            flock.step(args.dt)
+        profiler.end_frame()
+        if recorder is not None and (step + 1) % args.record_every == 0:
+            recorder.record_flock(flock, (step + 1) * args.dt)
+        if screen is not None:
+            py.event.pump()
+            screen.blit(background, (0, 0))
+            atlas.draw(screen, flock)
+            py.display.update()
+    elapsed: float = time.perf_counter() - start
+
+    if screen is not None: py.quit()
+    flock.close()
+    print(f'{args.n} boids, {args.steps} steps in {elapsed:.2f} s: {args.steps / elapsed:.2f} steps/sec')
+    if recorder is not None:
+        recorder.close()
+        print(recorder)
+    if args.trace is not None:
+        profiler.export_chrome_trace(args.trace)
+        spans, counters = profiler.summary()
+        print(f'Last {len(profiler.frames)} steps, per step: ' + ', '.join(
+            [f'{name} {ms:.2f} ms' for name, ms in spans.items()] +
+            [f'{name} {value:.0f}' for name, value in counters.items()]))
+        print(f'Trace saved to {args.trace}')
+
+def export(args: argparse.Namespace) -> None:
+    """
+    Render a clip offline: fixed dt, every frame rasterised off screen and encoded by a thread
+    pool while the next one is stepped. Same seed, same files, however slow the machine.
+    """
+    import pygame as py
+    from Draw import SpriteAtlas, draw_points
+    from Compositor import paint_obstacles
+    from Export import FrameWriter, surface_pixels
+    if args.neighbour_limit is not None and args.neighbour_limit < 1: sys.exit('--neighbour-limit must be at least 1')
+    flock_module.set_resolution(args.width, args.height)
+    flock_module.set_neighbour_limit(args.neighbour_limit)
+    flock = build_flock(args.n, args.width, args.height, args.rules, args.backend, args.seed, args.threads)
+    background = py.Surface((args.width, args.height))
+    if args.obstacles is not None:
+        from Obstacles import ObstacleField
+        flock.obstacles = ObstacleField.load(args.obstacles, args.width, args.height)
+        paint_obstacles(background, flock.obstacles, (60, 60, 60))
+    canvas = py.Surface((args.width, args.height))
+    draw = draw_points if args.points else SpriteAtlas().draw
+    writer = FrameWriter(args.output, args.format, args.encoders)
+
+    frames: int = round(args.seconds * args.fps)
+    stepsPerFrame: int = max(1, round(1 / (args.fps * args.dt)))
+    stepTime = drawTime = 0.0
+    start: float = time.perf_counter()
+    for frame in range(frames):
+        stepped: float = time.perf_counter()
+        for _ in range(stepsPerFrame):
+            flock.step(args.dt)
+        drawn: float = time.perf_counter()
+        canvas.blit(background, (0, 0))
+        draw(canvas, flock)
+        writer.submit(surface_pixels(canvas))
+        stepTime += drawn - stepped; drawTime += time.perf_counter() - drawn
+    writer.close()
+    elapsed: float = time.perf_counter() - start
+    flock.close()
+
+    print(f'{frames} frames ({frames / args.fps:.1f} s of clip, {stepsPerFrame} steps each) of {args.n} boids '
+          f'in {elapsed:.2f} s: {frames / elapsed:.2f} frames/sec, {frames / args.fps / elapsed:.2f}x real time')
+    print(f'Per frame: physics {stepTime / frames * 1000:.1f} ms, drawing {drawTime / frames * 1000:.1f} ms')
+    print(writer)
+
+def gui(args: argparse.Namespace) -> None:
+    """
+    Interactive simulator (init.py)
+    """
+    import init
+    init.main(record=args.record, trace=args.trace, obstacles=args.obstacles, process=args.process,
+              budget=None if args.budget_ms is None else args.budget_ms / 1000, governor_log=args.governor_log)
+
+def play(args: argparse.Namespace) -> None:
+    """
+    Replay a trajectory file in the interactive simulator, without running the physics
+    """
+    import init
+    init.main(replay=args.file)
+
+def report_regressions(regressions: list, threshold: float) -> None:
+    if not regressions:
+        print(f'No regressions beyond {threshold:.0%}')
+        return
+    print(f'{len(regressions)} regressions beyond {threshold:.0%}:')
+    for r in regressions:
+        print(f'  {r["engine"]:>14} {r["n"]:>7} {r["layout"]:>10} {r["rules"] or "-":>4} {r["phase"]:>12}: '
+              f'{r["baseline_ms"]:.2f} -> {r["current_ms"]:.2f} ms ({r["change"]:+.0%})')
+    sys.exit(1)
+
+def bench(args: argparse.Namespace) -> None:
+    """
+    Run the benchmark suite, save it as JSON and optionally compare it with a previous run
+    """
+    import Benchmark
+    results = Benchmark.run_suite(engines=tuple(args.engines), counts=tuple(args.counts),
+                                  layouts=tuple(args.layouts), rules=tuple(r.strip('-') for r in args.rules),
+                                  width=args.width, height=args.height, steps=args.steps,
+                                  warmup=args.warmup, deltaTime=args.dt, seed=args.seed,
+                                  maxObjectBoids=args.max_object_boids)
+    if args.output is not None:
+        Benchmark.save(results, args.output)
+        print(f'Saved {len(results["results"])} cases to {args.output}')
+    if args.compare is not None:
+        report_regressions(Benchmark.compare(Benchmark.load(args.compare), results, args.threshold), args.threshold)
+
+def far_field(args: argparse.Namespace) -> None:
+    """
+    Error and speed of the far field approximation against the exact rules
+    """
+    import Benchmark
+    print(f'{"n":>7} {"layout":>10} {"rms":>7} {"max":>7} {"angle":>7} {"count":>7} {"exact ms":>9} {"far ms":>9}')
+    for n in args.counts:
+        for layout in args.layouts:
+            e = Benchmark.far_field_error(n, layout, args.width, args.height, args.seed, args.jit)
+            print(f'{n:>7} {layout:>10} {e["rms"]:>7.3f} {e["max"]:>7.3f} {e["angle"]:>6.1f}° {e["count"]:>7.1%} '
+                  f'{e["exact_ms"]:>9.2f} {e["far_ms"]:>9.2f}')
+
+def sweep(args: argparse.Namespace) -> None:
+    """
+    Run every combination of the given parameters as one ensemble and print their metrics
+    """
+    import Ensemble
+    grid: dict = {name: getattr(args, name) for name in Ensemble.ENSEMBLE_PARAMETERS
+                  if getattr(args, name) is not None}
+    start: float = time.perf_counter()
+    results: list = Ensemble.sweep(args.n, args.steps, args.dt, args.width, args.height, args.seed, **grid)
+    elapsed: float = time.perf_counter() - start
+    names: list = list(grid)
+    print(' '.join(f'{name:>10}' for name in names) + f' {"polarization":>12} {"speed":>7} {"neighbours":>10}')
+    for r in results:
+        print(' '.join(f'{r[name]:>10g}' for name in names) +
+              f' {r["polarization"]:>12.3f} {r["speed"]:>7.3f} {r["neighbours"]:>10.1f}')
+    print(f'{len(results)} flocks x {args.n} boids x {args.steps} steps in {elapsed:.2f} s')
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'n': args.n, 'steps': args.steps, 'dt': args.dt, 'width': args.width,
+                       'height': args.height, 'seed': args.seed, 'results': results}, file, indent=1)
+        print(f'Saved {len(results)} flocks to {args.output}')
+
+def compare(args: argparse.Namespace) -> None:
+    import Benchmark
+    report_regressions(Benchmark.compare(Benchmark.load(args.baseline), Benchmark.load(args.current),
+                                         args.threshold), args.threshold)
+
+def add_benchmark_arguments(benchParser: argparse.ArgumentParser, farParser: argparse.ArgumentParser) -> None:
+    """
+    Arguments of the bench and farfield commands, whose defaults and choices come from Benchmark
+    """
+    import Benchmark
+    benchParser.add_argument('--engines', nargs='+', default=list(Benchmark.ENGINES), choices=list(Benchmark.ENGINES))
+    benchParser.add_argument('--counts', nargs='+', type=int, default=list(Benchmark.COUNTS))
+    benchParser.add_argument('--layouts', nargs='+', default=list(Benchmark.LAYOUTS), choices=list(Benchmark.LAYOUTS))
+    benchParser.add_argument('--rules', nargs='+', default=[r or '-' for r in Benchmark.RULES],
+                             help='Rule combinations, e.g. SAC SA - (- = no rules)')
+    benchParser.add_argument('--steps', type=int, default=5, help='Timed steps per case')
+    benchParser.add_argument('--warmup', type=int, default=1, help='Untimed steps per case')
+    benchParser.add_argument('--dt', type=float, default=0.016)
+    benchParser.add_argument('--width', type=int, default=3840)
+    benchParser.add_argument('--height', type=int, default=2160)
+    benchParser.add_argument('--seed', type=int, default=0)
+    benchParser.add_argument('--max-object-boids', type=int, default=Benchmark.MAX_OBJECT_BOIDS,
+                             help='Skip the per boid engines above this count')
+    benchParser.add_argument('--output', default=None, help='JSON file for the results')
+    benchParser.add_argument('--compare', default=None, help='Baseline JSON to flag regressions against')
+    benchParser.add_argument('--threshold', type=float, default=0.1, help='Relative slow down flagged (0.1 = 10%%)')
+
+    farParser.add_argument('--counts', nargs='+', type=int, default=[1000, 10000])
+    farParser.add_argument('--layouts', nargs='+', default=list(Benchmark.LAYOUTS), choices=list(Benchmark.LAYOUTS))
+    farParser.add_argument('--width', type=int, default=3840)
+    farParser.add_argument('--height', type=int, default=2160)
+    farParser.add_argument('--seed', type=int, default=0)
+    farParser.add_argument('--no-jit', dest='jit', action='store_false')
+
+def main(argv: list = None) -> None:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(prog='python -m boids', description='Py Boid simulation')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runParser = commands.add_parser('run', help='Step a flock at a fixed dt and report steps/sec')
+    runParser.add_argument('--n', type=int, default=1000, help='Number of boids')
+    runParser.add_argument('--steps', type=int, default=1000, help='Number of steps to simulate')
+    runParser.add_argument('--dt', type=float, default=0.016, help='Fixed time step (s)')
+    runParser.add_argument('--width', type=int, default=flock_module.SCREEN_WIDTH)
+    runParser.add_argument('--height', type=int, default=flock_module.SCREEN_HEIGHT)
+    runParser.add_argument('--rules', default='SAC', help='Enabled rules: S, A and/or C')
+    runParser.add_argument('--backend', default=flock_module.NEIGHBOUR_BACKEND,
+                           choices=flock_module.NEIGHBOUR_BACKENDS)
+    runParser.add_argument('--seed', type=int, default=None)
+    runParser.add_argument('--no-jit', dest='jit', action='store_false',
+                           help='Use the NumPy rules even when numba is installed')
+    runParser.add_argument('--far-field', dest='far_field', action='store_true',
+                           help='Approximate the cells beyond the separation margin by their aggregates')
+    runParser.add_argument('--stencil-sums', dest='stencil_sums', action='store_true',
+                           help='Alignment and cohesion over the stencil cells from summed-area tables')
+    runParser.add_argument('--neighbour-limit', dest='neighbour_limit', type=int, default=None,
+                           help='Only the k nearest neighbours within the radius count (about 7 in real flocks)')
+    runParser.add_argument('--threads', type=int, default=None,
+                           help='Step chunks of the flock on this many threads')
+    runParser.add_argument('--workers', type=int, default=None,
+                           help='Step the flock with this many processes (ParallelFlock)')
+    runParser.add_argument('--obstacles', default=None,
+                           help='JSON file of circles, polygons and mask images the boids avoid')
+    runParser.add_argument('--headless', action='store_true', help='Do not open a window (no pygame)')
+    runParser.add_argument('--record', default=None, help='Trajectory file to record the run to')
+    runParser.add_argument('--record-every', type=int, default=1, help='Record one step out of this many')
+    runParser.add_argument('--trace', default=None, help='Profile every step and save a Chrome trace JSON here')
+    runParser.set_defaults(func=run)
+
+    guiParser = commands.add_parser('gui', help='Interactive simulator, as python init.py')
+    guiParser.add_argument('--process', action='store_true',
+                           help='Step the flock in its own process, the window only draws its newest state')
+    guiParser.add_argument('--obstacles', default=None, help='JSON file of obstacles')
+    guiParser.add_argument('--record', default=None, help='Trajectory file to record the run to')
+    guiParser.add_argument('--trace', default=None, help='Profile the run and save a Chrome trace JSON here')
+    guiParser.add_argument('--budget-ms', dest='budget_ms', type=float, default=None,
+                           help='Target frame time: quality is degraded while the frames are slower (e.g. 16.7)')
+    guiParser.add_argument('--governor-log', dest='governor_log', default=None,
+                           help='JSON lines file of every quality change of --budget-ms')
+    guiParser.set_defaults(func=gui)
+
+    exportParser = commands.add_parser('export', help='Render a clip offline to numbered PNG or raw frames')
+    exportParser.add_argument('output', help='Directory of the frames')
+    exportParser.add_argument('--n', type=int, default=1000, help='Number of boids')
+    exportParser.add_argument('--seconds', type=float, default=10, help='Length of the clip')
+    exportParser.add_argument('--fps', type=float, default=60, help='Frames per second of the clip')
+    exportParser.add_argument('--dt', type=float, default=1 / 120, help='Fixed time step (s), rounded to whole steps per frame')
+    exportParser.add_argument('--width', type=int, default=1920)
+    exportParser.add_argument('--height', type=int, default=1080)
+    exportParser.add_argument('--rules', default='SAC', help='Enabled rules: S, A and/or C')
+    exportParser.add_argument('--backend', default=flock_module.NEIGHBOUR_BACKEND,
+                              choices=flock_module.NEIGHBOUR_BACKENDS)
+    exportParser.add_argument('--seed', type=int, default=0, help='Same seed, same frames')
+    exportParser.add_argument('--neighbour-limit', dest='neighbour_limit', type=int, default=None,
+                              help='Only the k nearest neighbours within the radius count')
+    exportParser.add_argument('--threads', type=int, default=None,
+                              help='Step chunks of the flock on this many threads (same frames with any number)')
+    exportParser.add_argument('--obstacles', default=None, help='JSON file of obstacles')
+    exportParser.add_argument('--format', default='png', choices=['png', 'raw'],
+                              help='png, or raw RGB24 frames (ffmpeg -f rawvideo -pix_fmt rgb24)')
+    exportParser.add_argument('--encoders', type=int, default=None, help='Encoder threads, one per core by default')
+    exportParser.add_argument('--points', action='store_true', help='Draw the boids as points instead of sprites')
+    exportParser.set_defaults(func=export)
+
+    playParser = commands.add_parser('play', help='Replay a trajectory file recorded with run --record')
+    playParser.add_argument('file')
+    playParser.set_defaults(func=play)
+
+    benchParser = commands.add_parser('bench', help='Time every engine, layout and rule combination')
+    benchParser.set_defaults(func=bench)
+    farParser = commands.add_parser('farfield', help='Error and speed of the far field approximation')
+    farParser.set_defaults(func=far_field)
+    # Benchmark loads every engine (ParallelFlock, the object boids), only its own commands pay for it
+    if argv[:1] in (['bench'], ['farfield']): add_benchmark_arguments(benchParser, farParser)
+
+    sweepParser = commands.add_parser('sweep', help='Run a grid of parameter values as one batched ensemble')
+    sweepParser.add_argument('--n', type=int, default=500, help='Boids per flock')
+    sweepParser.add_argument('--steps', type=int, default=300)
+    sweepParser.add_argument('--dt', type=float, default=0.016)
+    sweepParser.add_argument('--width', type=int, default=flock_module.SCREEN_WIDTH)
+    sweepParser.add_argument('--height', type=int, default=flock_module.SCREEN_HEIGHT)
+    sweepParser.add_argument('--seed', type=int, default=None)
+    sweepParser.add_argument('--max-force', dest='max_force', nargs='+', type=float, default=None)
+    sweepParser.add_argument('--max-speed', dest='max_speed', nargs='+', type=float, default=None)
+    sweepParser.add_argument('--radius', nargs='+', type=float, default=None)
+    sweepParser.add_argument('--margin', nargs='+', type=float, default=None)
+    sweepParser.add_argument('--output', default=None, help='JSON file for the results')
+    sweepParser.set_defaults(func=sweep)
+
+    compareParser = commands.add_parser('compare', help='Flag regressions between two benchmark JSON files')
+    compareParser.add_argument('baseline')
+    compareParser.add_argument('current')
+    compareParser.add_argument('--threshold', type=float, default=0.1)
+    compareParser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,56 @@
 import pygame as py
 import pygame_widgets as pyw
 from pygame_widgets.slider import Slider
-import random
-import concurrent.futures
-
-from Boid import Boid, CELS_PER_AXIS, AVG_SIZE, set_max_force, set_max_speed, set_resolution
+import os
+
+import Flock as flock_module
+from Flock import Flock, set_max_force, set_max_speed, set_resolution, set_distance_radius
+from Draw import SpriteAtlas, draw_points
+from Compositor import Compositor, grid_background, paint_obstacles, HUD_FPS
+from Governor import Governor
+from Obstacles import ObstacleField, Circle
+from Timestep import FixedTimestep
+from Recorder import Recorder, Recording, Player
+from Profiler import Profiler
+from SimulationProcess import SimulationProcess, STEPS_PER_SECOND
 from Text import Text
 
-def print_matriz(matriz: list)->None:
-    print("\n\n")
-    for fila in matriz:
-        print("[ ", end="")
-        for element in fila:
-            print("[", end="")
-            for e in element:
-                print(str(e), end="")
-            print("]", end=" ")
-        print("]")
-
-def main() -> None:
+def main(replay: str = None, record: str = None, trace: str = None, obstacles: str = None,
+         process: bool = False, budget: float = None, governor_log: str = None) -> None:
+    """
+    :param replay: Trajectory file (see Recorder.py) to play instead of running the physics.
+                   SIMULATION X sets the playback speed, SPACE pauses, LEFT / RIGHT seek.
+    :param record: Trajectory file where every physics step is recorded
+    :param trace: Profile the whole run (P shows the overlay) and save its Chrome trace here
+    :param obstacles: JSON file of obstacles (see ObstacleField.load), more are placed with a right click
+    :param process: Step the flock in its own process (SimulationProcess.py), this one only draws the
+                    newest state, so rendering and physics do not slow each other down
+    :param budget: Target frame time (s). A Governor (Governor.py) then degrades the quality (HUD refresh,
+                   points instead of sprites and, when the physics runs here, neighbour cap, physics
+                   rate and radius) while the frames run over it, and restores it when they are back under.
+    :param governor_log: JSON lines file of the decisions of the governor
+    """
     # ================ DEFAULT VALUES ================
     REFERENCE_FPS = 1200
+    PHYSICS_FPS = 120
+    MAX_PHYSICS_STEPS = 5
     BLUE: tuple = (27, 78, 207)
-    RED: tuple = (232, 57, 51)
-    GREEN: tuple = (72, 232, 51)
-    PURPLE: tuple = (202, 67, 230)
-
-    COLORS: list[tuple] = [BLUE, RED, GREEN, PURPLE]
+    GREY: tuple = (60, 60, 60)
+    OBSTACLE_RADIUS: float = 40
+    # Boids added around the mouse (scroll up) or removed at random (scroll down) per wheel notch
+    SCROLL_BOIDS: int = 100
     # ================ BASE ================
     py.init()
     infoObject = py.display.Info()
-    set_resolution(infoObject.current_w, infoObject.current_h)
     SCREEN_WIDTH = infoObject.current_w; SCREEN_HEIGHT = infoObject.current_h
-    CEL_GAP_X = SCREEN_WIDTH/CELS_PER_AXIS; CEL_GAP_Y = SCREEN_HEIGHT/CELS_PER_AXIS
     #SCREEN_WIDTH = 1400; SCREEN_HEIGHT = 700
-    SCREEN = py.display.set_mode((infoObject.current_w, infoObject.current_h)) #, py.FULLSCREEN
+    RECORDING: Recording = None
+    if replay is not None:
+        # Recorded coordinates are pixels of the recorded screen, the window takes its size
+        RECORDING = Recording(replay)
+        SCREEN_WIDTH = int(RECORDING.width); SCREEN_HEIGHT = int(RECORDING.height)
+    set_resolution(SCREEN_WIDTH, SCREEN_HEIGHT)
+    SCREEN = py.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT)) #, py.FULLSCREEN
     #SCREEN = py.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT)) #, py.FULLSCREEN
     py.display.set_caption('Py Boid simulation')
     CLOCK = py.time.Clock()
@@ -47,17 +63,13 @@ def main() -> None:
     slider_offSetY: int = 25
     text_font = py.font.SysFont("Arial", text_size)
 
-    def draw_text(textToRender: Text) -> None:
-        img = text_font.render(str(textToRender), True, textToRender.text_col)
-        SCREEN.blit(img, textToRender.pos)
-
     AlignmentText = Text("Alignment (1)",True, 10, SCREEN_HEIGHT - text_size*1 - text_offSet)
     CohesionText = Text("Cohesion (2)",True, 10, SCREEN_HEIGHT - text_size*2 - text_offSet)
     SeparationText = Text("Separation (3)",True, 10, SCREEN_HEIGHT - text_size*3 - text_offSet)
     FPSText = Text("FPS", 60,10, text_size*0 + text_offSet)
     BOIDSText = Text("BOIDS", 0,10, text_size*1 + text_offSet)
     BOIDSInfo1Text = Text("Add (Click / Scroll)",None,10, text_size*2 + text_offSet)
-    BOIDSInfo2Text = Text("Remove (Q)",None,10, text_size*3 + text_offSet)
+    BOIDSInfo2Text = Text("Remove (Q / Scroll down)",None,10, text_size*3 + text_offSet)
     BOIDSInfo3Text = Text("Rotate (R)",None,10, text_size*4 + text_offSet)
     BOIDSInfo4Text = Text("Random (T)",None,10, text_size*5 + text_offSet)
 
@@ -86,114 +98,222 @@ def main() -> None:
                      SCREEN_WIDTH - slider_offSetX * 3.75,
                      SCREEN_HEIGHT - slider_offSetY * 2)
 
-    TEXTS = [AlignmentText,CohesionText,SeparationText,FPSText, BOIDSText,
-             FORCEText, SPEEDText,SIMULATIONText, BOIDSInfo1Text, BOIDSInfo2Text, BOIDSInfo3Text, BOIDSInfo4Text]
-
-
-    # ================ COMPONENTS ================
-    BOIDS_MATRIX = []
-
-    for i,_ in enumerate(range(CELS_PER_AXIS)):
-        BOIDS_MATRIX.append([])
-        for _ in range(CELS_PER_AXIS):
-            BOIDS_MATRIX[i].append([])
-
-    BOIDS: list[Boid] = []
+    BOIDSInfo5Text = Text("Profile (P)",None,10, text_size*6 + text_offSet)
+    BOIDSInfo6Text = Text("Obstacle (Right click / C)",None,10, text_size*7 + text_offSet)
 
-    def add_boid(x: float = None, y: float = None):
-        if x is None: x = random.uniform(0, SCREEN_WIDTH)
-        if y is None: y = random.uniform(0, SCREEN_HEIGHT)
-
-        newBoid: Boid = Boid(x=x, y=y, size=AVG_SIZE, color=random.choice(COLORS), matrix=BOIDS_MATRIX)
-        newBoid.switch_alignment(bool(AlignmentText.get_value()))
-        newBoid.switch_cohesion(bool(CohesionText.get_value()))
-        newBoid.switch_separation(bool(SeparationText.get_value()))
+    TEXTS = [AlignmentText,CohesionText,SeparationText,FPSText, BOIDSText,
+             FORCEText, SPEEDText,SIMULATIONText, BOIDSInfo1Text, BOIDSInfo2Text, BOIDSInfo3Text, BOIDSInfo4Text,
+             BOIDSInfo5Text, BOIDSInfo6Text]
 
-        BOIDSText.set_value(int(BOIDSText.get_value()) + 1)
-        BOIDS.append(newBoid)
+    # Profiling overlay, ms per frame of every phase and neighbour counters
+    PROFILE_PHASES: list = ['physics', 'grid rebuild', 'neighbours', 'rules', 'integration', 'draw', 'hud', 'display']
+    PROFILE_COUNTERS: list = ['candidates', 'accepted']
+    PROFILE_TEXTS: dict = {name: Text(f'{name} (ms)' if name in PROFILE_PHASES else name, 0,
+                                      SCREEN_WIDTH - 220, text_size*k + text_offSet)
+                           for k, name in enumerate(PROFILE_PHASES + PROFILE_COUNTERS + ['occupancy'])}
 
-    def remove_boid():
-        if int(BOIDSText.get_value()) <= 0: return
-        BOIDSText.set_value(int(BOIDSText.get_value()) -1)
-        boid = BOIDS.pop(random.randrange(0,len(BOIDS)))
-        boid.remove_from_matrix()
 
-    for x in range(100):
-        add_boid()
+    # ================ COMPONENTS ================
+    PROFILER: Profiler = Profiler(enabled=trace is not None)
+    OBSTACLES: ObstacleField = None if obstacles is None else ObstacleField.load(obstacles, SCREEN_WIDTH,
+                                                                                 SCREEN_HEIGHT)
+    if process and replay is None:
+        FLOCK: SimulationProcess = SimulationProcess(SCREEN_WIDTH, SCREEN_HEIGHT, PHYSICS_FPS, MAX_PHYSICS_STEPS,
+                                                     workers=os.cpu_count(), obstacles=OBSTACLES, record=record)
+        SIMText = Text("SIM STEPS/S", 0, 10, text_size*8 + text_offSet)
+        TEXTS.append(SIMText)
+    else:
+        process = False
+        FLOCK: Flock = Flock(SCREEN_WIDTH, SCREEN_HEIGHT, workers=os.cpu_count(), profiler=PROFILER,
+                             obstacles=OBSTACLES)
+    ATLAS: SpriteAtlas = SpriteAtlas()
+    TIMESTEP: FixedTimestep = FixedTimestep(PHYSICS_FPS, MAX_PHYSICS_STEPS)
+    # Grid dots (the cells of the flock) drawn once, only what changed is redrawn and sent to the display
+    def make_background() -> py.Surface:
+        background = grid_background(SCREEN_WIDTH, SCREEN_HEIGHT, FLOCK.index.cels_x, FLOCK.index.cels_y, BLUE)
+        return background if FLOCK.obstacles is None else paint_obstacles(background, FLOCK.obstacles, GREY)
+    COMPOSITOR: Compositor = Compositor(SCREEN, make_background(), text_font)
+    DRAW_FLOCK = ATLAS.draw
+    for slider in [FORCESlider, SPEEDSlider, SIMULATIONSlider]:
+        COMPOSITOR.add_widget(py.Rect(slider.getX(), slider.getY(), slider.getWidth(), slider.getHeight())
+                              .inflate(2 * slider.handleRadius + 2, 2 * slider.handleRadius + 2))
+
+    def add_boid(x: float, y: float):
+        FLOCK.add((x, y),
+                  separation=bool(SeparationText.get_value()),
+                  alignment=bool(AlignmentText.get_value()),
+                  cohesion=bool(CohesionText.get_value()))
+        BOIDSText.set_value(len(FLOCK))
+
+    def spawn_boids(n: int):
+        FLOCK.spawn(n,
+                    separation=bool(SeparationText.get_value()),
+                    alignment=bool(AlignmentText.get_value()),
+                    cohesion=bool(CohesionText.get_value()))
+        BOIDSText.set_value(len(FLOCK))
+
+    def spawn_around(x: float, y: float):
+        FLOCK.spawn(SCROLL_BOIDS,
+                    separation=bool(SeparationText.get_value()),
+                    alignment=bool(AlignmentText.get_value()),
+                    cohesion=bool(CohesionText.get_value()),
+                    region=(x - OBSTACLE_RADIUS, y - OBSTACLE_RADIUS, x + OBSTACLE_RADIUS, y + OBSTACLE_RADIUS),
+                    distribution='gaussian')
+        BOIDSText.set_value(len(FLOCK))
+
+    def add_obstacle(x: float, y: float):
+        # Compiled again with the new circle, the field is only rebuilt on clicks
+        FLOCK.add_obstacle(Circle(x, y, OBSTACLE_RADIUS))
+        COMPOSITOR.set_background(make_background())
+
+    def remove_boids(n: int = 1):
+        if len(FLOCK) <= 0: return
+        FLOCK.despawn(n)
+        BOIDSText.set_value(len(FLOCK))
+
+    PLAYER: Player = None
+    RECORDER: Recorder = None
+    simulationTime: float = 0.0
+    if replay is not None:
+        PLAYER = Player(RECORDING)
+        PLAYERText = Text("REPLAY (Space / Left / Right)", str(PLAYER), 10, text_size*8 + text_offSet)
+        TEXTS.append(PLAYERText)
+    else:
+        spawn_boids(100)
+    if record is not None and not process:
+        RECORDER = Recorder(record, SCREEN_WIDTH, SCREEN_HEIGHT, PHYSICS_FPS)
+
+    # ================ FRAME BUDGET ================
+    GOVERNOR: Governor = None
+    RADIUS: float = flock_module.DISTANCE_RADIUS_CHECK
+    def set_points(points: bool):
+        nonlocal DRAW_FLOCK
+        DRAW_FLOCK = draw_points if points else ATLAS.draw
+    def set_radius(scale: float):
+        set_distance_radius(RADIUS * scale)
+        FLOCK.fit_index()
+        COMPOSITOR.set_background(make_background())
+    if budget is not None:
+        knobs: dict = {'hud_fps': (HUD_FPS, COMPOSITOR.set_hud_fps), 'points': (False, set_points)}
+        if not process and PLAYER is None:
+            # The physics only costs frame time when it runs in this process
+            knobs.update({'neighbour_limit': (FLOCK.neighbourLimit, FLOCK.set_neighbour_limit),
+                          'physics_rate': (PHYSICS_FPS, TIMESTEP.set_rate),
+                          'radius': (1.0, set_radius)})
+        GOVERNOR = Governor(budget, knobs, profiler=PROFILER, log=governor_log)
+        QUALITYText = Text("QUALITY", "full", 10, text_size*9 + text_offSet)
+        TEXTS.append(QUALITYText)
+    # Phases are timed by the governor when there is one, it passes them on to the profiler
+    SPANS = PROFILER if GOVERNOR is None else GOVERNOR
 
     # ================ RUNNING LOOP ================
     RUNNING_GAME: bool = True
-    #with concurrent.futures.ThreadPoolExecutor(max_workers=12) as executor:
+    SHOW_PROFILE: bool = trace is not None
     while RUNNING_GAME:
-        #print_matriz(BOIDS_MATRIX)
         # ================ BASE ================
-        SCREEN.fill((0,0,0))
-        deltaTime = CLOCK.tick(REFERENCE_FPS) / 1000.0 * SIMULATIONSlider.getValue()
-        if deltaTime == 0: continue
-        FPSText.set_value(round(1/deltaTime, 2))
-
-        # ================ SHOW CELLS ================
-        for i in range(1, CELS_PER_AXIS):
-            pointX = i * CEL_GAP_X
-            for j in range(1, CELS_PER_AXIS):
-                pointY = j * CEL_GAP_Y
-                py.draw.circle(SCREEN, BLUE, (pointX, pointY), 1)
-        # ================ COMPONENTS ================
-        '''futures = [executor.submit(process_boid, boid, SCREEN, deltaTime) for boid in BOIDS]
-        # Wait for all the boids
-        concurrent.futures.wait(futures)'''
-        for boid in BOIDS:
-            boid.draw(SCREEN)
-            boid.boid_movement(deltaTime)
-
-        for text in TEXTS:
-            draw_text(text)
+        COMPOSITOR.begin_frame()
+        frameTime = CLOCK.tick(REFERENCE_FPS) / 1000.0
+        if frameTime == 0: continue
+        FPSText.set_value(round(1/frameTime, 2))
+        deltaTime = frameTime * SIMULATIONSlider.getValue()
+
+        if process:
+            # ================ NEWEST STATE OF THE SIMULATION PROCESS ================
+            FLOCK.set_parameters(FORCESlider.getValue(), SPEEDSlider.getValue(), SIMULATIONSlider.getValue())
+            with FLOCK.newest() as (frame, header), SPANS.span('draw'):
+                if frame is not None:
+                    BOIDSText.set_value(len(frame))
+                    SIMText.set_value(round(header[STEPS_PER_SECOND], 1))
+                    COMPOSITOR.add_drawn(DRAW_FLOCK(SCREEN, frame, doreturn=True))
+        elif PLAYER is None:
+            # ================ PHYSICS (FIXED RATE) ================
+            with SPANS.span('physics'):
+                for _ in range(TIMESTEP.advance(deltaTime)):
+                    FLOCK.step(TIMESTEP.deltaTime)
+                    simulationTime += TIMESTEP.deltaTime
+                    if RECORDER is not None: RECORDER.record_flock(FLOCK, simulationTime)
+
+            # ================ COMPONENTS ================
+            # Sizes and colours are derived here, between the last two physics states
+            with SPANS.span('draw'):
+                COMPOSITOR.add_drawn(DRAW_FLOCK(SCREEN, FLOCK, TIMESTEP.alpha(), doreturn=True))
+        else:
+            # ================ REPLAY (NO PHYSICS) ================
+            PLAYER.advance(deltaTime)
+            frame = PLAYER.frame()
+            BOIDSText.set_value(len(frame))
+            PLAYERText.set_value(str(PLAYER))
+            with SPANS.span('draw'):
+                COMPOSITOR.add_drawn(DRAW_FLOCK(SCREEN, frame, doreturn=True))
+
+        with SPANS.span('hud'):
+            if SHOW_PROFILE:
+                spans, counters = PROFILER.summary()
+                for name in PROFILE_PHASES: PROFILE_TEXTS[name].set_value(round(spans.get(name, 0), 2))
+                for name in PROFILE_COUNTERS: PROFILE_TEXTS[name].set_value(int(counters.get(name, 0)))
+                histogram = PROFILER.histograms.get('cell occupancy')
+                if histogram is not None:
+                    # Empty cells, mean and max boids of the occupied ones
+                    occupied = sum(histogram[1:])
+                    mean = sum(k * c for k, c in enumerate(histogram)) / max(occupied, 1)
+                    PROFILE_TEXTS['occupancy'].set_value(f'{histogram[0]} empty, {mean:.1f} mean, {len(histogram) - 1} max')
+            COMPOSITOR.draw_texts(TEXTS + (list(PROFILE_TEXTS.values()) if SHOW_PROFILE else []),
+                                  py.time.get_ticks() / 1000.0)
 
         # ================ KEYS ================
         key = py.key.get_pressed()
-        if key[py.K_q]:
-            remove_boid()
-        if key[py.K_r]:
-            for boid in BOIDS:
-                boid.change_velocity_direction(250*deltaTime)
-        if key[py.K_t]:
-            for boid in BOIDS:
-                boid.change_velocity_direction(random.uniform(-50,50))
-        if key[py.K_a]:
-            for boid in BOIDS:
-                boid.move_left(deltaTime=deltaTime)
-        if key[py.K_d]:
-            for boid in BOIDS:
-                boid.move_right(deltaTime=deltaTime)
-        if key[py.K_w]:
-            for boid in BOIDS:
-                boid.move_up(deltaTime=deltaTime)
-        if key[py.K_s]:
-            for boid in BOIDS:
-                boid.move_down(deltaTime=deltaTime)
+        if PLAYER is not None:
+            if key[py.K_LEFT]:
+                PLAYER.seek(-5*frameTime)
+            if key[py.K_RIGHT]:
+                PLAYER.seek(5*frameTime)
+        else:
+            if key[py.K_q]:
+                remove_boids()
+            if key[py.K_r]:
+                FLOCK.change_velocity_direction(250*deltaTime)
+            if key[py.K_t]:
+                FLOCK.random_direction(50)
+            if key[py.K_a]:
+                FLOCK.move((-10*deltaTime, 0))
+            if key[py.K_d]:
+                FLOCK.move((10*deltaTime, 0))
+            if key[py.K_w]:
+                FLOCK.move((0, -10*deltaTime))
+            if key[py.K_s]:
+                FLOCK.move((0, 10*deltaTime))
 
         # ================ EVENT HANDLER LOOP ================
         events = py.event.get()
         for event in events:
             if event.type == py.QUIT: RUNNING_GAME = False; break
-            elif event.type == py.MOUSEBUTTONUP:
+            elif event.type == py.MOUSEBUTTONUP and PLAYER is None:
                 pos = py.mouse.get_pos()
-                add_boid(pos[0], pos[1])
+                if event.button == 3: add_obstacle(pos[0], pos[1])
+                elif event.button == 4: spawn_around(pos[0], pos[1])
+                elif event.button == 5: remove_boids(SCROLL_BOIDS)
+                else: add_boid(pos[0], pos[1])
 
             elif event.type == py.KEYUP:
                 if event.key == py.K_ESCAPE: RUNNING_GAME = False; break
+                if event.key == py.K_p:
+                    SHOW_PROFILE = not SHOW_PROFILE
+                    if trace is None: PROFILER.set_enabled(SHOW_PROFILE)
+                    if not SHOW_PROFILE: COMPOSITOR.hide_texts(PROFILE_TEXTS.values())
+                if event.key == py.K_c and FLOCK.obstacles is not None:
+                    FLOCK.clear_obstacles()
+                    COMPOSITOR.set_background(make_background())
+                if event.key == py.K_SPACE and PLAYER is not None:
+                    PLAYER.toggle_pause()
                 if event.key == py.K_1:
                     AlignmentText.set_value(not bool(AlignmentText.get_value()))
-                    for boid in BOIDS:
-                        boid.switch_alignment(bool(AlignmentText.get_value()))
+                    FLOCK.switch_alignment(bool(AlignmentText.get_value()))
                 if event.key == py.K_2:
                     CohesionText.set_value(not bool(CohesionText.get_value()))
-                    for boid in BOIDS:
-                        boid.switch_cohesion(bool(CohesionText.get_value()))
+                    FLOCK.switch_cohesion(bool(CohesionText.get_value()))
                 if event.key == py.K_3:
                     SeparationText.set_value(not bool(SeparationText.get_value()))
-                    for boid in BOIDS:
-                        boid.switch_separation(bool(SeparationText.get_value()))
+                    FLOCK.switch_separation(bool(SeparationText.get_value()))
 
         # ================ SLIDER PARAMS ================
         set_max_force(FORCESlider.getValue())
@@ -204,8 +324,18 @@ def main() -> None:
 
         SIMULATIONText.set_value(round(SIMULATIONSlider.getValue(),2))
 
-        pyw.update(events)
-        py.display.update()
+        with SPANS.span('display'):
+            pyw.update(events)
+            COMPOSITOR.present()
+        PROFILER.end_frame()
+        if GOVERNOR is not None:
+            decision = GOVERNOR.end_frame()
+            if decision is not None:
+                QUALITYText.set_value('full' if GOVERNOR.level == 0 else
+                                      f'level {GOVERNOR.level} ({decision["knob"]} {decision["to"]})')
+    FLOCK.close()
+    if RECORDER is not None: RECORDER.close()
+    if trace is not None: PROFILER.export_chrome_trace(trace)
     py.quit()
 
 